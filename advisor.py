@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+advisor.py - index advisor for the queries in app.py, main.py and the tools
+
+Collects every textual SQL statement in the given source files (string
+literals passed to ``text()`` / ``run()``) plus the paginated list queries
+built in app.py, runs each one under EXPLAIN (ANALYZE, BUFFERS) inside a
+transaction that is always rolled back, and reports:
+
+  * sequential scans over tables larger than --min-rows, with the filter
+    that was applied and how many rows it threw away;
+  * foreign keys whose referencing columns are not covered by the leading
+    columns of any index (every ON DELETE CASCADE on them is a full scan).
+
+    python advisor.py                    # every file in DEFAULT_FILES
+    python advisor.py app.py --min-rows 0
+"""
+
+import argparse
+import ast
+import json
+import re
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from db import make_engine
+
+DEFAULT_FILES = ("app.py", "main.py", "profiles.py", "aggregates.py")
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+# Values bound to named parameters when a statement is explained. Anything
+# not listed here is bound as 1.
+SAMPLE_PARAMS = {
+    "e": "nobody@example.com",
+    "email": "nobody@example.com",
+    "q": "care",
+    "rct": "elderly",
+    "ct": "elderly",
+    "g": "female",
+    "limit": 51,
+    "ids": [1],
+    "town": "Astana",
+    "status": "accepted",
+    "from_statuses": ["pending"],
+    "first": "2025-01-06",
+    "last": "2025-01-13",
+    "since": "2025-01-01",
+    "after_date": "2025-01-13",
+}
+
+BIND_RE = re.compile(r"(?<![:\w]):(\w+)")
+
+UNINDEXED_FKS_SQL = """
+    SELECT c.conrelid::regclass AS table_name,
+           c.conname,
+           array_agg(a.attname ORDER BY k.ord) AS columns
+    FROM pg_constraint c
+    CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord)
+    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+    WHERE c.contype = 'f'
+      AND c.connamespace = 'public'::regnamespace
+      AND NOT EXISTS (
+          SELECT 1 FROM pg_index i
+          WHERE i.indrelid = c.conrelid
+            AND (i.indkey::int2[])[0:cardinality(c.conkey) - 1] @> c.conkey
+      )
+    GROUP BY c.conrelid, c.conname
+    ORDER BY 1, 2
+"""
+
+
+SQL_VERBS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER")
+
+
+def _is_sql(value):
+    words = value.split(None, 1)
+    return bool(words) and words[0] in SQL_VERBS
+
+
+def extract_queries(path):
+    """Yield (label, sql) for every string literal passed to text() or run() in ``path``,
+    and every SQL string in main.py's Mutation(...) / Report(...) step definitions."""
+    tree = ast.parse(Path(path).read_text(), filename=str(path))
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and node.args):
+            continue
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+        arg = node.args[0]
+        if name in ("text", "run") and isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            yield f"{Path(path).name}:{node.lineno}", arg.value
+        elif name in ("Mutation", "Report"):
+            for value in node.args + [k.value for k in node.keywords]:
+                if isinstance(value, ast.Constant) and isinstance(value.value, str) and _is_sql(value.value):
+                    yield f"{Path(path).name}:{value.lineno}", value.value
+
+
+def builder_queries():
+    """The keyset list queries in app.py are assembled at runtime, so build them explicitly."""
+    import app
+    cases = [
+        ("jobs", app.jobs_query({})),
+        ("jobs?type", app.jobs_query({"required_caregiving_type": "elderly", "after": "1"})),
+        ("applications(caregiver)", app.applications_query({}, 1, "caregiver")),
+        ("applications(member)", app.applications_query({"after": "1.1"}, 2, "member")),
+        ("appointments", app.appointments_query({}, 1)),
+        ("caregivers?type", app.caregivers_query({"caregiving_type": "elderly", "after": "1"})),
+    ]
+    for label, (sql, params, _key) in cases:
+        yield f"app.py:{label}", sql, params
+
+
+def sample_params(sql):
+    return {name: SAMPLE_PARAMS.get(name, 1) for name in BIND_RE.findall(sql)}
+
+
+def walk_plan(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from walk_plan(child)
+
+
+def explain(conn, sql, params):
+    res = conn.execute(text("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql), params).scalar()
+    plan = res if isinstance(res, list) else json.loads(res)
+    return plan[0]
+
+
+def table_sizes(conn):
+    rows = conn.execute(text("""
+        SELECT relname, reltuples::bigint FROM pg_class
+        WHERE relkind IN ('r', 'p') AND relnamespace = 'public'::regnamespace
+    """))
+    return {name: n for name, n in rows}
+
+
+def seq_scan_findings(plan, sizes, min_rows):
+    for node in walk_plan(plan["Plan"]):
+        if node["Node Type"] != "Seq Scan":
+            continue
+        rel = node.get("Relation Name")
+        if sizes.get(rel, 0) < min_rows:
+            continue
+        yield {
+            "relation": rel,
+            "filter": node.get("Filter"),
+            "actual_rows": node.get("Actual Rows"),
+            "rows_removed": node.get("Rows Removed by Filter", 0),
+            "shared_hit": node.get("Shared Hit Blocks", 0),
+            "shared_read": node.get("Shared Read Blocks", 0),
+        }
+
+
+def advise(files, min_rows):
+    engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+    queries = [(label, sql, sample_params(sql)) for f in files for label, sql in extract_queries(f)]
+    if "app.py" in {Path(f).name for f in files}:
+        queries.extend(builder_queries())
+
+    flagged = errors = skipped = 0
+    with engine.connect() as conn:
+        sizes = table_sizes(conn)
+        for label, sql, params in queries:
+            if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                skipped += 1
+                continue
+            trans = conn.begin()
+            try:
+                plan = explain(conn, sql, params)
+            except SQLAlchemyError as e:
+                errors += 1
+                reason = str(getattr(e, "orig", None) or e).strip().splitlines()[0]
+                print(f"\n{label}: could not explain ({reason})")
+                continue
+            finally:
+                # EXPLAIN ANALYZE executes writes; never keep them
+                trans.rollback()
+            findings = list(seq_scan_findings(plan, sizes, min_rows))
+            if not findings:
+                continue
+            flagged += 1
+            print(f"\n{label}  ({plan.get('Execution Time', 0):.2f} ms)")
+            print("   " + " ".join(sql.split())[:160])
+            for f in findings:
+                print(f"   Seq Scan on {f['relation']} (~{sizes.get(f['relation'], 0)} rows): "
+                      f"filter={f['filter']} returned={f['actual_rows']} removed={f['rows_removed']} "
+                      f"buffers hit={f['shared_hit']} read={f['shared_read']}")
+
+        print("\n-- Foreign keys without a supporting index --")
+        missing = conn.execute(text(UNINDEXED_FKS_SQL)).fetchall()
+        for table_name, conname, columns in missing:
+            print(f"   {table_name}.{conname}: ({', '.join(columns)})")
+        if not missing:
+            print("   (none)")
+
+    print(f"\n{len(queries)} statements: {flagged} with sequential scans, "
+          f"{errors} could not be explained, {skipped} skipped (DDL), {len(missing)} unindexed foreign keys")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", default=list(DEFAULT_FILES))
+    parser.add_argument("--min-rows", type=int, default=1000,
+                        help="ignore sequential scans on tables smaller than this (default 1000)")
+    args = parser.parse_args()
+    advise(args.files, args.min_rows)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+aggregates.py - check or rebuild the report summary tables
+
+job_applicant_count and caregiver_accepted_stats (migration 0004) are
+maintained by triggers. Appointments archived by `partitions.py archive`
+still count towards caregiver_accepted_stats, so archive.appointment is
+part of the recompute. `verify` recomputes both from the base tables and
+lists every row that differs; `rebuild` recomputes them from scratch under
+a SHARE lock on the base tables (writes wait, reads continue).
+
+    python aggregates.py verify      # exit status 1 if anything differs
+    python aggregates.py rebuild
+"""
+
+import sys
+
+from sqlalchemy import text
+from db import make_engine
+
+engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+
+RECOMPUTE_APPLICANTS = """
+    SELECT job_id, count(*) AS applicant_count
+    FROM job_application
+    GROUP BY job_id
+"""
+
+RECOMPUTE_ACCEPTED = """
+    SELECT caregiver_user_id, count(*) AS accepted_count, coalesce(sum(work_hours), 0) AS accepted_hours
+    FROM (SELECT caregiver_user_id, work_hours FROM appointment WHERE status = 'accepted'
+          UNION ALL
+          SELECT caregiver_user_id, work_hours FROM archive.appointment WHERE status = 'accepted') a
+    WHERE caregiver_user_id IS NOT NULL
+    GROUP BY caregiver_user_id
+"""
+
+# Rows that are zero on one side and missing on the other are equivalent.
+VERIFY_APPLICANTS = f"""
+    SELECT coalesce(s.job_id, r.job_id) AS job_id,
+           coalesce(s.applicant_count, 0) AS stored,
+           coalesce(r.applicant_count, 0) AS actual
+    FROM job_applicant_count s
+    FULL JOIN ({RECOMPUTE_APPLICANTS}) r ON r.job_id = s.job_id
+    WHERE coalesce(s.applicant_count, 0) <> coalesce(r.applicant_count, 0)
+    ORDER BY 1
+"""
+
+VERIFY_ACCEPTED = f"""
+    SELECT coalesce(s.caregiver_user_id, r.caregiver_user_id) AS caregiver_user_id,
+           coalesce(s.accepted_count, 0) AS stored_count, coalesce(r.accepted_count, 0) AS actual_count,
+           coalesce(s.accepted_hours, 0) AS stored_hours, coalesce(r.accepted_hours, 0) AS actual_hours
+    FROM caregiver_accepted_stats s
+    FULL JOIN ({RECOMPUTE_ACCEPTED}) r ON r.caregiver_user_id = s.caregiver_user_id
+    WHERE coalesce(s.accepted_count, 0) <> coalesce(r.accepted_count, 0)
+       OR coalesce(s.accepted_hours, 0) <> coalesce(r.accepted_hours, 0)
+    ORDER BY 1
+"""
+
+
+def verify(limit=20):
+    # one REPEATABLE READ snapshot, so both sides see the same data
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            applicants = conn.execute(text(VERIFY_APPLICANTS)).fetchall()
+            accepted = conn.execute(text(VERIFY_ACCEPTED)).fetchall()
+    for title, rows in (("job_applicant_count", applicants), ("caregiver_accepted_stats", accepted)):
+        print(f"-- {title}: {len(rows)} mismatched row(s)")
+        for r in rows[:limit]:
+            print("  ", tuple(r))
+    return not applicants and not accepted
+
+
+def rebuild():
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE job_application, appointment, archive.appointment IN SHARE MODE"))
+        conn.execute(text("DELETE FROM job_applicant_count"))
+        conn.execute(text(f"INSERT INTO job_applicant_count (job_id, applicant_count) {RECOMPUTE_APPLICANTS}"))
+        conn.execute(text("DELETE FROM caregiver_accepted_stats"))
+        conn.execute(text(f"""
+            INSERT INTO caregiver_accepted_stats (caregiver_user_id, accepted_count, accepted_hours)
+            {RECOMPUTE_ACCEPTED}
+        """))
+    print("Summary tables rebuilt.")
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if cmd == "verify":
+        sys.exit(0 if verify() else 1)
+    elif cmd == "rebuild":
+        rebuild()
+    else:
+        sys.exit(f"usage: {sys.argv[0]} [verify|rebuild]")
@@ -0,0 +1,163 @@
+"""
+api.py - versioned JSON API for the mobile client (/api/v1)
+
+The same lists as /jobs, /applications and /appointments, plus the
+caregiver directory, without the page layout around them. Each list runs
+the query builder of its HTML page with the same filters, keyset cursor
+and audience, and access goes through app.access_denied like the page
+decorators; only the answer to a refusal differs (401 / 403 JSON instead
+of a redirect or forbidden.html).
+
+    GET /api/v1/jobs?fields=job_id,date_posted&limit=200&after=<next>
+
+    {"fields": ["job_id", "date_posted"],
+     "rows": [[1, "2025-01-06"], [2, "2025-01-07"]],
+     "next": "2"}
+
+``fields`` picks columns from the list's whitelist (app.JOB_FIELDS, ...);
+only those are selected, and an unknown name is a 400 that lists the
+allowed ones. Rows are arrays in ``fields`` order, sliced straight from
+the result rows with no dict per row. ``next`` is the ``after`` cursor of
+the following page, null on the last one.
+
+The body is MessagePack for clients that send Accept: application/msgpack
+(when the msgpack package is installed), compact JSON otherwise. Bodies of
+COMPRESS_MIN_BYTES or more are brotli-compressed when the client accepts
+br and the brotli package is installed, gzip-compressed when it accepts
+gzip.
+"""
+
+import gzip
+import json
+
+from flask import Blueprint, Response, jsonify, request, session
+from sqlalchemy import text
+
+from app import (APPLICATION_FIELDS, APPOINTMENT_FIELDS, CAREGIVER_FIELDS, JOB_FIELDS, MEMBER_ROLES, PAGE_SIZE,
+                 access_denied, applications_query, appointments_query, caregivers_query, encode_cursor,
+                 jobs_query, read_db)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+API_MAX_PAGE = 500
+COMPRESS_MIN_BYTES = 1024   # smaller bodies fit in a packet or two anyway
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5          # close to gzip -6 in CPU, noticeably smaller
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+def refusal(roles=None):
+    """The page decorators' access rules, answered in JSON: a 401 / 403 response, or None."""
+    denied = access_denied(session, roles)
+    if denied == "login":
+        return jsonify(error="login required"), 401
+    if denied:
+        return jsonify(error="forbidden"), 403
+    return None
+
+
+# name -> (roles allowed (None: any signed-in user), field whitelist,
+#          fields the cursor is built from, query builder(args, size, fields))
+LISTS = {
+    "jobs": (None, JOB_FIELDS, ("job_id",),
+             lambda args, size, fields: jobs_query(args, size, fields)),
+    "applications": (None, APPLICATION_FIELDS, ("job_id", "caregiver_user_id"),
+                     lambda args, size, fields: applications_query(args, session["user_id"],
+                                                                   session.get("role"), size, fields)),
+    "appointments": (None, APPOINTMENT_FIELDS, ("appointment_date", "appointment_id"),
+                     lambda args, size, fields: appointments_query(args, session["user_id"], size, fields)),
+    # rates and profiles are shown to members choosing a caregiver (appointment form), not to caregivers
+    "caregivers": (MEMBER_ROLES, CAREGIVER_FIELDS, ("caregiver_user_id",),
+                   lambda args, size, fields: caregivers_query(args, size, fields)),
+}
+
+
+def parse_fields(raw, allowed):
+    """Requested field names in order (all of ``allowed`` if none), or None if any is unknown."""
+    if not raw:
+        return list(allowed)
+    fields = list(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    if not fields or any(f not in allowed for f in fields):
+        return None
+    return fields
+
+
+def _limit_arg():
+    try:
+        return min(max(int(request.args.get("limit", PAGE_SIZE)), 1), API_MAX_PAGE)
+    except ValueError:
+        return PAGE_SIZE
+
+
+# ---------------------------------------------------------------------------
+# Encoding
+# ---------------------------------------------------------------------------
+
+def encode(payload):
+    """(body, mimetype): MessagePack if the client prefers it and msgpack is installed, else JSON."""
+    if msgpack is not None and request.accept_mimetypes.best_match(("application/json",) + MSGPACK_TYPES) \
+            in MSGPACK_TYPES:
+        return msgpack.packb(payload, default=str, use_bin_type=True), "application/msgpack"
+    body = json.dumps(payload, default=str, ensure_ascii=False, separators=(",", ":"))
+    return body.encode(), "application/json"
+
+
+def compress(body):
+    """(body, Content-Encoding or None) as negotiated from Accept-Encoding."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if accepted["gzip"]:
+        return gzip.compress(body, GZIP_LEVEL, mtime=0), "gzip"
+    return body, None
+
+
+def api_response(payload, status=200):
+    body, mimetype = encode(payload)
+    body, encoding = compress(body)
+    resp = Response(body, status=status, mimetype=mimetype)
+    resp.headers["Vary"] = "Accept, Accept-Encoding, Cookie"
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    return resp
+
+
+# ---------------------------------------------------------------------------
+# Lists
+# ---------------------------------------------------------------------------
+
+@api.route("/<name>")
+def list_view(name):
+    if name not in LISTS:
+        return jsonify(error=f"unknown list: {name}"), 404
+    roles, allowed, cursor_fields, build = LISTS[name]
+    refused = refusal(roles)
+    if refused:
+        return refused
+    fields = parse_fields(request.args.get("fields"), allowed)
+    if fields is None:
+        return jsonify(error="unknown field in 'fields'", allowed=list(allowed)), 400
+    size = _limit_arg()
+    # the cursor's columns are selected even when not asked for, and cut off below
+    selected = fields + [f for f in cursor_fields if f not in fields]
+    sql, params, key = build(request.args, size, selected)
+    with read_db() as db:
+        rows = db.execute(text(sql), params).all()   # LIMIT size + 1
+    next_cursor = None
+    if len(rows) > size:
+        del rows[size:]
+        next_cursor = encode_cursor(*key(rows[-1]._mapping))
+    n = len(fields)
+    return api_response({"fields": fields, "rows": [r[:n] for r in rows], "next": next_cursor})
@@ -1,47 +1,98 @@
-from flask import Flask, render_template, request, redirect, session
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
+from flask import Blueprint, Flask, Response, jsonify, render_template, request, redirect, session, stream_template, stream_with_context
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from datetime import date, datetime, time, timedelta
 from functools import wraps
-from config import DB_URL
-
-app = Flask(__name__, template_folder="templates")
-app.secret_key = "change-this-in-production"
-
-engine = create_engine(DB_URL)
-DB = sessionmaker(bind=engine, expire_on_commit=False)
+import queue
+from cache import cache, cached, changed, fragment, wrote_within
+from config import DB_READ_YOUR_WRITES_SECONDS, INTERNAL_TOKEN, JOB_FEED_ENABLED, JOB_FEED_MAX_SUBSCRIBERS
+from db import DB, get_engine, get_replicas, pool_status, read_session, warm_pool
+from exports import EXPORTS, FORMATS, stream_export
+from instrumentation import instrument, render_metrics
+from jobfeed import feed, format_event
+import matching
+from profiles import upsert_caregiver, upsert_member
+from search import search_jobs
+from tasks import enqueue, enqueue_many
+from templating import bytecode_cache, load_all
+
+# every route lives on this blueprint; create_app() at the bottom builds the app
+views = Blueprint("views", __name__)
+
+PAGE_SIZE = 50
+CAREGIVING_TYPES = ("babysitter", "elderly", "playmate")
+
+
+def read_db():
+    """Session for a read-only view: a replica, or the primary right after this user wrote.
+
+    Reading from the primary for DB_READ_YOUR_WRITES_SECONDS after changed()
+    means the redirect that follows a write shows the write, however far
+    behind the replica is.
+    """
+    if wrote_within(DB_READ_YOUR_WRITES_SECONDS):
+        return DB()
+    return read_session()
 
 
 # ---------------------------------------------------------------------------
 # Auth decorators
 # ---------------------------------------------------------------------------
 
-def login_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if "user_id" not in session:
-            return redirect("/login")
-        return f(*args, **kwargs)
-    return decorated
+MEMBER_ROLES = ("member", "both")
+CAREGIVER_ROLES = ("caregiver", "both")
 
 
-def member_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if "user_id" not in session:
-            return redirect("/login")
-        if session.get("role") not in ("member", "both"):
-            return render_template("forbidden.html"), 403
-        return f(*args, **kwargs)
-    return decorated
+def access_denied(sess, roles=None):
+    """Why ``sess`` may not proceed: "login", "forbidden", or None if it may.
+
+    Shared by the decorators below and the async read path in asgi.py.
+    """
+    if "user_id" not in sess:
+        return "login"
+    if roles and sess.get("role") not in roles:
+        return "forbidden"
+    return None
+
+
+def _requires(roles=None):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            denied = access_denied(session, roles)
+            if denied == "login":
+                return redirect("/login")
+            if denied:
+                return render_template("forbidden.html"), 403
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+def role_flags(sess):
+    """Template flags for ``sess``, computed once per render instead of per row."""
+    role = sess.get("role")
+    return {"is_member": role in MEMBER_ROLES, "is_caregiver": role in CAREGIVER_ROLES,
+            "current_user_id": sess.get("user_id")}
+
 
+@views.app_context_processor
+def _role_flags():
+    return role_flags(session)
 
-def caregiver_required(f):
+
+login_required = _requires()
+member_required = _requires(MEMBER_ROLES)
+caregiver_required = _requires(CAREGIVER_ROLES)
+
+
+def internal_only(f):
+    """Operational endpoints: localhost, or a matching X-Internal-Token header."""
     @wraps(f)
     def decorated(*args, **kwargs):
-        if "user_id" not in session:
-            return redirect("/login")
-        if session.get("role") not in ("caregiver", "both"):
+        local = request.remote_addr in ("127.0.0.1", "::1")
+        token_ok = INTERNAL_TOKEN and request.headers.get("X-Internal-Token") == INTERNAL_TOKEN
+        if not (local or token_ok):
             return render_template("forbidden.html"), 403
         return f(*args, **kwargs)
     return decorated
@@ -51,76 +102,8 @@ def caregiver_required(f):
 # DB helpers
 # ---------------------------------------------------------------------------
 
-def normalize_hourly_rate(raw):
-    if not raw:
-        return None
-    try:
-        return int(round(float(raw) / 100) * 100)
-    except (ValueError, TypeError):
-        return None
-
-
-def upsert_member(db, user_id, form):
-    exists = db.execute(
-        text("SELECT 1 FROM member WHERE member_user_id = :uid"), {"uid": user_id}
-    ).fetchone()
-    if exists:
-        db.execute(text("""
-            UPDATE member SET house_rules = :hr, dependent_description = :dd
-            WHERE member_user_id = :uid
-        """), {"hr": form.get("house_rules"), "dd": form.get("dependent_description"), "uid": user_id})
-    else:
-        db.execute(text("""
-            INSERT INTO member (member_user_id, house_rules, dependent_description)
-            VALUES (:uid, :hr, :dd)
-        """), {"uid": user_id, "hr": form.get("house_rules"), "dd": form.get("dependent_description")})
-    _upsert_address(db, user_id, form)
-
-
-def _upsert_address(db, user_id, form):
-    hn, st, tn = form.get("house_number"), form.get("street"), form.get("town")
-    addr = db.execute(
-        text("SELECT 1 FROM address WHERE member_user_id = :uid"), {"uid": user_id}
-    ).fetchone()
-    if addr:
-        db.execute(text("""
-            UPDATE address SET house_number = :hn, street = :st, town = :tn
-            WHERE member_user_id = :uid
-        """), {"hn": hn, "st": st, "tn": tn, "uid": user_id})
-    elif hn or st or tn:
-        db.execute(text("""
-            INSERT INTO address (member_user_id, house_number, street, town)
-            VALUES (:uid, :hn, :st, :tn)
-        """), {"uid": user_id, "hn": hn, "st": st, "tn": tn})
-
-
-def upsert_caregiver(db, user_id, form):
-    gender = form.get("gender")
-    caregiving_type = form.get("caregiving_type")
-    hourly_rate = normalize_hourly_rate(form.get("hourly_rate"))
-    exists = db.execute(
-        text("SELECT 1 FROM caregiver WHERE caregiver_user_id = :uid"), {"uid": user_id}
-    ).fetchone()
-    if exists:
-        db.execute(text("""
-            UPDATE caregiver SET gender = :g, caregiving_type = :ct, hourly_rate = :hr
-            WHERE caregiver_user_id = :uid
-        """), {"g": gender, "ct": caregiving_type, "hr": hourly_rate, "uid": user_id})
-    else:
-        db.execute(text("""
-            INSERT INTO caregiver (caregiver_user_id, gender, caregiving_type, hourly_rate)
-            VALUES (:uid, :g, :ct, :hr)
-        """), {"uid": user_id, "g": gender, "ct": caregiving_type, "hr": hourly_rate})
-
-
 def delete_member_cascade(db, user_id):
-    db.execute(text("DELETE FROM appointment WHERE member_user_id = :uid"), {"uid": user_id})
-    db.execute(text("""
-        DELETE FROM job_application
-        WHERE job_id IN (SELECT job_id FROM job WHERE member_user_id = :uid)
-    """), {"uid": user_id})
-    db.execute(text("DELETE FROM job WHERE member_user_id = :uid"), {"uid": user_id})
-    db.execute(text("DELETE FROM address WHERE member_user_id = :uid"), {"uid": user_id})
+    # ON DELETE CASCADE removes the address, jobs (and their applications) and appointments
     db.execute(text("DELETE FROM member WHERE member_user_id = :uid"), {"uid": user_id})
 
 
@@ -132,6 +115,90 @@ def delete_caregiver_cascade(db, user_id):
         db.execute(text("DELETE FROM caregiver WHERE caregiver_user_id = :uid"), {"uid": user_id})
 
 
+BATCH_LIMIT = 1000
+
+# new status -> statuses it may be reached from; none of these can create an
+# overlap, so a batch never trips appointment_no_overlap halfway through
+STATUS_TRANSITIONS = {
+    "accepted": ("pending",),
+    "declined": ("pending", "accepted"),
+}
+
+
+def parse_ids(values):
+    """Split raw id values into (ints, invalid) keeping first-seen order and dropping repeats."""
+    if not isinstance(values, (list, tuple)):
+        return [], [values]
+    ids, invalid = [], []
+    for v in values:
+        try:
+            i = int(v)
+        except (TypeError, ValueError):
+            invalid.append(v)
+            continue
+        if i not in ids:
+            ids.append(i)
+    return ids, invalid
+
+
+def apply_to_jobs(db, cid, job_ids):
+    """Apply caregiver ``cid`` to every job in ``job_ids`` with one INSERT.
+
+    Returns {job_id: (result, member_user_id)} where result is "applied",
+    "already_applied" or "not_found".
+    """
+    rows = db.execute(text("""
+        WITH req AS (SELECT DISTINCT unnest(CAST(:ids AS int[])) AS job_id),
+        ins AS (
+            INSERT INTO job_application (caregiver_user_id, job_id, date_applied)
+            SELECT :cid, j.job_id, CURRENT_DATE
+            FROM req JOIN job j ON j.job_id = req.job_id
+            ON CONFLICT (caregiver_user_id, job_id) DO NOTHING
+            RETURNING job_id
+        )
+        SELECT req.job_id, j.member_user_id,
+               CASE WHEN j.job_id IS NULL THEN 'not_found'
+                    WHEN ins.job_id IS NULL THEN 'already_applied'
+                    ELSE 'applied' END AS result
+        FROM req
+        LEFT JOIN job j ON j.job_id = req.job_id
+        LEFT JOIN ins ON ins.job_id = req.job_id
+    """), {"cid": cid, "ids": job_ids}).all()
+    return {r.job_id: (r.result, r.member_user_id) for r in rows}
+
+
+def set_appointment_status(db, cid, appointment_ids, status):
+    """Move caregiver ``cid``'s appointments to ``status`` with one UPDATE.
+
+    Returns {appointment_id: (result, member_user_id)} where result is
+    "updated", "unchanged", "invalid_transition", "forbidden" or
+    "not_found". The outer SELECT reads the pre-update snapshot, so it
+    explains the rows the UPDATE skipped.
+    """
+    rows = db.execute(text("""
+        WITH req AS (SELECT DISTINCT unnest(CAST(:ids AS int[])) AS appointment_id),
+        upd AS (
+            UPDATE appointment a SET status = :status
+            FROM req
+            WHERE a.appointment_id = req.appointment_id
+              AND a.caregiver_user_id = :cid
+              AND a.status = ANY(CAST(:from_statuses AS varchar[]))
+            RETURNING a.appointment_id
+        )
+        SELECT req.appointment_id, a.member_user_id,
+               CASE WHEN a.appointment_id IS NULL THEN 'not_found'
+                    WHEN a.caregiver_user_id <> :cid THEN 'forbidden'
+                    WHEN upd.appointment_id IS NOT NULL THEN 'updated'
+                    WHEN a.status = :status THEN 'unchanged'
+                    ELSE 'invalid_transition' END AS result
+        FROM req
+        LEFT JOIN appointment a ON a.appointment_id = req.appointment_id
+        LEFT JOIN upd ON upd.appointment_id = req.appointment_id
+    """), {"cid": cid, "ids": appointment_ids, "status": status,
+           "from_statuses": list(STATUS_TRANSITIONS[status])}).all()
+    return {r.appointment_id: (r.result, r.member_user_id) for r in rows}
+
+
 def get_user_role(db, uid):
     is_c = db.execute(text("SELECT 1 FROM caregiver WHERE caregiver_user_id = :uid"), {"uid": uid}).fetchone()
     is_m = db.execute(text("SELECT 1 FROM member WHERE member_user_id = :uid"), {"uid": uid}).fetchone()
@@ -144,6 +211,235 @@ def get_user_role(db, uid):
     return "unknown"
 
 
+# ---------------------------------------------------------------------------
+# Keyset pagination
+# ---------------------------------------------------------------------------
+
+def encode_cursor(*values):
+    return ".".join(str(v) for v in values)
+
+
+def parse_cursor(raw, *types):
+    """Decode an ``after`` cursor into a tuple, or None if it is missing or malformed."""
+    if not raw:
+        return None
+    parts = raw.split(".")
+    if len(parts) != len(types):
+        return None
+    try:
+        return tuple(t(p) for t, p in zip(types, parts))
+    except ValueError:
+        return None
+
+
+def _where(clauses):
+    return ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+
+def select_fields(columns, fields=None):
+    """SELECT list for ``fields`` (default: every name in ``columns``), each expression aliased to its name."""
+    return ", ".join(f"{columns[f]} AS {f}" for f in (fields or columns))
+
+
+class KeysetPage:
+    """Yields at most ``size`` rows from a LIMIT size + 1 result without materializing it.
+
+    Once the extra row is seen, ``next_cursor`` holds the cursor of the last
+    row yielded, so templates can render the "next page" link after the loop.
+    """
+
+    def __init__(self, rows, size, key):
+        self._rows = rows
+        self.size = size
+        self.key = key
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for n, row in enumerate(self._rows):
+            if n == self.size:
+                self.next_cursor = encode_cursor(*self.key(last))
+                break
+            last = row
+            yield row
+
+
+def stream_page(template, sql, params, key, size=PAGE_SIZE, **context):
+    """Render ``template`` while rows are still being read from the database.
+
+    The session stays open for the lifetime of the response body; the page
+    is exposed to the template as ``page`` together with the active filters.
+    """
+    filters = {k: v for k, v in request.args.items() if k != "after" and v}
+    db_session = read_db()   # decided now, while the request's session is at hand
+
+    def generate():
+        with db_session as db:
+            rows = db.execute(text(sql), params).mappings()
+            page = KeysetPage(rows, size, key)
+            yield from stream_template(template, page=page, filters=filters, **context)
+
+    return Response(stream_with_context(generate()))
+
+
+# list columns: name -> expression; the list pages select them all, the
+# JSON API (api.py) only the ones a client asks for
+JOB_FIELDS = {
+    "job_id": "j.job_id",
+    "member_user_id": "j.member_user_id",
+    "required_caregiving_type": "j.required_caregiving_type",
+    "other_requirements": "j.other_requirements",
+    "date_posted": "j.date_posted",
+    "member_name": "u.given_name || ' ' || u.surname",
+}
+
+APPLICATION_FIELDS = {
+    "job_id": "ja.job_id",
+    "caregiver_user_id": "ja.caregiver_user_id",
+    "date_applied": "ja.date_applied",
+    "caregiver_name": "u.given_name || ' ' || u.surname",
+    "required_caregiving_type": "j.required_caregiving_type",
+    "member_user_id": "j.member_user_id",
+}
+
+APPOINTMENT_FIELDS = {
+    "appointment_id": "a.appointment_id",
+    "caregiver_user_id": "a.caregiver_user_id",
+    "member_user_id": "a.member_user_id",
+    "appointment_date": "a.appointment_date",
+    "appointment_time": "a.appointment_time",
+    "work_hours": "a.work_hours",
+    "status": "a.status",
+    "caregiver_name": "cu.given_name || ' ' || cu.surname",
+    "member_name": "mu.given_name || ' ' || mu.surname",
+}
+
+CAREGIVER_FIELDS = {
+    "caregiver_user_id": "c.caregiver_user_id",
+    "name": "u.given_name || ' ' || u.surname",
+    "city": "u.city",
+    "gender": "c.gender",
+    "caregiving_type": "c.caregiving_type",
+    "hourly_rate": "c.hourly_rate",
+    "profile_description": "u.profile_description",
+}
+
+
+def jobs_query(args, size=PAGE_SIZE, fields=None):
+    clauses, params = [], {"limit": size + 1}
+    after = parse_cursor(args.get("after"), int)
+    if after:
+        clauses.append("j.job_id > :after_id")
+        params["after_id"] = after[0]
+    rct = args.get("required_caregiving_type")
+    if rct in CAREGIVING_TYPES:
+        clauses.append("j.required_caregiving_type = :rct")
+        params["rct"] = rct
+    town = (args.get("town") or "").strip()
+    if town:
+        # any spelling or former name of the town, via locality_alias
+        clauses.append("""j.member_user_id IN (
+            SELECT a.member_user_id FROM address a
+            WHERE a.locality_id = (SELECT locality_id FROM locality_alias WHERE alias_key = locality_key(:town)))""")
+        params["town"] = town
+    sql = f"""
+        SELECT {select_fields(JOB_FIELDS, fields)}
+        FROM job j
+        LEFT JOIN app_user u ON u.user_id = j.member_user_id
+        {_where(clauses)}
+        ORDER BY j.job_id
+        LIMIT :limit
+    """
+    return sql, params, lambda r: (r["job_id"],)
+
+
+def applications_query(args, uid, role, size=PAGE_SIZE, fields=None):
+    params = {"uid": uid, "limit": size + 1}
+    if role in CAREGIVER_ROLES:
+        # (caregiver_user_id, job_id) is the primary key, so job_id alone is unique here
+        clauses = ["ja.caregiver_user_id = :uid"]
+        after = parse_cursor(args.get("after"), int)
+        if after:
+            clauses.append("ja.job_id > :after_job")
+            params["after_job"] = after[0]
+        order = "ja.job_id"
+        key = lambda r: (r["job_id"],)
+    else:
+        clauses = ["j.member_user_id = :uid"]
+        after = parse_cursor(args.get("after"), int, int)
+        if after:
+            clauses.append("(ja.job_id, ja.caregiver_user_id) > (:after_job, :after_cg)")
+            params["after_job"], params["after_cg"] = after
+        order = "ja.job_id, ja.caregiver_user_id"
+        key = lambda r: (r["job_id"], r["caregiver_user_id"])
+    sql = f"""
+        SELECT {select_fields(APPLICATION_FIELDS, fields)}
+        FROM job_application ja
+        LEFT JOIN app_user u ON u.user_id = ja.caregiver_user_id
+        LEFT JOIN job j ON j.job_id = ja.job_id
+        {_where(clauses)}
+        ORDER BY {order}
+        LIMIT :limit
+    """
+    return sql, params, key
+
+
+def appointments_query(args, uid, size=PAGE_SIZE, fields=None):
+    # One index-ordered branch per side of the appointment instead of
+    # "caregiver_user_id = :uid OR member_user_id = :uid", which can only be
+    # answered by collecting and sorting the user's whole history.
+    keyset, params = "", {"uid": uid, "limit": size + 1}
+    after = parse_cursor(args.get("after"), date.fromisoformat, int)
+    if after:
+        # the row comparison alone does not prune partitions; the plain bound on
+        # appointment_date skips the months after the cursor
+        keyset = ("AND appointment_date <= :after_date"
+                  " AND (appointment_date, appointment_id) < (:after_date, :after_id)")
+        params["after_date"], params["after_id"] = after
+    branch = """
+        (SELECT * FROM appointment
+         WHERE {col} = :uid {keyset}
+         ORDER BY appointment_date DESC, appointment_id DESC
+         LIMIT :limit)
+    """
+    sql = f"""
+        SELECT {select_fields(APPOINTMENT_FIELDS, fields)}
+        FROM ({branch.format(col="caregiver_user_id", keyset=keyset)}
+              UNION
+              {branch.format(col="member_user_id", keyset=keyset)}) a
+        LEFT JOIN app_user cu ON cu.user_id = a.caregiver_user_id
+        LEFT JOIN app_user mu ON mu.user_id = a.member_user_id
+        ORDER BY a.appointment_date DESC, a.appointment_id DESC
+        LIMIT :limit
+    """
+    return sql, params, lambda r: (r["appointment_date"], r["appointment_id"])
+
+
+def caregivers_query(args, size=PAGE_SIZE, fields=None):
+    clauses, params = [], {"limit": size + 1}
+    after = parse_cursor(args.get("after"), int)
+    if after:
+        clauses.append("c.caregiver_user_id > :after_id")
+        params["after_id"] = after[0]
+    ct = args.get("caregiving_type")
+    if ct in CAREGIVING_TYPES:
+        clauses.append("c.caregiving_type = :ct")
+        params["ct"] = ct
+    g = args.get("gender")
+    if g in ("male", "female", "other"):
+        clauses.append("c.gender = :g")
+        params["g"] = g
+    sql = f"""
+        SELECT {select_fields(CAREGIVER_FIELDS, fields)}
+        FROM caregiver c
+        JOIN app_user u ON u.user_id = c.caregiver_user_id
+        {_where(clauses)}
+        ORDER BY c.caregiver_user_id
+        LIMIT :limit
+    """
+    return sql, params, lambda r: (r["caregiver_user_id"],)
+
+
 def row_to_obj(row):
     if row is None:
         return None
@@ -158,7 +454,7 @@ def row_to_obj(row):
 # Login / Logout / Dashboard
 # ---------------------------------------------------------------------------
 
-@app.route("/login", methods=["GET", "POST"])
+@views.route("/login", methods=["GET", "POST"])
 def login():
     if "user_id" in session:
         return redirect("/dashboard")
@@ -169,7 +465,8 @@ def login():
             row = db.execute(
                 text("SELECT * FROM app_user WHERE email = :e LIMIT 1"), {"e": email}
             ).fetchone()
-        if not row or row._mapping["password"] != password:
+        # a blank password never signs in, whatever is stored
+        if not row or not password or row._mapping["password"] != password:
             return render_template("login.html", error="Invalid email or password.")
         uid = row._mapping["user_id"]
         with DB() as db:
@@ -181,14 +478,14 @@ def login():
     return render_template("login.html")
 
 
-@app.route("/logout")
+@views.route("/logout")
 def logout():
     session.clear()
     return redirect("/login")
 
 
-@app.route("/")
-@app.route("/dashboard")
+@views.route("/")
+@views.route("/dashboard")
 @login_required
 def dashboard():
     return render_template("dashboard.html")
@@ -198,7 +495,7 @@ def dashboard():
 # Sign up
 # ---------------------------------------------------------------------------
 
-@app.route("/signup", methods=["GET", "POST"])
+@views.route("/signup", methods=["GET", "POST"])
 def signup_choice():
     if request.method == "POST":
         role = request.form.get("role")
@@ -206,20 +503,19 @@ def signup_choice():
     return render_template("signup_choice.html")
 
 
-@app.route("/signup/caregiver", methods=["GET", "POST"])
+@views.route("/signup/caregiver", methods=["GET", "POST"])
 def signup_caregiver():
     if request.method == "POST":
         email = (request.form.get("email") or "").strip().lower()
         if not email:
             return render_template("signup_caregiver.html", error="Email is required.", form=request.form)
         with DB() as db:
-            if db.execute(text("SELECT 1 FROM app_user WHERE email = :e LIMIT 1"), {"e": email}).fetchone():
-                return render_template("signup_caregiver.html", error="Email already registered.", form=request.form)
             try:
                 res = db.execute(text("""
                     INSERT INTO app_user
                         (email, given_name, surname, city, phone_number, profile_description, password)
                     VALUES (:email, :gn, :sn, :city, :ph, :pd, :pw)
+                    ON CONFLICT (email) DO NOTHING
                     RETURNING user_id
                 """), {
                     "email": email,
@@ -230,17 +526,15 @@ def signup_caregiver():
                     "pd": request.form.get("profile_description") or None,
                     "pw": request.form.get("password") or "",
                 })
-                new_id = res.fetchone()[0]
-                db.execute(text("""
-                    INSERT INTO caregiver (caregiver_user_id, gender, caregiving_type, hourly_rate)
-                    VALUES (:uid, :g, :ct, :hr)
-                """), {
-                    "uid": new_id,
-                    "g": request.form.get("gender"),
-                    "ct": request.form.get("caregiving_type"),
-                    "hr": normalize_hourly_rate(request.form.get("hourly_rate")),
-                })
+                new_row = res.fetchone()
+                if new_row is None:
+                    db.rollback()
+                    return render_template("signup_caregiver.html", error="Email already registered.", form=request.form)
+                new_id = new_row[0]
+                upsert_caregiver(db, new_id, request.form)
+                enqueue(db, "caregiver_welcome", user_id=new_id)
                 db.commit()
+                changed("caregivers")
                 session["user_id"] = new_id
                 session["name"] = request.form.get("given_name") or ""
                 session["role"] = "caregiver"
@@ -252,20 +546,19 @@ def signup_caregiver():
     return render_template("signup_caregiver.html")
 
 
-@app.route("/signup/member", methods=["GET", "POST"])
+@views.route("/signup/member", methods=["GET", "POST"])
 def signup_member():
     if request.method == "POST":
         email = (request.form.get("email") or "").strip().lower()
         if not email:
             return render_template("signup_member.html", error="Email is required.", form=request.form)
         with DB() as db:
-            if db.execute(text("SELECT 1 FROM app_user WHERE email = :e LIMIT 1"), {"e": email}).fetchone():
-                return render_template("signup_member.html", error="Email already registered.", form=request.form)
             try:
                 res = db.execute(text("""
                     INSERT INTO app_user
                         (email, given_name, surname, city, phone_number, profile_description, password)
                     VALUES (:email, :gn, :sn, :city, :ph, NULL, :pw)
+                    ON CONFLICT (email) DO NOTHING
                     RETURNING user_id
                 """), {
                     "email": email,
@@ -275,7 +568,11 @@ def signup_member():
                     "ph": request.form.get("phone_number") or "",
                     "pw": request.form.get("password") or "",
                 })
-                new_id = res.fetchone()[0]
+                new_row = res.fetchone()
+                if new_row is None:
+                    db.rollback()
+                    return render_template("signup_member.html", error="Email already registered.", form=request.form)
+                new_id = new_row[0]
                 upsert_member(db, new_id, request.form)
                 db.commit()
                 session["user_id"] = new_id
@@ -293,20 +590,100 @@ def signup_member():
 # Jobs
 # ---------------------------------------------------------------------------
 
-@app.route("/jobs")
+@views.route("/jobs")
 @login_required
+@cached("jobs")
 def jobs():
-    with DB() as db:
-        rows = db.execute(text("""
-            SELECT j.*, u.given_name || ' ' || u.surname AS member_name
-            FROM job j
-            LEFT JOIN app_user u ON u.user_id = j.member_user_id
-            ORDER BY j.job_id
-        """)).mappings().all()
-    return render_template("jobs.html", jobs=rows)
+    sql, params, key = jobs_query(request.args)
+    return stream_page("jobs.html", sql, params, key, caregiving_types=CAREGIVING_TYPES,
+                       job_feed=JOB_FEED_ENABLED)
+
+
+@views.route("/jobs/search")
+@login_required
+@cached("jobs")
+def search_jobs_view():
+    q = request.args.get("q") or ""
+    rct = request.args.get("required_caregiving_type")
+    if rct not in CAREGIVING_TYPES:
+        rct = None
+    with read_db() as db:
+        results = search_jobs(db, q, caregiving_type=rct)
+    return render_template("jobs_search.html", q=q, results=results,
+                           required_caregiving_type=rct, caregiving_types=CAREGIVING_TYPES)
 
 
-@app.route("/jobs/create", methods=["GET", "POST"])
+STREAM_KEEPALIVE = 15        # seconds between comments on an idle feed
+STREAM_RETRY_MS = 3000       # browser reconnect delay
+STREAM_REPLAY_LIMIT = 500    # more missed postings than this: tell the client to reload
+
+
+@views.route("/jobs/stream")
+@login_required
+def job_stream():
+    """Server-Sent Events feed of job postings, edits and deletions (see jobfeed.py).
+
+    Takes the /jobs filters (required_caregiving_type, town). A client that
+    reconnects with Last-Event-ID (or passes ?last_id=) first receives the
+    jobs posted after that id, then the live events.
+
+    Each open feed holds a server thread, so past JOB_FEED_MAX_SUBSCRIBERS
+    in this process the answer is 204, which tells the browser not to
+    reconnect; the page then simply does not update live.
+    """
+    if not JOB_FEED_ENABLED or feed.subscriber_count() >= JOB_FEED_MAX_SUBSCRIBERS:
+        return Response(status=204)
+    rct = request.args.get("required_caregiving_type")
+    if rct not in CAREGIVING_TYPES:
+        rct = None
+    town = (request.args.get("town") or "").strip()
+    last_id = parse_cursor(request.headers.get("Last-Event-ID") or request.args.get("last_id"), int)
+    locality_id = None
+    if town:
+        with read_db() as db:
+            locality_id = db.execute(text("""
+                SELECT locality_id FROM locality_alias WHERE alias_key = locality_key(:town)
+            """), {"town": town}).scalar()
+    # subscribe before replaying, so nothing posted in between is missed
+    sub = feed.subscribe(caregiving_type=rct, locality_id=locality_id, by_town=bool(town))
+
+    def generate():
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            replayed = last_id[0] if last_id else 0
+            if last_id:
+                sql, params, _key = jobs_query({"after": encode_cursor(*last_id), "required_caregiving_type": rct,
+                                                "town": town}, size=STREAM_REPLAY_LIMIT)
+                with DB() as db:   # the primary: a replica may not have the newest postings yet
+                    rows = db.execute(text(sql), params).mappings().all()
+                if len(rows) > STREAM_REPLAY_LIMIT:
+                    yield format_event("reset", None, {})
+                    return
+                for row in rows:
+                    replayed = row["job_id"]
+                    yield format_event("job", row["job_id"], dict(row))
+            while True:
+                try:
+                    item = sub.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is None:   # closed by the feed; the browser reconnects and replays
+                    return
+                event, event_id, data = item
+                if event_id is not None and event_id <= replayed:
+                    continue
+                yield format_event(event, event_id, data)
+        finally:
+            feed.unsubscribe(sub)
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"   # nginx: pass events through unbuffered
+    return resp
+
+
+@views.route("/jobs/create", methods=["GET", "POST"])
 @member_required
 def create_job():
     if request.method == "POST":
@@ -320,15 +697,19 @@ def create_job():
                 "req": request.form.get("other_requirements"),
             })
             db.commit()
+        changed("jobs")
         return redirect("/jobs")
     return render_template("job_form.html", job=None, create=True)
 
 
-@app.route("/jobs/edit/<int:jid>", methods=["GET", "POST"])
+@views.route("/jobs/edit/<int:jid>", methods=["GET", "POST"])
 @member_required
 def edit_job(jid):
     with DB() as db:
-        row = db.execute(text("SELECT * FROM job WHERE job_id = :jid"), {"jid": jid}).fetchone()
+        row = db.execute(text("""
+            SELECT job_id, member_user_id, required_caregiving_type, other_requirements, date_posted
+            FROM job WHERE job_id = :jid
+        """), {"jid": jid}).fetchone()
     if not row or row._mapping["member_user_id"] != session["user_id"]:
         return render_template("forbidden.html"), 403
     if request.method == "POST":
@@ -342,84 +723,149 @@ def edit_job(jid):
                 "jid": jid,
             })
             db.commit()
+        matching.jobs.mark_dirty(jid)
+        # the job's type and requirements also show on every applicant's page
+        changed("jobs", "applications")
         return redirect("/jobs")
     return render_template("job_form.html", job=dict(row._mapping), create=False)
 
 
-@app.route("/jobs/delete/<int:jid>")
+@views.route("/jobs/delete/<int:jid>")
 @member_required
 def delete_job(jid):
     with DB() as db:
-        row = db.execute(text("SELECT member_user_id FROM job WHERE job_id = :jid"), {"jid": jid}).fetchone()
-        if not row or row._mapping["member_user_id"] != session["user_id"]:
+        # the ownership check is part of the DELETE; job_application rows go
+        # with the job (ON DELETE CASCADE)
+        deleted = db.execute(text("""
+            DELETE FROM job WHERE job_id = :jid AND member_user_id = :uid RETURNING job_id
+        """), {"jid": jid, "uid": session["user_id"]}).fetchone()
+        if deleted is None:
             return render_template("forbidden.html"), 403
-        db.execute(text("DELETE FROM job_application WHERE job_id = :jid"), {"jid": jid})
-        db.execute(text("DELETE FROM job WHERE job_id = :jid"), {"jid": jid})
         db.commit()
+    matching.jobs.mark_dirty(jid)
+    changed("jobs", "applications")
     return redirect("/jobs")
 
 
+def _top_k_arg():
+    try:
+        return min(max(int(request.args.get("k", matching.DEFAULT_TOP_K)), 1), 100)
+    except ValueError:
+        return matching.DEFAULT_TOP_K
+
+
+@views.route("/jobs/<int:jid>/matches")
+@member_required
+def job_matches(jid):
+    with read_db() as db:
+        job = db.execute(text("""
+            SELECT job_id, member_user_id, required_caregiving_type, other_requirements
+            FROM job WHERE job_id = :jid
+        """), {"jid": jid}).mappings().first()
+        if not job or job["member_user_id"] != session["user_id"]:
+            return render_template("forbidden.html"), 403
+        ranked = matching.match_caregivers(db, jid, k=_top_k_arg()) or []
+        details = {r["user_id"]: r for r in db.execute(text("""
+            SELECT u.user_id, u.given_name || ' ' || u.surname AS name, u.city,
+                   c.hourly_rate, coalesce(s.accepted_hours, 0) AS accepted_hours
+            FROM app_user u
+            JOIN caregiver c ON c.caregiver_user_id = u.user_id
+            LEFT JOIN caregiver_accepted_stats s ON s.caregiver_user_id = u.user_id
+            WHERE u.user_id = ANY(:ids)
+        """), {"ids": [cid for cid, _ in ranked]}).mappings()}
+    matches = [dict(details[cid], score=score) for cid, score in ranked if cid in details]
+    return render_template("job_matches.html", job=job, matches=matches)
+
+
+@views.route("/caregivers/me/recommended-jobs")
+@caregiver_required
+def recommended_jobs():
+    with read_db() as db:
+        ranked = matching.recommend_jobs(db, session["user_id"], k=_top_k_arg())
+        details = {r["job_id"]: r for r in db.execute(text("""
+            SELECT j.job_id, j.required_caregiving_type, j.other_requirements, j.date_posted,
+                   u.given_name || ' ' || u.surname AS member_name, a.town
+            FROM job j
+            LEFT JOIN app_user u ON u.user_id = j.member_user_id
+            LEFT JOIN address a ON a.member_user_id = j.member_user_id
+            WHERE j.job_id = ANY(:ids)
+        """), {"ids": [jid for jid, _ in ranked]}).mappings()}
+    recommended = [dict(details[jid], score=score) for jid, score in ranked if jid in details]
+    return render_template("recommended_jobs.html", jobs=recommended)
+
+
 # ---------------------------------------------------------------------------
 # Applications
 # ---------------------------------------------------------------------------
 
-@app.route("/applications")
+@views.route("/applications")
 @login_required
+@cached("applications", "applications:user:{uid}")
 def applications():
-    uid = session["user_id"]
-    role = session.get("role")
-    with DB() as db:
-        if role in ("caregiver", "both"):
-            rows = db.execute(text("""
-                SELECT ja.*, u.given_name || ' ' || u.surname AS caregiver_name,
-                       j.required_caregiving_type, j.member_user_id
-                FROM job_application ja
-                LEFT JOIN app_user u ON u.user_id = ja.caregiver_user_id
-                LEFT JOIN job j ON j.job_id = ja.job_id
-                WHERE ja.caregiver_user_id = :uid
-                ORDER BY ja.job_id
-            """), {"uid": uid}).mappings().all()
-        else:
-            rows = db.execute(text("""
-                SELECT ja.*, u.given_name || ' ' || u.surname AS caregiver_name,
-                       j.required_caregiving_type, j.member_user_id
-                FROM job_application ja
-                LEFT JOIN app_user u ON u.user_id = ja.caregiver_user_id
-                LEFT JOIN job j ON j.job_id = ja.job_id
-                WHERE j.member_user_id = :uid
-                ORDER BY ja.job_id
-            """), {"uid": uid}).mappings().all()
-    return render_template("applications.html", applications=rows)
-
-
-@app.route("/applications/create", methods=["GET", "POST"])
+    sql, params, key = applications_query(request.args, session["user_id"], session.get("role"))
+    return stream_page("applications.html", sql, params, key)
+
+
+@views.route("/applications/create", methods=["GET", "POST"])
 @caregiver_required
 def create_application():
     if request.method == "POST":
-        with DB() as db:
-            db.execute(text("""
-                INSERT INTO job_application (caregiver_user_id, job_id, date_applied)
-                VALUES (:cid, :jid, CURRENT_DATE)
-            """), {"cid": session["user_id"], "jid": request.form.get("job_id")})
-            db.commit()
+        job_ids, _ = parse_ids(request.form.getlist("job_id"))
+        _apply_and_invalidate(job_ids[:BATCH_LIMIT])
         return redirect("/applications")
-    with DB() as db:
+    with read_db() as db:
         jobs_list = db.execute(
             text("SELECT job_id, other_requirements FROM job ORDER BY job_id")
         ).mappings().all()
     return render_template("application_form.html", jobs=jobs_list)
 
 
-@app.route("/applications/delete/<int:cid>/<int:jid>")
+def _apply_and_invalidate(job_ids):
+    cid = session["user_id"]
+    with DB() as db:
+        results = apply_to_jobs(db, cid, job_ids) if job_ids else {}
+        enqueue_many(db, "application_received", [{"job_id": jid, "caregiver_user_id": cid}
+                                                  for jid, (result, _) in results.items() if result == "applied"])
+        db.commit()
+    owners = {owner for result, owner in results.values() if result == "applied"}
+    if owners:
+        matching.caregivers.mark_dirty(cid)
+        changed(f"applications:user:{cid}", *(f"applications:user:{o}" for o in owners))
+    return results
+
+
+@views.route("/applications/batch", methods=["POST"])
+@caregiver_required
+def batch_applications():
+    """JSON {"job_ids": [...]} -> per-job results, all in one transaction."""
+    payload = request.get_json(silent=True) or {}
+    job_ids, invalid = parse_ids(payload.get("job_ids") or [])
+    if not job_ids and not invalid:
+        return jsonify(error="job_ids is required"), 400
+    if len(job_ids) > BATCH_LIMIT:
+        return jsonify(error=f"at most {BATCH_LIMIT} job_ids per call"), 413
+    results = _apply_and_invalidate(job_ids)
+    items = [{"job_id": jid, "result": results[jid][0]} for jid in job_ids]
+    items += [{"job_id": v, "result": "invalid"} for v in invalid]
+    return jsonify(results=items)
+
+
+@views.route("/applications/delete/<int:cid>/<int:jid>")
 @caregiver_required
 def delete_application(cid, jid):
     if session["user_id"] != cid:
         return render_template("forbidden.html"), 403
     with DB() as db:
-        db.execute(text("""
-            DELETE FROM job_application WHERE caregiver_user_id = :cid AND job_id = :jid
-        """), {"cid": cid, "jid": jid})
+        owner = db.execute(text("""
+            WITH del AS (
+                DELETE FROM job_application WHERE caregiver_user_id = :cid AND job_id = :jid
+                RETURNING job_id
+            )
+            SELECT j.member_user_id FROM del JOIN job j ON j.job_id = del.job_id
+        """), {"cid": cid, "jid": jid}).scalar()
         db.commit()
+    matching.caregivers.mark_dirty(cid)
+    changed(f"applications:user:{cid}", f"applications:user:{owner}")
     return redirect("/applications")
 
 
@@ -427,52 +873,97 @@ def delete_application(cid, jid):
 # Appointments
 # ---------------------------------------------------------------------------
 
-@app.route("/appointments")
+@views.route("/appointments")
 @login_required
+@cached("appointments:user:{uid}")
 def appointments():
-    uid = session["user_id"]
-    with DB() as db:
-        rows = db.execute(text("""
-            SELECT a.*,
-                   cu.given_name || ' ' || cu.surname AS caregiver_name,
-                   mu.given_name || ' ' || mu.surname AS member_name
-            FROM appointment a
-            LEFT JOIN app_user cu ON cu.user_id = a.caregiver_user_id
-            LEFT JOIN app_user mu ON mu.user_id = a.member_user_id
-            WHERE a.caregiver_user_id = :uid OR a.member_user_id = :uid
-            ORDER BY a.appointment_date DESC
-        """), {"uid": uid}).mappings().all()
-    return render_template("appointments.html", appointments=rows)
-
-
-@app.route("/appointments/create", methods=["GET", "POST"])
+    sql, params, key = appointments_query(request.args, session["user_id"])
+    return stream_page("appointments.html", sql, params, key)
+
+
+@views.route("/appointments/create", methods=["GET", "POST"])
 @member_required
 def create_appointment():
     if request.method == "POST":
         with DB() as db:
-            db.execute(text("""
-                INSERT INTO appointment
-                    (caregiver_user_id, member_user_id, appointment_date, appointment_time, work_hours, status)
-                VALUES (:cid, :mid, :adate, :atime, :wh, 'pending')
-            """), {
-                "cid": request.form.get("caregiver_user_id"),
-                "mid": session["user_id"],
-                "adate": request.form.get("appointment_date"),
-                "atime": request.form.get("appointment_time"),
-                "wh": request.form.get("work_hours"),
-            })
-            db.commit()
+            try:
+                aid = db.execute(text("""
+                    INSERT INTO appointment
+                        (caregiver_user_id, member_user_id, appointment_date, appointment_time, work_hours, status)
+                    VALUES (:cid, :mid, :adate, :atime, :wh, 'pending')
+                    RETURNING appointment_id
+                """), {
+                    "cid": request.form.get("caregiver_user_id"),
+                    "mid": session["user_id"],
+                    "adate": request.form.get("appointment_date"),
+                    "atime": request.form.get("appointment_time"),
+                    "wh": request.form.get("work_hours"),
+                }).scalar()
+                enqueue(db, "appointment_requested", appointment_id=aid)
+                enqueue(db, "appointment_confirmation", appointment_id=aid)
+                db.commit()
+            except IntegrityError as e:
+                db.rollback()
+                # appointment_no_overlap (across months) or a partition's <partition>_no_overlap
+                constraint = getattr(getattr(e.orig, "diag", None), "constraint_name", None) or ""
+                if constraint.startswith("appointment") and constraint.endswith("_no_overlap"):
+                    error = "The caregiver is already booked at that time. Check their availability."
+                else:
+                    error = "Could not book the appointment, please check the details."
+                caregivers = fragment("caregiver_options", caregiver_options, tags=("caregivers",))
+                return render_template("appointment_form.html", caregivers=caregivers,
+                                       error=error, form=request.form), 409
+        changed(f"appointments:user:{request.form.get('caregiver_user_id')}",
+                f"appointments:user:{session['user_id']}")
         return redirect("/appointments")
-    with DB() as db:
-        caregivers = db.execute(text("""
+    caregivers = fragment("caregiver_options", caregiver_options, tags=("caregivers",))
+    return render_template("appointment_form.html", caregivers=caregivers)
+
+
+def caregiver_options():
+    with read_db() as db:
+        return [dict(r) for r in db.execute(text("""
             SELECT user_id, given_name || ' ' || surname AS name
             FROM app_user WHERE user_id IN (SELECT caregiver_user_id FROM caregiver)
             ORDER BY user_id
-        """)).mappings().all()
-    return render_template("appointment_form.html", caregivers=caregivers)
+        """)).mappings()]
 
 
-@app.route("/appointments/delete/<int:aid>")
+@views.route("/appointments/status", methods=["POST"])
+@caregiver_required
+def appointment_status():
+    """Accept or decline the caller's appointments in one UPDATE.
+
+    JSON {"status": "accepted"|"declined", "appointment_ids": [...]} gets
+    per-item results back; the form used on /appointments redirects there.
+    """
+    payload = request.get_json(silent=True)
+    if payload is None:
+        status = request.form.get("status")
+        ids, invalid = parse_ids(request.form.getlist("appointment_id"))
+    else:
+        status = payload.get("status")
+        ids, invalid = parse_ids(payload.get("appointment_ids") or [])
+    if status not in STATUS_TRANSITIONS:
+        return jsonify(error=f"status must be one of {', '.join(STATUS_TRANSITIONS)}"), 400
+    if len(ids) > BATCH_LIMIT:
+        return jsonify(error=f"at most {BATCH_LIMIT} appointment_ids per call"), 413
+    cid = session["user_id"]
+    with DB() as db:
+        results = set_appointment_status(db, cid, ids, status) if ids else {}
+        db.commit()
+    members = {member for result, member in results.values() if result == "updated"}
+    if members:
+        matching.caregivers.mark_dirty(cid)
+        changed(f"appointments:user:{cid}", *(f"appointments:user:{m}" for m in members))
+    if payload is None:
+        return redirect("/appointments")
+    items = [{"appointment_id": aid, "result": results[aid][0]} for aid in ids]
+    items += [{"appointment_id": v, "result": "invalid"} for v in invalid]
+    return jsonify(results=items)
+
+
+@views.route("/appointments/delete/<int:aid>")
 @login_required
 def delete_appointment(aid):
     with DB() as db:
@@ -487,8 +978,172 @@ def delete_appointment(aid):
             return render_template("forbidden.html"), 403
         db.execute(text("DELETE FROM appointment WHERE appointment_id = :aid"), {"aid": aid})
         db.commit()
+    changed(f"appointments:user:{m['caregiver_user_id']}", f"appointments:user:{m['member_user_id']}")
     return redirect("/appointments")
 
 
+# ---------------------------------------------------------------------------
+# Availability
+# ---------------------------------------------------------------------------
+
+WORKDAY_START = time(8)
+WORKDAY_END = time(20)
+AVAILABILITY_MAX_DAYS = 31
+
+
+def free_slots(booked, first_day, last_day):
+    """[(day, [(start, end), ...])] of free working time, given booked (start, end) datetimes sorted by start."""
+    days = []
+    i = 0
+    for n in range((last_day - first_day).days + 1):
+        day = first_day + timedelta(days=n)
+        cursor = datetime.combine(day, WORKDAY_START)
+        day_end = datetime.combine(day, WORKDAY_END)
+        free = []
+        while i < len(booked) and booked[i][1] <= cursor:
+            i += 1
+        j = i
+        while j < len(booked) and booked[j][0] < day_end:
+            start, end = booked[j]
+            if start > cursor:
+                free.append((cursor.time(), start.time()))
+            cursor = max(cursor, end)
+            j += 1
+        if cursor < day_end:
+            free.append((cursor.time(), WORKDAY_END))
+        days.append((day, free))
+    return days
+
+
+@views.route("/caregivers/<int:cid>/availability")
+@login_required
+def caregiver_availability(cid):
+    try:
+        first_day = date.fromisoformat(request.args.get("from") or date.today().isoformat())
+        last_day = date.fromisoformat(request.args.get("to") or (first_day + timedelta(days=6)).isoformat())
+    except ValueError:
+        return render_template("availability.html", error="Dates must be YYYY-MM-DD.", caregiver=None), 400
+    last_day = min(max(last_day, first_day), first_day + timedelta(days=AVAILABILITY_MAX_DAYS - 1))
+    with read_db() as db:
+        caregiver = db.execute(text("""
+            SELECT u.user_id, u.given_name || ' ' || u.surname AS name
+            FROM caregiver c JOIN app_user u ON u.user_id = c.caregiver_user_id
+            WHERE c.caregiver_user_id = :cid
+        """), {"cid": cid}).mappings().first()
+        if caregiver is None:
+            return render_template("availability.html", error="No such caregiver.", caregiver=None), 404
+        # the predicate matches the partitions' *_no_overlap constraints, so their GiST
+        # indexes serve the lookup; the date bound (a day back, for bookings that run
+        # past midnight) limits it to the partitions of the months shown
+        booked = db.execute(text("""
+            SELECT lower(time_range) AS starts, upper(time_range) AS ends
+            FROM appointment
+            WHERE caregiver_user_id = :cid AND status IN ('pending', 'accepted')
+              AND appointment_date >= CAST(:first AS date) - 1 AND appointment_date < :last
+              AND time_range && tsrange(:first, :last, '[)')
+            ORDER BY lower(time_range)
+        """), {"cid": cid, "first": first_day, "last": last_day + timedelta(days=1)}).all()
+    days = free_slots([(r.starts, r.ends) for r in booked], first_day, last_day)
+    return render_template("availability.html", caregiver=caregiver, days=days,
+                           first_day=first_day, last_day=last_day)
+
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+@views.route("/exports/<name>.<fmt>")
+@login_required
+def export(name, fmt):
+    """Stream an export; gzip-compressed when the client accepts it."""
+    builder = EXPORTS.get(name)
+    if builder is None or fmt not in FORMATS:
+        return Response("Unknown export.", status=404, mimetype="text/plain")
+    sql, params = builder(session["user_id"], session.get("role"), request.args)
+    gzip = "gzip" in request.accept_encodings
+    resp = Response(stream_with_context(stream_export(sql, params, fmt, gzip=gzip)),
+                    mimetype=FORMATS[fmt])
+    resp.headers["Content-Disposition"] = f'attachment; filename="{name}.{fmt}"'
+    resp.headers["Vary"] = "Accept-Encoding"
+    if gzip:
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
+
+# ---------------------------------------------------------------------------
+# Internal
+# ---------------------------------------------------------------------------
+
+@views.route("/internal/pool")
+@internal_only
+def internal_pool():
+    return jsonify(pool_status(get_engine()))
+
+
+@views.route("/internal/replicas")
+@internal_only
+def internal_replicas():
+    return jsonify(get_replicas().status())
+
+
+@views.route("/metrics")
+@internal_only
+def metrics():
+    gauges = {f"care_db_pool_{k}": v for k, v in pool_status(get_engine()).items() if isinstance(v, (int, float))}
+    gauges.update({f"care_cache_{k}": v for k, v in cache.stats().items()})
+    gauges["care_job_feed_subscribers"] = feed.subscriber_count()
+    replicas = get_replicas()
+    if replicas.replicas:
+        gauges["care_db_replicas_total"] = len(replicas.replicas)
+        gauges["care_db_replicas_up"] = sum(r.up for r in replicas.replicas)
+    return Response(render_metrics(gauges), mimetype="text/plain; version=0.0.4")
+
+
+# ---------------------------------------------------------------------------
+# Application factory
+# ---------------------------------------------------------------------------
+
+def create_app(warm=False):
+    """Build the web app.
+
+    Nothing connects to the database here; pools fill on first use in each
+    process. ``warm=True`` also compiles every template, which a pre-fork
+    server should do once in the master (see gunicorn.conf.py) so workers
+    inherit the compiled templates instead of each building them again.
+    """
+    app = Flask(__name__, template_folder="templates")
+    app.secret_key = "change-this-in-production"
+    app.jinja_options = {**app.jinja_options, "bytecode_cache": bytecode_cache()}
+    app.register_blueprint(views)
+    from api import api   # api.py builds on this module's queries and access rules
+    app.register_blueprint(api)
+    instrument(app, get_engine(), *get_replicas().engines)
+    if warm:
+        warm_up(app)
+    return app
+
+
+def warm_up(app, connections=0):
+    """Compile every template and open up to ``connections`` pooled connections per engine.
+
+    Run connections only in the process that will use them (a worker, after
+    the fork): a pool filled before fork() is thrown away in the children.
+    With ``connections`` the matching indices also start loading, so the
+    worker's first matching request does not wait for them.
+    """
+    started = datetime.now()
+    names = load_all(app.jinja_env)
+    opened = 0
+    if connections:
+        try:
+            opened = warm_pool(connections)
+        except SQLAlchemyError as e:
+            # not fatal: the pool fills on demand once the database is reachable
+            app.logger.warning("connection warm-up failed: %s", str(e).strip().splitlines()[0])
+        matching.warm_up()
+    app.logger.info("warmed up %d templates and %d connections in %.0f ms", len(names), opened,
+                    (datetime.now() - started).total_seconds() * 1000)
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app(warm=True).run(debug=True)
\ No newline at end of file
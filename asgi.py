@@ -0,0 +1,210 @@
+"""
+asgi.py - async serving path for the read-heavy pages
+
+    uvicorn asgi:application --workers 4
+
+/jobs, /applications and /appointments are served here on an AsyncEngine
+(asyncpg), so one worker can hold thousands of open client connections
+while their queries wait on Postgres. Every other request, and any
+non-GET, is handed to the Flask app unchanged through asgiref's
+WsgiToAsgi, so the write routes and their decorators keep working. The
+Flask fallback runs on a pool of WEB_THREADS threads (asgiref would run
+every such request on one shared thread, one at a time).
+
+The async views reuse app.py's query builders, templates and access rules
+(access_denied), and read the same signed Flask session cookie. A page is
+fetched in full (at most PAGE_SIZE + 1 rows) and the connection returned to
+the pool before the body is rendered and streamed, so a slow client never
+pins a database connection. These pages bypass the in-process response
+cache in cache.py.
+
+Reads follow read_db(): the primary for DB_READ_YOUR_WRITES_SECONDS after
+the user wrote, otherwise the replica db.py's router picks (health checks
+included), each engine having an asyncpg twin here. Their statements are
+counted into the same per-request metrics and Server-Timing header as the
+Flask routes (instrumentation.py).
+
+The live job feed (/jobs/stream) is not served here: a feed would hold one
+of the fallback threads for as long as its tab stays open. /jobs is
+rendered without it, and /jobs/stream answers 204 (do not reconnect);
+run gunicorn (gunicorn.conf.py) for live updates.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from jinja2 import Environment
+from sqlalchemy import text
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie
+
+from app import (CAREGIVING_TYPES, KeysetPage, PAGE_SIZE, access_denied, applications_query,
+                 appointments_query, create_app, jobs_query, role_flags)
+from config import DB_READ_YOUR_WRITES_SECONDS, DB_REPLICA_CONNECT_TIMEOUT, DB_REPLICA_URLS, WEB_THREADS
+from db import get_replicas, make_async_engine
+from instrumentation import RequestStats, finish_request, server_timing
+from templating import bytecode_cache, load_all
+
+# flush rendered output to the client in chunks of about this many bytes
+SEND_CHUNK = 16 * 1024
+
+app = create_app(warm=True)
+async_engine = make_async_engine()
+# the asyncpg twin of each replica engine in db.py's router
+async_replicas = {replica.engine: make_async_engine(url, connect_timeout=DB_REPLICA_CONNECT_TIMEOUT)
+                  for replica, url in zip(get_replicas().replicas, DB_REPLICA_URLS)}
+
+wsgi_threads = ThreadPoolExecutor(max_workers=WEB_THREADS, thread_name_prefix="wsgi")
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """WsgiToAsgiInstance that runs the WSGI app on ``wsgi_threads`` instead of one shared thread."""
+
+    async def run_wsgi_app(self, body):
+        run = WsgiToAsgiInstance.__dict__["run_wsgi_app"].func
+        await sync_to_async(run, thread_sensitive=False, executor=wsgi_threads)(self, body)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi = PooledWsgiToAsgi(app)
+
+# Flask's loader, filters and globals on an async-enabled environment
+templates = Environment(loader=app.jinja_loader, autoescape=True, enable_async=True,
+                        bytecode_cache=bytecode_cache(async_mode=True))
+templates.filters.update(app.jinja_env.filters)
+templates.globals.update(app.jinja_env.globals)
+templates.tests.update(app.jinja_env.tests)
+load_all(templates)
+
+
+# ---------------------------------------------------------------------------
+# Views: path -> (template, query builder, extra context)
+# ---------------------------------------------------------------------------
+
+READ_VIEWS = {
+    "/jobs": ("jobs.html",
+              lambda args, sess: jobs_query(args),
+              {"caregiving_types": CAREGIVING_TYPES, "job_feed": False}),
+    "/applications": ("applications.html",
+                      lambda args, sess: applications_query(args, sess["user_id"], sess.get("role")),
+                      {}),
+    "/appointments": ("appointments.html",
+                      lambda args, sess: appointments_query(args, sess["user_id"]),
+                      {}),
+}
+
+
+def load_session(headers):
+    """Decode Flask's signed session cookie; an invalid or expired cookie is an empty session."""
+    cookies = parse_cookie(headers.get(b"cookie", b"").decode("latin-1"))
+    raw = cookies.get(app.config["SESSION_COOKIE_NAME"])
+    if not raw:
+        return {}
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        return dict(serializer.loads(raw, max_age=int(app.permanent_session_lifetime.total_seconds())))
+    except Exception:
+        return {}
+
+
+def read_engine(sess):
+    """The async engine read_db() would pick for this session: the primary right after a write, else a replica."""
+    if time.time() - sess.get("_last_write", 0.0) < DB_READ_YOUR_WRITES_SECONDS:   # see cache.changed()
+        return async_engine
+    return async_replicas.get(get_replicas().engine(), async_engine)
+
+
+async def send_template(send, status, name, headers=(), **context):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"text/html; charset=utf-8"), *headers]})
+    buf = []
+    size = 0
+    async for chunk in templates.get_template(name).generate_async(**context):
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= SEND_CHUNK:
+            await send({"type": "http.response.body", "body": "".join(buf).encode(), "more_body": True})
+            buf, size = [], 0
+    await send({"type": "http.response.body", "body": "".join(buf).encode()})
+
+
+async def redirect(send, location):
+    await send({"type": "http.response.start", "status": 302,
+                "headers": [(b"location", location.encode())]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def read_view(scope, send, view, stats):
+    template, build, extra = view
+    headers = dict(scope["headers"])
+    sess = load_session(headers)
+    args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+    request = SimpleNamespace(args=args, path=scope["path"])
+    denied = access_denied(sess)
+    if denied == "login":
+        await redirect(send, "/login")
+        return 302
+    if denied:
+        await send_template(send, 403, "forbidden.html", session=sess, request=request, **role_flags(sess))
+        return 403
+
+    sql, params, key = build(args, sess)
+    # a due replica health check connects synchronously: keep it off the event loop
+    engine = await asyncio.to_thread(read_engine, sess)
+    async with engine.connect() as conn:
+        started = time.perf_counter()
+        rows = (await conn.execute(text(sql), params)).mappings().all()
+        stats.record(sql, time.perf_counter() - started)
+    filters = {k: v for k, v in args.items() if k != "after" and v}
+    await send_template(send, 200, template, headers=[(b"server-timing", server_timing(stats).encode())],
+                        page=KeysetPage(rows, PAGE_SIZE, key), filters=filters,
+                        session=sess, request=request, **role_flags(sess), **extra)
+    return 200
+
+
+# ---------------------------------------------------------------------------
+# ASGI entry point
+# ---------------------------------------------------------------------------
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for engine in (async_engine, *async_replicas.values()):
+                await engine.dispose()
+            wsgi_threads.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/jobs/stream":
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    view = READ_VIEWS.get(scope.get("path")) if scope["type"] == "http" else None
+    if view is None or scope["method"] not in ("GET", "HEAD"):
+        return await wsgi(scope, receive, send)
+
+    stats = RequestStats()
+    status = 500
+    try:
+        status = await read_view(scope, send, view, stats)
+    except Exception:
+        app.logger.exception("async view %s failed", scope["path"])
+        raise
+    finally:
+        finish_request(app, stats, scope["path"], scope["method"], status)
@@ -0,0 +1,202 @@
+"""
+cache.py - in-process response and fragment cache
+
+Pages are cached per (path, query string, role, user) with LRU eviction
+under a byte budget. Every cached response carries an ETag and a
+Last-Modified date, so a browser refreshing an unchanged page gets a 304
+without a body.
+
+Entries are tagged ("jobs", "appointments:user:7", ...). Write paths call
+changed(*tags) after committing, which drops only the entries carrying
+those tags and records the time of the user's last write in their session:
+an entry older than that write is never served to them, even by another
+worker whose copy of the cache was not invalidated. Other users see changes
+from other workers within CACHE_TTL seconds.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import make_response, request, session
+
+from config import CACHE_MAX_BYTES, CACHE_TTL
+
+
+class _Entry:
+    __slots__ = ("value", "size", "tags", "created", "etag", "mimetype")
+
+    def __init__(self, value, size, tags, etag=None, mimetype=None):
+        self.value = value
+        self.size = size
+        self.tags = tags
+        self.created = time.time()
+        self.etag = etag
+        self.mimetype = mimetype
+
+
+class ResponseCache:
+    """Thread-safe LRU keyed by arbitrary tuples, bounded by total bytes."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_tag = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, not_before=0.0):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.created < max(not_before, time.time() - self.ttl):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes // 4:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for tag in entry.tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._by_tag.pop(tag, ()):
+                    self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+cache = ResponseCache()
+
+
+def _format_tags(tags):
+    uid = session.get("user_id")
+    return tuple(t.format(uid=uid) for t in tags)
+
+
+def _last_write():
+    return session.get("_last_write", 0.0)
+
+
+def wrote_within(seconds):
+    """True when this user committed a write (see changed()) in the last ``seconds``."""
+    return time.time() - _last_write() < seconds
+
+
+def _conditional(entry):
+    resp = make_response(entry.value)
+    resp.mimetype = entry.mimetype
+    resp.set_etag(entry.etag)
+    resp.last_modified = datetime.fromtimestamp(int(entry.created), tz=timezone.utc)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+def _tee(resp, key, tags):
+    """Stream ``resp``'s body as before, keeping a copy that is cached once the body is complete.
+
+    A body that is cut short (client gone) or outgrows the whole cache is
+    not cached.
+    """
+    inner, mimetype = resp.response, resp.mimetype
+    chunks = resp.iter_encoded()
+
+    def generate():
+        parts, size = [], 0
+        try:
+            for chunk in chunks:
+                if parts is not None:
+                    parts.append(chunk)
+                    size += len(chunk)
+                    if size > cache.max_bytes:
+                        parts = None
+                yield chunk
+            if parts is not None:
+                body = b"".join(parts)
+                cache.put(key, _Entry(body, size, tags, etag=hashlib.sha1(body).hexdigest()[:20],
+                                      mimetype=mimetype))
+        finally:
+            close = getattr(inner, "close", None)
+            if close is not None:
+                close()
+
+    resp.response = generate()
+    return resp
+
+
+def cached(*tags):
+    """Cache a GET view's 200 responses under ``tags`` ("{uid}" is the session user).
+
+    A streamed page is not buffered on a miss: it goes out chunk by chunk
+    as rendered and enters the cache when it has been sent in full (the
+    first response therefore has no ETag).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            key = ("page", request.path, request.query_string, session.get("role"), session.get("user_id"))
+            entry = cache.get(key, not_before=_last_write())
+            if entry is None:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                if resp.is_streamed:
+                    return _tee(resp, key, _format_tags(tags))
+                body = resp.get_data()
+                entry = _Entry(body, len(body), _format_tags(tags),
+                               etag=hashlib.sha1(body).hexdigest()[:20], mimetype=resp.mimetype)
+                cache.put(key, entry)
+            return _conditional(entry)
+        return decorated
+    return decorator
+
+
+def fragment(name, loader, tags=()):
+    """Return the cached result of ``loader()`` (a small, shared, JSON-like value)."""
+    key = ("fragment", name)
+    entry = cache.get(key, not_before=_last_write())
+    if entry is None:
+        value = loader()
+        entry = _Entry(value, len(repr(value)), tuple(tags))
+        cache.put(key, entry)
+    return entry.value
+
+
+def changed(*tags):
+    """Call after committing a write: drop entries tagged ``tags`` and mark the user's write time."""
+    cache.invalidate(*tags)
+    session["_last_write"] = time.time()
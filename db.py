@@ -0,0 +1,325 @@
+"""
+db.py - engine construction, session settings and pool telemetry
+
+Everything that talks to Postgres gets its engine from make_engine(), so
+pool sizing, pre-ping/recycle and per-connection session settings come from
+config.py (and therefore the environment) in one place.
+
+    from db import DB, get_engine      # the web app's sessions and engine
+    engine = make_engine(statement_timeout_ms=0)   # batch tools: no timeout
+    engine = make_async_engine()       # asgi.py: the same settings on asyncpg
+    with read_session() as db:         # read-only views: a replica when configured
+
+Replicas (config.DB_REPLICA_URLS) are used round-robin. Each one is health
+checked at most every DB_REPLICA_CHECK_INTERVAL seconds, inline on whichever
+request picks it next: a replica that cannot be reached, or whose replay lag
+exceeds DB_REPLICA_MAX_LAG_SECONDS, is skipped until a later check passes.
+With no healthy replica reads fall back to the primary. A plain second
+database works as a "replica" for local testing (its lag reads as 0).
+
+Nothing is built or connected at import: the web engine and the replica
+router are created on first use in each process. Every engine made here is
+remembered, and a forked child drops the pools it inherited (without closing
+the parent's sockets), so a pre-fork server never shares a connection
+between processes.
+"""
+
+import functools
+import itertools
+import os
+import threading
+import time
+import weakref
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import config
+
+
+# every engine built in this process, for the after-fork cleanup below
+_engines = weakref.WeakSet()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return conn
+
+
+def _session_settings(statement_timeout_ms, idle_in_transaction_timeout_ms, work_mem):
+    settings = []
+    if statement_timeout_ms:
+        settings.append(("statement_timeout", f"{int(statement_timeout_ms)}ms"))
+    if idle_in_transaction_timeout_ms:
+        settings.append(("idle_in_transaction_session_timeout", f"{int(idle_in_transaction_timeout_ms)}ms"))
+    if work_mem:
+        settings.append(("work_mem", work_mem))
+    return settings
+
+
+def _engine_options(overrides):
+    """Merge config.py defaults with ``overrides``; return (pool kwargs, session settings)."""
+    opts = {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+        "statement_timeout_ms": config.DB_STATEMENT_TIMEOUT_MS,
+        "idle_in_transaction_timeout_ms": config.DB_IDLE_IN_TRANSACTION_TIMEOUT_MS,
+        "work_mem": config.DB_WORK_MEM,
+        "connect_timeout": config.DB_CONNECT_TIMEOUT,
+    }
+    unknown = set(overrides) - set(opts)
+    if unknown:
+        raise TypeError(f"unknown engine option(s): {', '.join(sorted(unknown))}")
+    opts.update(overrides)
+    settings = _session_settings(opts.pop("statement_timeout_ms"),
+                                 opts.pop("idle_in_transaction_timeout_ms"),
+                                 opts.pop("work_mem"))
+    return opts, settings
+
+
+def make_engine(url=None, **overrides):
+    """Build an engine from config.py settings; keyword arguments override them.
+
+    Accepted overrides: pool_size, max_overflow, pool_timeout, pool_recycle,
+    pool_pre_ping, statement_timeout_ms, idle_in_transaction_timeout_ms,
+    work_mem, connect_timeout (seconds; 0 = wait as long as the OS does).
+    """
+    opts, settings = _engine_options(overrides)
+    connect_timeout = opts.pop("connect_timeout")
+    connect_args = {"connect_timeout": int(connect_timeout)} if connect_timeout else {}
+    eng = create_engine(url or config.DB_URL, poolclass=TimedQueuePool, future=True,
+                        connect_args=connect_args, **opts)
+
+    if settings:
+        @event.listens_for(eng, "connect")
+        def _apply_session_settings(dbapi_conn, _record):
+            cur = dbapi_conn.cursor()
+            try:
+                for name, value in settings:
+                    cur.execute("SELECT set_config(%s, %s, false)", (name, value))
+            finally:
+                cur.close()
+            # the SETs opened a transaction on non-autocommit drivers
+            dbapi_conn.commit()
+
+    _engines.add(eng)
+    return eng
+
+
+def make_async_engine(url=None, **overrides):
+    """AsyncEngine on asyncpg with the same pool options and session settings as make_engine().
+
+    The settings are sent as asyncpg ``server_settings`` in the startup
+    packet instead of a SET round trip per new connection.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    opts, settings = _engine_options(overrides)
+    connect_args = {"server_settings": dict(settings)}
+    connect_timeout = opts.pop("connect_timeout")
+    if connect_timeout:
+        connect_args["timeout"] = connect_timeout
+    async_url = make_url(url or config.DB_URL).set(drivername="postgresql+asyncpg")
+    eng = create_async_engine(async_url, connect_args=connect_args, **opts)
+    _engines.add(eng.sync_engine)
+    return eng
+
+
+def _drop_inherited_pools():
+    # close=False: the sockets still belong to the parent, which keeps using them
+    for eng in list(_engines):
+        eng.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_drop_inherited_pools)
+
+
+def pool_status(eng):
+    """Live statistics for ``eng``'s pool, suitable for JSON."""
+    pool = eng.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool_class": type(pool).__name__}
+    stats = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": getattr(pool, "_max_overflow", None),
+    }
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "timeouts": pool.timeouts,
+                "wait_ms_total": round(pool.wait_total * 1000, 3),
+                "wait_ms_avg": round(pool.wait_total * 1000 / pool.checkouts, 3) if pool.checkouts else 0.0,
+                "wait_ms_max": round(pool.wait_max * 1000, 3),
+            })
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Read replicas
+# ---------------------------------------------------------------------------
+
+# (streaming, lag): whether WAL is still arriving from the primary, and the
+# seconds the replica is behind - 0 when it has replayed everything it
+# received (an idle primary stops producing WAL, so replay timestamps alone
+# would drift). A replica whose WAL receiver has stopped has also replayed
+# all it received, so its lag says 0 however stale it is; `streaming`
+# catches that. Without pg_read_all_stats the view shows only the pid,
+# which is enough: the row exists only while a receiver runs.
+REPLICA_LAG_SQL = """
+    SELECT NOT pg_is_in_recovery()
+             OR EXISTS (SELECT 1 FROM pg_stat_wal_receiver
+                        WHERE coalesce(status, 'streaming') = 'streaming') AS streaming,
+           CASE
+             WHEN NOT pg_is_in_recovery() THEN 0
+             WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END AS lag
+"""
+
+
+class Replica:
+    def __init__(self, url, eng):
+        self.url = make_url(url).render_as_string(hide_password=True)
+        self.engine = eng
+        self.up = True
+        self.lag = None
+        self.error = None
+        self.checked = 0.0
+        self._check_lock = threading.Lock()
+
+        @event.listens_for(eng, "handle_error")
+        def _mark_down(ctx):
+            if ctx.is_disconnect:
+                self.up, self.error, self.checked = False, "disconnected", time.monotonic()
+
+    def healthy(self):
+        # one thread re-checks a due replica; the others go by the last result
+        due = time.monotonic() - self.checked >= config.DB_REPLICA_CHECK_INTERVAL
+        if due and self._check_lock.acquire(blocking=False):
+            try:
+                self.check()
+            finally:
+                self._check_lock.release()
+        return self.up
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                streaming, lag = conn.execute(text(REPLICA_LAG_SQL)).one()
+        except SQLAlchemyError as e:
+            self.up, self.error = False, str(e).strip().splitlines()[0]
+        else:
+            self.lag = float(lag)
+            self.up = streaming and self.lag <= config.DB_REPLICA_MAX_LAG_SECONDS
+            if not streaming:
+                self.error = "not receiving WAL from the primary"
+            else:
+                self.error = None if self.up else f"replay lag {self.lag:.1f}s"
+        self.checked = time.monotonic()
+
+    def status(self):
+        return {"url": self.url, "up": self.up, "lag_seconds": self.lag, "error": self.error,
+                "pool": pool_status(self.engine)}
+
+
+class ReplicaRouter:
+    """Round-robin over the healthy replicas in ``urls``; ``primary`` when none is."""
+
+    def __init__(self, primary, urls, **overrides):
+        self.primary = primary
+        self.replicas = [Replica(url, make_engine(url, **overrides)) for url in urls]
+        self._turn = itertools.count()
+
+    @property
+    def engines(self):
+        return [r.engine for r in self.replicas]
+
+    def engine(self):
+        if not self.replicas:
+            return self.primary
+        start = next(self._turn)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.healthy():
+                return replica.engine
+        return self.primary
+
+    def status(self):
+        return [r.status() for r in self.replicas]
+
+
+# ---------------------------------------------------------------------------
+# The web app's engine and sessions, built on first use
+# ---------------------------------------------------------------------------
+
+@functools.cache
+def get_engine():
+    return make_engine()
+
+
+@functools.cache
+def get_replicas():
+    # a short connect timeout: health checks run on request threads, and an
+    # unreachable replica must cost a request seconds, not the OS TCP timeout
+    return ReplicaRouter(get_engine(), config.DB_REPLICA_URLS, connect_timeout=config.DB_REPLICA_CONNECT_TIMEOUT)
+
+
+_sessions = sessionmaker(expire_on_commit=False)
+
+
+def DB(bind=None):
+    """Session on the web app's engine (or on ``bind``); use as ``with DB() as db:``."""
+    return _sessions(bind=bind or get_engine())
+
+
+def read_session():
+    """Session for read-only work on the next healthy replica (or the primary)."""
+    return DB(bind=get_replicas().engine())
+
+
+def warm_pool(connections):
+    """Open up to ``connections`` connections to the primary and each replica, and pool them."""
+    opened = 0
+    for eng in (get_engine(), *get_replicas().engines):
+        conns = []
+        try:
+            for _ in range(min(connections, eng.pool.size())):
+                conns.append(eng.connect())
+        finally:
+            for conn in conns:
+                conn.close()
+        opened += len(conns)
+    return opened
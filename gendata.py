@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+gendata.py - deterministic scale-data generator
+
+Writes <table>.csv files shaped like the models.py entities, ready for
+``python importer.py OUT --keep-ids``. Every column is produced with numpy
+in whole-array operations; the same --seed and sizes always give the same
+files.
+
+The default sizes describe a small city; --scale multiplies all of them:
+
+    python gendata.py --out ./generated                 # 10k users, 200k appointments
+    python gendata.py --out ./generated --scale 100     # 1M users, 200k caregivers,
+                                                        # 2M jobs, 20M appointments
+
+Shape of the data:
+  * cities are skewed towards Astana and Almaty, with a few legacy
+    spellings (Nur-Sultan, Alma-Ata) mixed in;
+  * jobs and bookings are drawn from a Zipf distribution over members, so a
+    few heavy members post most of the jobs; caregiver activity is
+    lognormal (some are much busier than others);
+  * applications pair jobs with caregivers of the matching type;
+  * appointment status depends on the date: past bookings are mostly
+    accepted or declined, future ones mostly pending;
+  * a caregiver is never booked twice for the same slot.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+REFERENCE_DATE = np.datetime64("2025-12-01")
+HISTORY_DAYS = 3 * 365
+FUTURE_DAYS = 60
+CHUNK_ROWS = 1_000_000
+
+CITIES = ["Astana", "Almaty", "Shymkent", "Karagandy", "Aktobe", "Atyrau", "Pavlodar",
+          "Oskemen", "Taraz", "Kostanay", "Nur-Sultan", "Alma-Ata", "astana", "ALMATY"]
+CITY_WEIGHTS = [0.27, 0.25, 0.10, 0.07, 0.05, 0.05, 0.04, 0.04, 0.03, 0.03, 0.03, 0.02, 0.01, 0.01]
+GIVEN_NAMES = ["Arman", "Amina", "Gulnar", "Serik", "Dinara", "Azamat", "Saltanat", "Bekzat", "Aliya",
+               "Marat", "Nurgul", "Zhanar", "Samat", "Laysan", "Bek", "Gul", "Dina", "Timur", "Aila", "Nazar"]
+SURNAMES = ["Armanov", "Aminova", "Sadykova", "Ibragimov", "Bek", "Kairat", "Nur", "Zholdas", "Tursyn",
+            "Oralbay", "Aman", "Yessen", "Nurzhan", "Abay", "Sultanov", "Amanova", "Sarsen", "Atabay"]
+DESCRIPTIONS = ["Friendly and responsible.", "Calm and patient.", "Good with kids.", "Energetic helper.",
+                "Loves children.", "Very caring.", "Experienced nanny.", "Loves elder care.", ""]
+STREETS = ["Kabanbay Batyr", "Turan", "Abay", "Seifullin", "Satpayev", "Kenesary", "Mangilik El",
+           "Dostyk", "Al-Farabi", "Respublika"]
+HOUSE_RULES = ["No pets.", "No smoking, clean kitchen.", "No loud music.", "Respect privacy.",
+               "Quiet after 9 PM, hygiene important.", "No shoes inside.", "Keep rooms clean.",
+               "Very sensitive to noise.", "Avoid strong perfumes.", "No pets. No smoking."]
+DEPENDENTS = ["Elderly grandmother, needs daily check-ins.", "5-year-old daughter who likes painting.",
+              "Child with ADHD, needs patient supervision.", "Infant (4 months), needs feeding schedule.",
+              "Grandfather recovering from surgery.", "Toddler learning to walk."]
+REQUIREMENTS = ["Night shifts, feeding experience.", "Creative person preferred, soft-spoken preferred.",
+                "Need infant care experience.", "Medical knowledge preferred.", "Energetic and fun.",
+                "Strict with house rules.", "Mobility support required.", "Flexible hours.",
+                "Soft-spoken and patient.", "First aid certificate required."]
+TYPES = ["babysitter", "elderly", "playmate"]
+TYPE_WEIGHTS = [0.5, 0.3, 0.2]
+TYPE_RATE = np.array([3200, 4200, 2800])
+GENDERS = ["male", "female", "other"]
+GENDER_WEIGHTS = [0.25, 0.73, 0.02]
+STATUSES = ["pending", "accepted", "declined"]
+PAST_STATUS_WEIGHTS = [0.05, 0.75, 0.20]
+FUTURE_STATUS_WEIGHTS = [0.60, 0.35, 0.05]
+# four non-overlapping three-hour booking slots per day
+SLOT_STARTS = ["08:00", "11:00", "14:00", "17:00"]
+WORK_HOURS = np.arange(1, 3.01, 0.5)
+
+DEFAULTS = {"users": 10_000, "caregivers": 2_000, "jobs": 20_000, "applications": 60_000,
+            "appointments": 200_000}
+
+
+def pick(rng, values, n, weights=None):
+    """Draw ``n`` items of ``values`` (as a numpy string array) with optional weights."""
+    return np.asarray(values)[rng.choice(len(values), size=n, p=weights)]
+
+
+def zipf_index(rng, n, size, a=1.3):
+    """Indices in [0, size) where a handful of positions get most of the draws."""
+    return (rng.zipf(a, n) - 1) % size
+
+
+def lognormal_weights(rng, size, sigma=1.0):
+    """Activity weights for ``size`` entities: most are ordinary, some are very busy."""
+    w = rng.lognormal(0.0, sigma, size)
+    return w / w.sum()
+
+
+def write_csv(path, header, columns, mode="w"):
+    """Write equally long column arrays as CSV. Values never contain commas or quotes
+    except the free-text columns, which are quoted up front by ``quote``."""
+    lines = [",".join(row) for row in zip(*(c.astype(str).tolist() for c in columns))]
+    with open(path, mode, encoding="utf-8") as f:
+        if mode == "w":
+            f.write(",".join(header) + "\n")
+        if lines:
+            f.write("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def quote(values):
+    return np.char.add(np.char.add('"', np.char.replace(values.astype(str), '"', '""')), '"')
+
+
+def generate(out, seed, sizes):
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_users, n_caregivers = sizes["users"], min(sizes["caregivers"], sizes["users"])
+    report = {}
+
+    # -- users: a random subset are caregivers, everyone else is a member
+    user_ids = np.arange(1, n_users + 1)
+    is_caregiver = np.zeros(n_users, dtype=bool)
+    is_caregiver[rng.choice(n_users, n_caregivers, replace=False)] = True
+    caregiver_ids, member_ids = user_ids[is_caregiver], user_ids[~is_caregiver]
+    cities = pick(rng, CITIES, n_users, CITY_WEIGHTS)
+    report["app_user"] = write_csv(out / "app_user.csv",
+        ["user_id", "email", "given_name", "surname", "city", "phone_number", "profile_description", "password"],
+        [user_ids,
+         np.char.add(np.char.add("user", user_ids.astype(str)), "@example.com"),
+         pick(rng, GIVEN_NAMES, n_users), pick(rng, SURNAMES, n_users), cities,
+         np.char.add("+7701", np.char.zfill(rng.integers(0, 10_000_000, n_users).astype(str), 7)),
+         quote(pick(rng, DESCRIPTIONS, n_users)),
+         np.full(n_users, "123")])
+
+    # -- caregivers
+    cg_types = rng.choice(len(TYPES), n_caregivers, p=TYPE_WEIGHTS)
+    rates = np.clip(np.round(rng.normal(TYPE_RATE[cg_types], 600) / 100) * 100, 1000, None).astype(int)
+    report["caregiver"] = write_csv(out / "caregiver.csv",
+        ["caregiver_user_id", "gender", "caregiving_type", "hourly_rate"],
+        [caregiver_ids, pick(rng, GENDERS, n_caregivers, GENDER_WEIGHTS), np.asarray(TYPES)[cg_types], rates])
+
+    # -- members and their addresses (most members live in the city they signed up with)
+    n_members = len(member_ids)
+    report["member"] = write_csv(out / "member.csv",
+        ["member_user_id", "house_rules", "dependent_description"],
+        [member_ids, quote(pick(rng, HOUSE_RULES, n_members)), quote(pick(rng, DEPENDENTS, n_members))])
+    has_address = rng.random(n_members) < 0.9
+    addr_members = member_ids[has_address]
+    towns = np.where(rng.random(len(addr_members)) < 0.9, cities[addr_members - 1],
+                     pick(rng, CITIES, len(addr_members), CITY_WEIGHTS))
+    report["address"] = write_csv(out / "address.csv",
+        ["address_id", "member_user_id", "house_number", "street", "town"],
+        [np.arange(1, len(addr_members) + 1), addr_members, rng.integers(1, 200, len(addr_members)),
+         pick(rng, STREETS, len(addr_members)), towns])
+
+    # -- jobs: heavy-tailed over a shuffled member order
+    n_jobs = sizes["jobs"]
+    heavy_order = rng.permutation(member_ids)
+    job_members = heavy_order[zipf_index(rng, n_jobs, n_members)]
+    job_types = rng.choice(len(TYPES), n_jobs, p=TYPE_WEIGHTS)
+    job_dates = REFERENCE_DATE - rng.integers(0, 2 * 365, n_jobs).astype("timedelta64[D]")
+    report["job"] = write_csv(out / "job.csv",
+        ["job_id", "member_user_id", "required_caregiving_type", "other_requirements", "date_posted"],
+        [np.arange(1, n_jobs + 1), job_members, np.asarray(TYPES)[job_types],
+         quote(pick(rng, REQUIREMENTS, n_jobs)), job_dates])
+
+    # -- applications: each job draws applicants among caregivers of its type
+    n_apps = sizes["applications"]
+    app_jobs = rng.integers(0, n_jobs, n_apps) if n_jobs else np.zeros(0, dtype=int)
+    app_cgs = np.zeros(n_apps, dtype=np.int64)
+    for t in range(len(TYPES)):
+        pool = caregiver_ids[cg_types == t]
+        mask = job_types[app_jobs] == t
+        if len(pool):
+            app_cgs[mask] = pool[rng.choice(len(pool), int(mask.sum()), p=lognormal_weights(rng, len(pool)))]
+        else:
+            app_cgs[mask] = 0
+    keep = app_cgs > 0
+    pairs = np.unique(app_cgs[keep] * (n_jobs + 1) + app_jobs[keep] + 1)
+    app_cgs, app_job_ids = pairs // (n_jobs + 1), pairs % (n_jobs + 1)
+    applied = job_dates[app_job_ids - 1] + rng.integers(0, 14, len(pairs)).astype("timedelta64[D]")
+    report["job_application"] = write_csv(out / "job_application.csv",
+        ["caregiver_user_id", "job_id", "date_applied"], [app_cgs, app_job_ids, applied])
+
+    # -- appointments, in chunks; chunk k only uses days d with d % chunks == k,
+    # so de-duplicating (caregiver, day, slot) inside a chunk is enough to rule
+    # out double bookings across the whole file
+    n_appts = sizes["appointments"]
+    days_total = HISTORY_DAYS + FUTURE_DAYS
+    n_chunks = max(1, -(-n_appts // CHUNK_ROWS))
+    cg_weights = lognormal_weights(rng, n_caregivers)
+    written, next_id = 0, 1
+    for k in range(n_chunks):
+        want = min(CHUNK_ROWS, n_appts - written)
+        draw = int(want * 1.05) + 16
+        cg = caregiver_ids[rng.choice(n_caregivers, draw, p=cg_weights)]
+        day = k + n_chunks * rng.integers(0, max(1, days_total // n_chunks), draw)
+        slot = rng.integers(0, len(SLOT_STARTS), draw)
+        key = (cg.astype(np.int64) * days_total + day) * len(SLOT_STARTS) + slot
+        _, first = np.unique(key, return_index=True)
+        first = np.sort(first)[:want]
+        cg, day, slot = cg[first], day[first], slot[first]
+        n = len(first)
+        dates = REFERENCE_DATE - np.timedelta64(HISTORY_DAYS, "D") + day.astype("timedelta64[D]")
+        past = dates < REFERENCE_DATE
+        status = np.where(past, rng.choice(3, n, p=PAST_STATUS_WEIGHTS), rng.choice(3, n, p=FUTURE_STATUS_WEIGHTS))
+        write_csv(out / "appointment.csv",
+            ["appointment_id", "caregiver_user_id", "member_user_id", "appointment_date", "appointment_time",
+             "work_hours", "status"],
+            [np.arange(next_id, next_id + n), cg, heavy_order[zipf_index(rng, n, n_members)], dates,
+             np.asarray(SLOT_STARTS)[slot], WORK_HOURS[rng.integers(0, len(WORK_HOURS), n)],
+             np.asarray(STATUSES)[status]],
+            mode="w" if k == 0 else "a")
+        written += n
+        next_id += n
+    report["appointment"] = written
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="generated")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every default size")
+    for name, default in DEFAULTS.items():
+        parser.add_argument(f"--{name}", type=int, help=f"override the row count (default {default} x scale)")
+    args = parser.parse_args()
+    sizes = {name: getattr(args, name) or int(default * args.scale) for name, default in DEFAULTS.items()}
+    started = time.perf_counter()
+    counts = generate(args.out, args.seed, sizes)
+    for table, n in counts.items():
+        print(f"{table:16} {n:>12,}")
+    print(f"generated {sum(counts.values()):,} rows in {time.perf_counter() - started:.1f}s -> {args.out}")
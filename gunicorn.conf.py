@@ -0,0 +1,40 @@
+"""
+gunicorn.conf.py - production server settings
+
+    gunicorn -c gunicorn.conf.py
+
+The app is built and every template compiled once, in the master
+(preload_app), so a forked worker starts with all of it in memory and is
+ready as soon as its connections are. Pools never cross the fork: db.py
+drops anything a child inherits, and each worker opens its own
+DB_WARM_CONNECTIONS connections before it accepts requests.
+
+Workers are threaded (gthread, WEB_THREADS each): an open /jobs/stream
+feed holds a thread for as long as the tab is open, which would pin a
+sync worker for good. A worker takes at most JOB_FEED_MAX_SUBSCRIBERS
+feeds, so its remaining threads always serve pages. gthread workers
+heartbeat from their main loop, so `timeout` does not cut long-lived
+feeds; it still catches a worker that hangs.
+
+Every worker has its own pool, so WEB_CONCURRENCY * (DB_POOL_SIZE +
+DB_MAX_OVERFLOW) must stay below the server's max_connections. Threads
+beyond the pool size wait up to DB_POOL_TIMEOUT for a connection; feeds
+only use one while replaying missed postings.
+"""
+
+import os
+
+import config
+
+wsgi_app = "app:create_app(warm=True)"
+preload_app = True
+bind = os.getenv("BIND") or "127.0.0.1:8000"
+workers = int(os.getenv("WEB_CONCURRENCY") or 4)
+worker_class = "gthread"
+threads = config.WEB_THREADS
+timeout = int(os.getenv("WEB_TIMEOUT") or 30)
+
+
+def post_worker_init(worker):
+    from app import warm_up
+    warm_up(worker.wsgi, connections=config.DB_WARM_CONNECTIONS)
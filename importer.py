@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+importer.py - bulk loader using COPY FROM STDIN
+
+Loads a directory of <table>.csv (with a header row) or <table>.jsonl files
+into the platform tables, in foreign-key order:
+
+    app_user, caregiver, member, address, job, job_application, appointment
+
+Rows are read, validated and sent in bounded chunks, so memory does not grow
+with the file; the only per-row state kept across chunks is the id map of
+the tables that others reference (app_user, caregiver, member, job), and
+only rows that were actually loaded enter it. Before a chunk is sent every
+row is checked against the schema.sql CHECK / NOT NULL constraints; a row
+that still violates a constraint in the database (a foreign key, a
+duplicate, an overlapping appointment) makes the chunk be re-sent in halves
+until that row is isolated. Bad rows are skipped and counted, and the first
+few are reported, instead of aborting the import.
+
+Ids in the files are treated as source ids. By default every SERIAL id is
+replaced by a freshly reserved one from the table's sequence and the
+foreign keys of later tables are remapped through it. With --keep-ids the
+source ids are loaded as-is and the sequences are advanced past them
+afterwards (fastest; use it for an empty database).
+
+    python importer.py ./export
+    python importer.py ./generated --keep-ids --chunk-size 200000
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from sqlalchemy import text
+from db import make_engine
+
+CHUNK_SIZE = 50_000
+MAX_REPORTED_REJECTS = 10
+
+GENDERS = ("male", "female", "other")
+CAREGIVING_TYPES = ("babysitter", "elderly", "playmate")
+STATUSES = ("pending", "accepted", "declined")
+
+
+def one_of(*allowed):
+    return lambda v: v in allowed
+
+
+def positive(v):
+    return float(v) > 0
+
+
+def non_negative(v):
+    return int(v) >= 0
+
+
+class Table:
+    """How one table is read, checked and remapped.
+
+    ``serial`` names the SERIAL primary key (if any), ``key`` the column other
+    tables reference (the serial one unless given), ``refs`` maps foreign key
+    columns to the table whose ids they reference, and ``checks`` maps
+    columns to predicates mirroring the CHECK constraints (NULL always
+    passes, as in Postgres).
+    """
+
+    def __init__(self, name, columns, serial=None, key=None, refs=None, required=(), checks=None):
+        self.name = name
+        self.columns = columns
+        self.serial = serial
+        self.key = key or serial
+        self.refs = refs or {}
+        self.required = required
+        self.checks = checks or {}
+
+
+TABLES = [
+    Table("app_user",
+          ["user_id", "email", "given_name", "surname", "city", "phone_number", "profile_description", "password"],
+          serial="user_id", required=("email", "given_name", "surname", "password")),
+    Table("caregiver", ["caregiver_user_id", "gender", "caregiving_type", "hourly_rate"],
+          key="caregiver_user_id", refs={"caregiver_user_id": "app_user"}, required=("caregiver_user_id",),
+          checks={"gender": one_of(*GENDERS), "caregiving_type": one_of(*CAREGIVING_TYPES),
+                  "hourly_rate": non_negative}),
+    Table("member", ["member_user_id", "house_rules", "dependent_description"],
+          key="member_user_id", refs={"member_user_id": "app_user"}, required=("member_user_id",)),
+    Table("address", ["address_id", "member_user_id", "house_number", "street", "town"],
+          serial="address_id", refs={"member_user_id": "member"}),
+    Table("job", ["job_id", "member_user_id", "required_caregiving_type", "other_requirements", "date_posted"],
+          serial="job_id", refs={"member_user_id": "member"},
+          checks={"required_caregiving_type": one_of(*CAREGIVING_TYPES)}),
+    Table("job_application", ["caregiver_user_id", "job_id", "date_applied"],
+          refs={"caregiver_user_id": "caregiver", "job_id": "job"}, required=("caregiver_user_id", "job_id")),
+    Table("appointment",
+          ["appointment_id", "caregiver_user_id", "member_user_id", "appointment_date", "appointment_time",
+           "work_hours", "status"],
+          serial="appointment_id", refs={"caregiver_user_id": "caregiver", "member_user_id": "member"},
+          checks={"work_hours": positive, "status": one_of(*STATUSES)}),
+]
+
+# tables whose source -> new id maps are needed by later tables; the others
+# (address, job_application, appointment) are not referenced, so their maps
+# are never kept
+REFERENCED = {target for table in TABLES for target in table.refs.values()}
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def find_source(directory, table):
+    for suffix in (".csv", ".jsonl"):
+        path = Path(directory) / f"{table}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def read_rows(path):
+    """Yield (line_number, {column: value-or-None}) from a CSV or JSONL file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.suffix == ".csv":
+            for n, row in enumerate(csv.DictReader(f), start=2):
+                yield n, {k: (v if v != "" else None) for k, v in row.items()}
+        else:
+            for n, line in enumerate(f, start=1):
+                if line.strip():
+                    yield n, json.loads(line)
+
+
+class Rejects:
+    """The first MAX_REPORTED_REJECTS rejected rows and a count of all of them."""
+
+    def __init__(self):
+        self.count = 0
+        self.examples = []
+
+    def add(self, line, reason):
+        self.count += 1
+        if len(self.examples) < MAX_REPORTED_REJECTS:
+            self.examples.append((line, reason))
+
+
+def chunks(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ---------------------------------------------------------------------------
+# Validation and id remapping
+# ---------------------------------------------------------------------------
+
+def validate(table, row):
+    """Return None if ``row`` satisfies the table's constraints, else the reason it does not."""
+    for col in table.required:
+        if row.get(col) in (None, ""):
+            return f"{col} is required"
+    for col in (table.serial, *table.refs):
+        value = row.get(col) if col else None
+        if value is not None:
+            try:
+                int(value)
+            except (TypeError, ValueError):
+                return f"{col}={value!r} is not an integer id"
+    for col, check in table.checks.items():
+        value = row.get(col)
+        if value is None:
+            continue
+        try:
+            ok = check(value)
+        except (TypeError, ValueError):
+            ok = False
+        if not ok:
+            return f"{col}={value!r} violates the CHECK constraint"
+    return None
+
+
+def reserve_ids(conn, table, n):
+    """Take ``n`` values from the table's id sequence in one round trip."""
+    return conn.execute(text("""
+        SELECT nextval(pg_get_serial_sequence(:t, :c)) FROM generate_series(1, :n)
+    """), {"t": table.name, "c": table.serial, "n": n}).scalars().all()
+
+
+def remap_chunk(conn, table, chunk, id_maps, rejects):
+    """Replace source ids with database ids; drop rows whose references are unknown.
+
+    Each kept row remembers its source key under "_src" for record_ids().
+    """
+    kept = []
+    for n, row in chunk:
+        row["_src"] = row.get(table.key) if table.key else None
+        for col, target in table.refs.items():
+            value = row.get(col)
+            if value is None:
+                continue
+            new = id_maps.get(target, {}).get(int(value))
+            if new is None:
+                rejects.add(n, f"{col}={value} references a {target} row that was not imported")
+                break
+            row[col] = new
+        else:
+            kept.append((n, row))
+    if table.serial and kept:
+        for (_, row), new in zip(kept, reserve_ids(conn, table, len(kept))):
+            row[table.serial] = new
+    return kept
+
+
+def record_ids(table, rows, id_maps):
+    """Add the loaded ``rows`` to the table's source -> database id map, if later tables need it."""
+    if table.name not in REFERENCED:
+        return
+    mapping = id_maps.setdefault(table.name, {})
+    for _, row in rows:
+        if row["_src"] is not None:
+            mapping[int(row["_src"])] = row[table.key]
+
+
+# ---------------------------------------------------------------------------
+# COPY
+# ---------------------------------------------------------------------------
+
+def _copy_value(v):
+    if v is None:
+        return "\\N"
+    return (str(v).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def copy_chunk(raw_conn, table, rows):
+    buf = io.StringIO()
+    for _, row in rows:
+        buf.write("\t".join(_copy_value(row.get(c)) for c in table.columns))
+        buf.write("\n")
+    buf.seek(0)
+    with raw_conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table.name} ({', '.join(table.columns)}) FROM STDIN", buf)
+
+
+def copy_rows(conn, raw_conn, table, rows, rejects):
+    """COPY ``rows``, isolating and rejecting rows that violate a constraint; return the rows loaded.
+
+    Each attempt runs under a savepoint; a failed one is retried in halves,
+    down to single rows, so a few bad rows cost O(log n) extra COPYs each.
+    """
+    try:
+        with conn.begin_nested():
+            copy_chunk(raw_conn, table, rows)
+        return rows
+    except psycopg2.IntegrityError as e:   # foreign key, unique, exclusion (overlapping appointment)
+        if len(rows) == 1:
+            rejects.add(rows[0][0], e.diag.message_primary or str(e).strip().splitlines()[0])
+            return []
+        mid = len(rows) // 2
+        return (copy_rows(conn, raw_conn, table, rows[:mid], rejects)
+                + copy_rows(conn, raw_conn, table, rows[mid:], rejects))
+
+
+def advance_sequence(conn, table):
+    conn.execute(text(f"""
+        SELECT setval(pg_get_serial_sequence(:t, :c),
+                      GREATEST((SELECT MAX({table.serial}) FROM {table.name}), 1))
+    """), {"t": table.name, "c": table.serial})
+
+
+def import_table(engine, table, path, id_maps, keep_ids, chunk_size):
+    loaded, rejects, started = 0, Rejects(), time.perf_counter()
+    with engine.connect() as conn:
+        raw = conn.connection.dbapi_connection
+        for chunk in chunks(read_rows(path), chunk_size):
+            good = []
+            for n, row in chunk:
+                reason = validate(table, row)
+                if reason:
+                    rejects.add(n, reason)
+                else:
+                    good.append((n, row))
+            # COPY goes through the raw DBAPI connection; the explicit begin()
+            # makes the Connection commit it together with the id reservation
+            with conn.begin():
+                if not keep_ids:
+                    good = remap_chunk(conn, table, good, id_maps, rejects)
+                if good:
+                    good = copy_rows(conn, raw, table, good, rejects)
+                if not keep_ids:
+                    record_ids(table, good, id_maps)
+            loaded += len(good)
+            print(f"  {table.name}: {loaded} rows", end="\r", flush=True)
+        if keep_ids and table.serial:
+            with conn.begin():
+                advance_sequence(conn, table)
+    elapsed = time.perf_counter() - started
+    print(f"  {table.name}: {loaded} rows loaded, {rejects.count} rejected in {elapsed:.1f}s "
+          f"({loaded / elapsed if elapsed else 0:,.0f} rows/s)")
+    for n, reason in rejects.examples:
+        print(f"    {path.name}:{n}: {reason}", file=sys.stderr)
+    if rejects.count > len(rejects.examples):
+        print(f"    ... {rejects.count - len(rejects.examples)} more", file=sys.stderr)
+    return loaded, rejects.count
+
+
+def import_directory(directory, keep_ids=False, chunk_size=CHUNK_SIZE, only=None):
+    engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+    id_maps = {}
+    total_loaded = total_rejected = 0
+    for table in TABLES:
+        if only and table.name not in only:
+            continue
+        path = find_source(directory, table.name)
+        if path is None:
+            continue
+        print(f"-- {table.name} <- {path}")
+        loaded, rejected = import_table(engine, table, path, id_maps, keep_ids, chunk_size)
+        total_loaded += loaded
+        total_rejected += rejected
+    print(f"== {total_loaded} rows loaded, {total_rejected} rejected ==")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--keep-ids", action="store_true",
+                        help="load source ids as-is instead of remapping SERIAL ids")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--only", nargs="+", metavar="TABLE",
+                        help="import only these tables (combine with --keep-ids when they reference "
+                             "tables that are not part of this run)")
+    args = parser.parse_args()
+    import_directory(args.directory, args.keep_ids, args.chunk_size, args.only)
@@ -0,0 +1,260 @@
+"""
+instrumentation.py - per-request SQL accounting and Prometheus metrics
+
+instrument(app, *engines) hooks the engines' cursor events and the Flask
+request cycle. For every request it records the number of statements, the
+total time spent in the database and the slowest statement, and logs a
+warning when the same statement shape runs N_PLUS_ONE_THRESHOLD times or
+more (the classic N+1 pattern) and when its slowest statement took
+SLOW_STATEMENT_SECONDS or longer. A Server-Timing header carries the
+numbers, the slowest statement's time included, to the browser's dev tools.
+
+Template rendering is timed through Flask's before_render_template /
+template_rendered signals, minus any SQL run while the template renders,
+so care_template_render_seconds (per template) shows rendering cost apart
+from database cost; the request's total appears as "render" in
+Server-Timing.
+
+asgi.py's async views do not pass through Flask: they time their statement
+into a RequestStats themselves and report through finish_request() and
+server_timing(), so they show up in the same metrics.
+
+Per-route histograms are kept in process memory and rendered in the
+Prometheus text format by render_metrics(). Under gunicorn every worker
+keeps its own registry, so scrape each worker (or sum them) accordingly.
+"""
+
+import re
+import threading
+import time
+import weakref
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+N_PLUS_ONE_THRESHOLD = 5
+SLOW_STATEMENT_SECONDS = 0.5
+SLOW_STATEMENT_LOG_CHARS = 200
+
+# seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    """Collapse literals and whitespace so repeated statements compare equal."""
+    return _SPACES.sub(" ", _LITERALS.sub("?", statement)).strip()
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = (0.0, None)
+        self.shapes = {}
+        self.render_time = 0.0
+        self.rendering = []   # (started, db_time then) per template being rendered
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest[0]:
+            self.slowest = (elapsed, statement)
+        shape = statement_shape(statement)
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {shape: n for shape, n in self.shapes.items() if n >= threshold}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+
+
+class Registry:
+    """Per-route histograms and counters, guarded by one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}   # (metric, route) -> Histogram
+        self.counters = {}     # (metric, labels tuple) -> int
+
+    def observe(self, metric, route, value, buckets):
+        with self.lock:
+            h = self.histograms.get((metric, route))
+            if h is None:
+                h = self.histograms[(metric, route)] = Histogram(buckets)
+            h.observe(value)
+
+    def inc(self, metric, labels, amount=1):
+        with self.lock:
+            self.counters[(metric, labels)] = self.counters.get((metric, labels), 0) + amount
+
+
+registry = Registry()
+
+HELP = {
+    "care_http_request_duration_seconds": ("histogram", "Wall time per request, including streamed bodies."),
+    "care_db_time_seconds": ("histogram", "Time spent executing SQL per request."),
+    "care_db_queries": ("histogram", "Number of SQL statements per request."),
+    "care_template_render_seconds": ("histogram", "Time spent rendering a template, excluding SQL."),
+    "care_http_requests_total": ("counter", "Requests by route and status."),
+    "care_n_plus_one_total": ("counter", "Requests that repeated one statement shape at least "
+                                         f"{N_PLUS_ONE_THRESHOLD} times."),
+    "care_slow_statements_total": ("counter", "Requests whose slowest statement took at least "
+                                              f"{SLOW_STATEMENT_SECONDS}s."),
+}
+
+
+# histograms labelled by something other than the route
+HISTOGRAM_LABELS = {"care_template_render_seconds": "template"}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(pairs):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_metrics(extra_gauges=None):
+    """Return the registry in the Prometheus text exposition format.
+
+    ``extra_gauges`` is an optional {metric_name: value} mapping (e.g. pool stats).
+    """
+    lines = []
+    with registry.lock:
+        histograms = sorted(registry.histograms.items())
+        counters = sorted(registry.counters.items())
+    for name, (kind, text) in HELP.items():
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            label = HISTOGRAM_LABELS.get(name, "route")
+            for (metric, route), h in histograms:
+                if metric != name:
+                    continue
+                for upper, n in zip(h.buckets, h.counts):
+                    lines.append(f"{name}_bucket{_fmt_labels([(label, route), ('le', upper)])} {n}")
+                lines.append(f"{name}_bucket{_fmt_labels([(label, route), ('le', '+Inf')])} {h.count}")
+                lines.append(f"{name}_sum{_fmt_labels([(label, route)])} {h.sum}")
+                lines.append(f"{name}_count{_fmt_labels([(label, route)])} {h.count}")
+        else:
+            for (metric, labels), n in counters:
+                if metric == name:
+                    lines.append(f"{name}{_fmt_labels(labels)} {n}")
+    for name, value in (extra_gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def finish_request(app, stats, route, method, status):
+    """Record a finished request's metrics and log its N+1 and slow-statement warnings."""
+    elapsed = time.perf_counter() - stats.started
+    registry.observe("care_http_request_duration_seconds", route, elapsed, LATENCY_BUCKETS)
+    registry.observe("care_db_time_seconds", route, stats.db_time, LATENCY_BUCKETS)
+    registry.observe("care_db_queries", route, stats.queries, QUERY_COUNT_BUCKETS)
+    registry.inc("care_http_requests_total", (("route", route), ("method", method), ("status", status)))
+    repeated = stats.repeated()
+    if repeated:
+        registry.inc("care_n_plus_one_total", (("route", route),))
+        for shape, n in repeated.items():
+            app.logger.warning("N+1 suspected on %s %s: %d x %s", method, route, n,
+                               shape[:SLOW_STATEMENT_LOG_CHARS])
+    slowest, statement = stats.slowest
+    if statement is not None and slowest >= SLOW_STATEMENT_SECONDS:
+        registry.inc("care_slow_statements_total", (("route", route),))
+        app.logger.warning("slow statement on %s %s: %.0f ms: %s", method, route, slowest * 1000,
+                           _SPACES.sub(" ", statement).strip()[:SLOW_STATEMENT_LOG_CHARS])
+
+
+def server_timing(stats):
+    """The Server-Timing header value for ``stats``."""
+    return (f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+            f'slowest;dur={stats.slowest[0] * 1000:.2f};desc="slowest statement", '
+            f'render;dur={stats.render_time * 1000:.2f}')
+
+
+_instrumented = weakref.WeakSet()
+
+
+def instrument(app, *engines):
+    """Attach query accounting to ``engines`` and request accounting to ``app``."""
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append((context, time.perf_counter()))
+
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()[1]
+        if has_request_context():
+            stats = g.get("sql_stats")
+            if stats is not None:
+                stats.record(statement, elapsed)
+
+    def _failed(ctx):
+        # a failed statement never reaches after_cursor_execute; its start time
+        # would otherwise stay on the pooled connection for good
+        starts = ctx.connection.info.get("query_start") if ctx.connection is not None else None
+        if starts and ctx.execution_context is not None and starts[-1][0] is ctx.execution_context:
+            starts.pop()
+
+    for engine in engines:
+        if engine in _instrumented:   # another app in this process already counts it
+            continue
+        _instrumented.add(engine)
+        event.listen(engine, "before_cursor_execute", _before)
+        event.listen(engine, "after_cursor_execute", _after)
+        event.listen(engine, "handle_error", _failed)
+
+    @app.before_request
+    def _start():
+        g.sql_stats = RequestStats()
+
+    # a streamed template sends template_rendered when its generator is exhausted
+    @before_render_template.connect_via(app)
+    def _render_start(sender, template, context, **extra):
+        stats = g.get("sql_stats")
+        if stats is not None:
+            stats.rendering.append((time.perf_counter(), stats.db_time))
+
+    @template_rendered.connect_via(app)
+    def _render_done(sender, template, context, **extra):
+        stats = g.get("sql_stats")
+        if stats is None or not stats.rendering:
+            return
+        started, db_time = stats.rendering.pop()
+        elapsed = time.perf_counter() - started - (stats.db_time - db_time)
+        stats.render_time += elapsed
+        registry.observe("care_template_render_seconds", template.name, elapsed, LATENCY_BUCKETS)
+
+    @app.after_request
+    def _report(response):
+        stats = g.get("sql_stats")
+        if stats is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        method, status = request.method, response.status_code
+        if response.is_streamed:
+            # the body (and its queries) is produced after this hook returns
+            response.call_on_close(lambda: finish_request(app, stats, route, method, status))
+        else:
+            response.headers["Server-Timing"] = server_timing(stats)
+            finish_request(app, stats, route, method, status)
+        return response
@@ -0,0 +1,174 @@
+"""
+jobfeed.py - live job changes for /jobs/stream
+
+Triggers on job (migrations/0008_job_notify.sql) NOTIFY the job_feed channel
+on every insert, update and delete. Each process runs one listener thread
+on one dedicated connection: it loads a changed job once and puts it on the
+queue of every open feed whose filters match, so a thousand feeds cost one
+connection and one query per change, per process.
+
+A feed that falls QUEUE_SIZE events behind is closed, and so is every feed
+when the listener loses its connection. Browsers reconnect by themselves
+with Last-Event-ID, and /jobs/stream replays the jobs posted since then.
+Only postings are replayed; edits and deletes that happened while a client
+was disconnected are not.
+
+Every open feed holds a server thread (or greenlet) for its lifetime, so
+/jobs/stream needs a threaded or gevent worker class (gunicorn.conf.py
+runs gthread), and each process caps its feeds at JOB_FEED_MAX_SUBSCRIBERS.
+Under asgi.py the feed is switched off (/jobs/stream answers 204).
+"""
+
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import make_engine
+
+CHANNEL = "job_feed"
+QUEUE_SIZE = 256           # events a feed may fall behind before it is closed
+POLL_SECONDS = 5           # select() timeout on the listener connection
+RECONNECT_SECONDS = 2
+
+log = logging.getLogger(__name__)
+
+JOB_ROW = """
+    SELECT j.job_id, j.member_user_id, j.required_caregiving_type, j.other_requirements, j.date_posted,
+           u.given_name || ' ' || u.surname AS member_name
+    FROM job j
+    LEFT JOIN app_user u ON u.user_id = j.member_user_id
+    WHERE j.job_id = %s
+"""
+
+
+class Subscription:
+    """One open feed: its filters and the queue of (event, job_id, data) it has yet to send."""
+
+    def __init__(self, caregiving_type=None, locality_id=None, by_town=False):
+        self.caregiving_type = caregiving_type
+        self.locality_id = locality_id
+        self.by_town = by_town
+        self.queue = queue.Queue(QUEUE_SIZE)
+
+    def matches(self, caregiving_type, locality_id):
+        return ((self.caregiving_type is None or caregiving_type == self.caregiving_type)
+                and (not self.by_town or locality_id == self.locality_id))
+
+    def offer(self, item):
+        """Queue ``item``; False if the feed is too far behind and was closed instead."""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    def close(self):
+        # drop the backlog and leave the end-of-feed marker, even when full
+        with self.queue.mutex:
+            self.queue.queue.clear()
+        self.queue.put_nowait(None)
+
+
+class JobFeed:
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._engine = None
+
+    def subscribe(self, **filters):
+        sub = Subscription(**filters)
+        with self._lock:
+            self._subscribers.add(sub)
+            if self._thread is None or not self._thread.is_alive():
+                # started on first use, so it runs in the worker and not in a pre-fork master
+                self._thread = threading.Thread(target=self._run, name="jobfeed", daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    # -- listener thread -----------------------------------------------------
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except (SQLAlchemyError, psycopg2.Error, OSError) as e:
+                log.warning("job feed listener lost its connection: %s", str(e).strip().splitlines()[0])
+            # anything sent while we were not listening is lost: let every feed reconnect and replay
+            with self._lock:
+                subscribers, self._subscribers = self._subscribers, set()
+            for sub in subscribers:
+                sub.close()
+            time.sleep(RECONNECT_SECONDS)
+
+    def _listen(self):
+        if self._engine is None:
+            self._engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0,
+                                       idle_in_transaction_timeout_ms=0)
+        raw = self._engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CHANNEL}")
+            while True:
+                if select.select([conn], [], [], POLL_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._dispatch(cur, json.loads(conn.notifies.pop(0).payload))
+        finally:
+            raw.invalidate()
+
+    def _dispatch(self, cur, change):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        job_id, locality_id = change["job_id"], change["locality_id"]
+        removed = ("removed", None, {"job_id": job_id})
+        job = None
+        for sub in subscribers:
+            if change["op"] == "delete":
+                # the member's address may already be gone (cascade), so town is not checked
+                item = removed if sub.matches(change["type"], sub.locality_id) else None
+            elif sub.matches(change["type"], locality_id):
+                if job is None:
+                    cur.execute(JOB_ROW, (job_id,))
+                    row = cur.fetchone()
+                    if row is None:   # deleted again since; its delete is on the way
+                        return
+                    job = dict(zip([c.name for c in cur.description], row))
+                # an edit keeps the feed position: only new postings advance Last-Event-ID
+                item = ("job", job_id if change["op"] == "insert" else None, job)
+            elif change["old_type"] and sub.matches(change["old_type"], locality_id):
+                item = removed   # edited out of this feed's filter
+            else:
+                item = None
+            if item is not None and not sub.offer(item):
+                self.unsubscribe(sub)
+
+
+feed = JobFeed()
+
+
+def format_event(event, event_id, data):
+    """One Server-Sent Events message."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, default=str, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
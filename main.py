@@ -1,21 +1,47 @@
 #!/usr/bin/env python3
 """
 main.py - Part 2 runner for Caregivers platform (SQLAlchemy + textual SQL)
+
+Runs in two phases:
+
+  1. Mutations (3.x, 4.x, 8) run one after another, in the order listed,
+     each in its own transaction followed by a query showing its effect.
+  2. Reports (5.x - 8) run concurrently on --workers connections. One
+     coordinating transaction exports its snapshot (pg_export_snapshot) and
+     every worker imports it (SET TRANSACTION SNAPSHOT), so all reports see
+     exactly the same data however long they take.
+
+    python main.py                    # everything
+    python main.py --only 5.1 6.2     # just these steps
+    python main.py --list             # step names
+    python main.py --workers 8
+    python main.py --since 2025-01-01 # appointment reports from this date on
+
+appointment is partitioned by month (migration 0010): --since lets the
+appointment reports read only the partitions from that month on.
 """
 
-from sqlalchemy import create_engine, text
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
-from config import DB_URL  # single source of truth
+from db import make_engine  # single source of truth
 
-engine = create_engine(DB_URL, echo=False, future=True)
+DEFAULT_WORKERS = 4
+PRINT_LIMIT = 20
+
+engine = None   # created in main() with a pool sized for --workers
 
 
 def run(sql, params=None, fetch=False):
-    """Helper to run SQL and optionally fetch results."""
+    """Helper to run SQL and optionally fetch the first PRINT_LIMIT + 1 rows."""
     try:
         with engine.begin() as conn:
             if fetch:
-                return conn.execute(text(sql), params or {}).fetchall()
+                return fetch_for_print(conn, sql, params)
             else:
                 conn.execute(text(sql), params or {})
     except SQLAlchemyError as e:
@@ -23,88 +49,114 @@ def run(sql, params=None, fetch=False):
         raise
 
 
-def print_rows(rows, limit=20):
+def fetch_for_print(conn, sql, params=None):
+    # server-side cursor: only the rows print_rows can show ever leave the database
+    result = conn.execution_options(stream_results=True).execute(text(sql), params or {})
+    try:
+        return result.fetchmany(PRINT_LIMIT + 1)
+    finally:
+        result.close()
+
+
+def print_rows(rows, limit=PRINT_LIMIT):
     if not rows:
         print("(0 rows)")
         return
     for r in rows[:limit]:
         print(r)
     if len(rows) > limit:
-        print(f"... {len(rows)} rows total (showing {limit})")
+        print(f"... more rows (showing {limit})")
 
 
-def main():
-    print("== Part 2 script started ==")
+class Mutation:
+    """Statements run in order in one transaction, then ``check`` shows the result."""
+
+    def __init__(self, name, title, *statements, check=None):
+        self.name = name
+        self.title = title
+        self.statements = statements
+        self.check = check
+
+
+class Report:
+    """A read-only query; runs concurrently with the other reports."""
+
+    def __init__(self, name, title, sql):
+        self.name = name
+        self.title = title
+        self.sql = sql
 
-    print("\n-- 3.1 Update Arman's phone number --")
-    run("""
+
+MUTATIONS = [
+    Mutation("3.1", "Update Arman's phone number", """
         UPDATE app_user
         SET phone_number = '+77773414141'
         WHERE given_name = 'Arman' AND surname = 'Armanov'
-    """)
-    rows = run("""
+    """, check="""
         SELECT user_id, given_name, surname, phone_number
         FROM app_user
         WHERE given_name = 'Arman'
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 3.2 Add 10% commission to caregivers' hourly rate --")
     # hourly_rate is stored as an integer KZT value (e.g. 4500)
     # round to nearest 100 after applying the increase
-    run("""
+    Mutation("3.2", "Add 10% commission to caregivers' hourly rate", """
         UPDATE caregiver
         SET hourly_rate = ROUND((hourly_rate * 1.10) / 100.0) * 100
-    """)
-    rows = run("""
+    """, check="""
         SELECT caregiver_user_id, hourly_rate
         FROM caregiver
         ORDER BY caregiver_user_id
-    """, fetch=True)
-    print_rows(rows)
-
-    print("\n-- 4.1 Delete jobs posted by Amina Aminova --")
-    # delete dependent job_applications first, then the jobs
-    run("""
-        DELETE FROM job_application
-        WHERE job_id IN (
-            SELECT j.job_id
-            FROM job j
-            JOIN app_user u ON j.member_user_id = u.user_id
-            WHERE u.given_name = 'Amina' AND u.surname = 'Aminova'
-        )
-    """)
-    run("""
+    """),
+
+    # job_application rows go with their jobs (ON DELETE CASCADE)
+    Mutation("4.1", "Delete jobs posted by Amina Aminova", """
         DELETE FROM job
         WHERE member_user_id IN (
             SELECT u.user_id
             FROM app_user u
             WHERE u.given_name = 'Amina' AND u.surname = 'Aminova'
         )
-    """)
-    rows = run("""
+    """, check="""
         SELECT job_id, member_user_id, other_requirements
         FROM job
         ORDER BY job_id
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 4.2 Delete members who live on Kabanbay Batyr (full cascade) --")
     # The schema uses ON DELETE CASCADE throughout, so deleting the member
     # automatically removes their address, jobs, job_applications, and appointments.
-    run("""
+    Mutation("4.2", "Delete members who live on Kabanbay Batyr (full cascade)", """
         DELETE FROM member
         WHERE member_user_id IN (
-            SELECT member_user_id FROM address WHERE street ILIKE 'Kabanbay Batyr'
+            -- same case-insensitive equality as ILIKE, served by address_street_lower_idx
+            SELECT member_user_id FROM address WHERE lower(street) = lower('Kabanbay Batyr')
         )
-    """)
-    rows = run("""
+    """, check="""
         SELECT member_user_id, house_rules FROM member ORDER BY member_user_id
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 5.1 Caregiver + Member names for accepted appointments --")
-    rows = run("""
+    Mutation("8", "Create VIEW view_job_applications_applicants", """
+        DROP VIEW IF EXISTS view_job_applications_applicants
+    """, """
+        CREATE VIEW view_job_applications_applicants AS
+        SELECT j.job_id,
+               j.member_user_id,
+               au.given_name         AS member_name,
+               j.required_caregiving_type,
+               j.other_requirements,
+               ja.caregiver_user_id,
+               ac.given_name         AS caregiver_name,
+               ja.date_applied
+        FROM job j
+        LEFT JOIN job_application ja ON j.job_id              = ja.job_id
+        LEFT JOIN member m           ON j.member_user_id      = m.member_user_id
+        LEFT JOIN app_user au        ON m.member_user_id      = au.user_id
+        LEFT JOIN app_user ac        ON ja.caregiver_user_id  = ac.user_id
+    """),
+]
+
+REPORTS = [
+    Report("5.1", "Caregiver + Member names for accepted appointments", """
         SELECT a.appointment_id,
                uc.given_name AS caregiver_name,
                um.given_name AS member_name,
@@ -116,132 +168,208 @@ def main():
         JOIN app_user uc  ON c.caregiver_user_id  = uc.user_id
         JOIN member m     ON a.member_user_id      = m.member_user_id
         JOIN app_user um  ON m.member_user_id      = um.user_id
-        WHERE a.status = 'accepted'
+        WHERE a.status = 'accepted' AND a.appointment_date >= :since
         ORDER BY a.appointment_date
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 5.2 Jobs containing 'soft-spoken' --")
-    rows = run("""
+    # phrase match on the GIN-indexed search_tsv column instead of a leading-wildcard ILIKE
+    Report("5.2", "Jobs containing 'soft-spoken'", """
         SELECT job_id, other_requirements
         FROM job
-        WHERE other_requirements ILIKE '%soft-spoken%'
-    """, fetch=True)
-    print_rows(rows)
+        WHERE search_tsv @@ phraseto_tsquery('english', 'soft-spoken')
+    """),
 
-    print("\n-- 5.3 Work hours of all babysitter appointments --")
-    rows = run("""
+    Report("5.3", "Work hours of all babysitter appointments", """
         SELECT a.appointment_id, a.work_hours, uc.given_name
         FROM appointment a
         JOIN caregiver c ON a.caregiver_user_id = c.caregiver_user_id
         JOIN app_user uc ON c.caregiver_user_id  = uc.user_id
-        WHERE c.caregiving_type = 'babysitter'
-    """, fetch=True)
-    print_rows(rows)
+        WHERE c.caregiving_type = 'babysitter' AND a.appointment_date >= :since
+    """),
 
-    print("\n-- 5.4 Members looking for elderly care in Astana with 'No pets.' --")
-    rows = run("""
-        SELECT DISTINCT um.user_id, um.given_name, um.surname, ad.town, m.house_rules
-        FROM job
-        JOIN member m    ON job.member_user_id  = m.member_user_id
-        JOIN app_user um ON m.member_user_id    = um.user_id
-        LEFT JOIN address ad ON m.member_user_id = ad.member_user_id
-        WHERE job.required_caregiving_type = 'elderly'
-          AND (ad.town ILIKE 'Astana' OR um.city ILIKE 'Astana')
+    # "Astana" resolves through locality_alias (so Nur-Sultan etc. match too),
+    # and each side of the old OR becomes an indexed equality on locality_id.
+    # house_rules keeps its exact substring semantics; the ILIKE is served by
+    # member_house_rules_trgm_idx (pg_trgm) rather than a sequential scan
+    Report("5.4", "Members looking for elderly care in Astana with 'No pets.'", """
+        WITH place AS (
+            SELECT locality_id FROM locality_alias WHERE alias_key = locality_key('Astana')
+        ),
+        located AS (
+            SELECT ad.member_user_id FROM address ad JOIN place p ON ad.locality_id = p.locality_id
+            UNION
+            SELECT u.user_id FROM app_user u JOIN place p ON u.locality_id = p.locality_id
+        )
+        SELECT um.user_id, um.given_name, um.surname, ad.town, m.house_rules
+        FROM located l
+        JOIN member m    ON m.member_user_id = l.member_user_id
+        JOIN app_user um ON um.user_id       = m.member_user_id
+        LEFT JOIN address ad ON ad.member_user_id = m.member_user_id
+        WHERE EXISTS (SELECT 1 FROM job
+                      WHERE job.member_user_id = m.member_user_id
+                        AND job.required_caregiving_type = 'elderly')
           AND m.house_rules ILIKE '%No pets.%'
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 6.1 Count applicants per job --")
-    rows = run("""
+    # 6.x and 7 read the trigger-maintained summary tables from migration 0004
+    # (job_applicant_count, caregiver_accepted_stats); `python aggregates.py
+    # verify` checks them against a full recompute.
+    Report("6.1", "Count applicants per job", """
         SELECT j.job_id,
                j.member_user_id,
-               COUNT(ja.caregiver_user_id) AS applicant_count
+               COALESCE(jc.applicant_count, 0) AS applicant_count
         FROM job j
-        LEFT JOIN job_application ja ON j.job_id = ja.job_id
-        GROUP BY j.job_id, j.member_user_id
+        LEFT JOIN job_applicant_count jc ON jc.job_id = j.job_id
         ORDER BY j.job_id
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 6.2 Total hours worked by caregivers (accepted only) --")
-    rows = run("""
-        SELECT c.caregiver_user_id,
+    Report("6.2", "Total hours worked by caregivers (accepted only)", """
+        SELECT s.caregiver_user_id,
                au.given_name,
-               SUM(a.work_hours) AS total_hours
-        FROM appointment a
-        JOIN caregiver c ON a.caregiver_user_id = c.caregiver_user_id
-        JOIN app_user au ON c.caregiver_user_id  = au.user_id
-        WHERE a.status = 'accepted'
-        GROUP BY c.caregiver_user_id, au.given_name
+               s.accepted_hours AS total_hours
+        FROM caregiver_accepted_stats s
+        JOIN app_user au ON s.caregiver_user_id = au.user_id
+        WHERE s.accepted_count > 0
         ORDER BY total_hours DESC
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 6.3 Average caregiver pay (accepted appointments) --")
-    rows = run("""
-        SELECT AVG(c.hourly_rate) AS avg_hourly_rate
-        FROM caregiver c
-        JOIN appointment a ON a.caregiver_user_id = c.caregiver_user_id
-        WHERE a.status = 'accepted'
-    """, fetch=True)
-    print_rows(rows)
+    # AVG over accepted appointments == rates weighted by each caregiver's accepted count
+    Report("6.3", "Average caregiver pay (accepted appointments)", """
+        SELECT SUM(c.hourly_rate * s.accepted_count)::numeric / NULLIF(SUM(s.accepted_count), 0)
+               AS avg_hourly_rate
+        FROM caregiver_accepted_stats s
+        JOIN caregiver c ON c.caregiver_user_id = s.caregiver_user_id
+        WHERE s.accepted_count > 0 AND c.hourly_rate IS NOT NULL
+    """),
 
-    print("\n-- 6.4 Caregivers earning above average --")
-    rows = run("""
+    Report("6.4", "Caregivers earning above average", """
         WITH avg_rate AS (
-            SELECT AVG(c.hourly_rate) AS avg_hourly
-            FROM caregiver c
-            JOIN appointment a ON a.caregiver_user_id = c.caregiver_user_id
-            WHERE a.status = 'accepted'
+            SELECT SUM(c.hourly_rate * s.accepted_count)::numeric / NULLIF(SUM(s.accepted_count), 0)
+                   AS avg_hourly
+            FROM caregiver_accepted_stats s
+            JOIN caregiver c ON c.caregiver_user_id = s.caregiver_user_id
+            WHERE s.accepted_count > 0 AND c.hourly_rate IS NOT NULL
         )
-        SELECT DISTINCT c.caregiver_user_id, au.given_name, c.hourly_rate
+        SELECT c.caregiver_user_id, au.given_name, c.hourly_rate
         FROM caregiver c
         JOIN app_user au ON c.caregiver_user_id = au.user_id
         CROSS JOIN avg_rate
         WHERE c.hourly_rate > avg_rate.avg_hourly
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 7. Total cost for each caregiver (accepted appointments) --")
-    rows = run("""
-        SELECT c.caregiver_user_id,
+    Report("7", "Total cost for each caregiver (accepted appointments)", """
+        SELECT s.caregiver_user_id,
                au.given_name,
-               SUM(c.hourly_rate * a.work_hours) AS total_payment
-        FROM caregiver c
-        JOIN appointment a ON a.caregiver_user_id = c.caregiver_user_id
-        JOIN app_user au   ON c.caregiver_user_id  = au.user_id
-        WHERE a.status = 'accepted'
-        GROUP BY c.caregiver_user_id, au.given_name
+               c.hourly_rate * s.accepted_hours AS total_payment
+        FROM caregiver_accepted_stats s
+        JOIN caregiver c ON c.caregiver_user_id = s.caregiver_user_id
+        JOIN app_user au ON s.caregiver_user_id = au.user_id
+        WHERE s.accepted_count > 0
         ORDER BY total_payment DESC
-    """, fetch=True)
-    print_rows(rows)
+    """),
 
-    print("\n-- 8. Create VIEW view_job_applications_applicants --")
-    run("DROP VIEW IF EXISTS view_job_applications_applicants")
-    run("""
-        CREATE VIEW view_job_applications_applicants AS
-        SELECT j.job_id,
-               j.member_user_id,
-               au.given_name         AS member_name,
-               j.required_caregiving_type,
-               j.other_requirements,
-               ja.caregiver_user_id,
-               ac.given_name         AS caregiver_name,
-               ja.date_applied
-        FROM job j
-        LEFT JOIN job_application ja ON j.job_id              = ja.job_id
-        LEFT JOIN member m           ON j.member_user_id      = m.member_user_id
-        LEFT JOIN app_user au        ON m.member_user_id      = au.user_id
-        LEFT JOIN app_user ac        ON ja.caregiver_user_id  = ac.user_id
-    """)
-    rows = run("""
+    Report("8", "Rows of view_job_applications_applicants", """
         SELECT * FROM view_job_applications_applicants ORDER BY job_id LIMIT 50
-    """, fetch=True)
-    print_rows(rows)
+    """),
+]
 
+STEP_NAMES = list(dict.fromkeys([m.name for m in MUTATIONS] + [r.name for r in REPORTS]))
+
+
+# ---------------------------------------------------------------------------
+# Phase 1: mutations, in order
+# ---------------------------------------------------------------------------
+
+def run_mutation(m):
+    print(f"\n-- {m.name} {m.title} --")
+    started = time.perf_counter()
+    try:
+        with engine.begin() as conn:
+            for sql in m.statements:
+                conn.execute(text(sql))
+    except SQLAlchemyError as e:
+        print("SQL ERROR:", e)
+        raise
+    print(f"({(time.perf_counter() - started) * 1000:.1f} ms)")
+    if m.check:
+        print_rows(run(m.check, fetch=True))
+
+
+# ---------------------------------------------------------------------------
+# Phase 2: reports, concurrently on one shared snapshot
+# ---------------------------------------------------------------------------
+
+def _snapshot_transaction(conn):
+    return conn.execution_options(isolation_level="REPEATABLE READ").begin()
+
+
+def run_report(report, snapshot_id, params):
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        with _snapshot_transaction(conn):
+            # must come before the first query of the transaction
+            conn.execute(text("SET TRANSACTION SNAPSHOT :sid"), {"sid": snapshot_id})
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+            rows = fetch_for_print(conn, report.sql, params)
+    return rows, time.perf_counter() - started
+
+
+def run_reports(reports, workers, params):
+    """Run ``reports`` concurrently with bind ``params``; print them in list order with their timings."""
+    if not reports:
+        return
+    started = time.perf_counter()
+    with engine.connect() as coordinator:
+        # the exported snapshot stays importable while this transaction is open
+        with _snapshot_transaction(coordinator):
+            snapshot_id = coordinator.execute(text("SELECT pg_export_snapshot()")).scalar()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(run_report, r, snapshot_id, params) for r in reports]
+                for report, future in zip(reports, futures):
+                    print(f"\n-- {report.name} {report.title} --")
+                    try:
+                        rows, elapsed = future.result()
+                    except SQLAlchemyError as e:
+                        print("SQL ERROR:", e)
+                        continue
+                    count = f"{len(rows)}" if len(rows) <= PRINT_LIMIT else f"over {PRINT_LIMIT}"
+                    print(f"({elapsed * 1000:.1f} ms, {count} rows)")
+                    print_rows(rows)
+    print(f"\n{len(reports)} reports in {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"on {workers} connections (snapshot {snapshot_id})")
+
+
+def main():
+    global engine
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", metavar="STEP", choices=STEP_NAMES,
+                        help="run only these steps (see --list)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"concurrent report connections (default {DEFAULT_WORKERS})")
+    parser.add_argument("--since", type=date.fromisoformat, default=date.min, metavar="YYYY-MM-DD",
+                        help="appointment reports cover appointments from this date on (default: all)")
+    parser.add_argument("--list", action="store_true", help="list step names and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for m in MUTATIONS:
+            print(f"{m.name:5} mutation  {m.title}")
+        for r in REPORTS:
+            print(f"{r.name:5} report    {r.title}")
+        return
+
+    selected = set(args.only or STEP_NAMES)
+    workers = max(args.workers, 1)
+    # one connection per worker plus the snapshot coordinator
+    engine = make_engine(pool_size=workers + 1, max_overflow=0, statement_timeout_ms=0)
+
+    print("== Part 2 script started ==")
+    for m in MUTATIONS:
+        if m.name in selected:
+            run_mutation(m)
+    run_reports([r for r in REPORTS if r.name in selected], workers, {"since": args.since})
     print("\n== Part 2 COMPLETE ==")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,403 @@
+"""
+matching.py - caregiver <-> job matching on in-memory numpy indices
+
+Two column-oriented indices are held per process: every caregiver (type,
+city, hourly rate, accepted hours, applications per caregiving type) and
+every job (type, the member's town, the rate the member has paid before,
+posting date). Scoring a job against all caregivers, or a caregiver
+against all jobs, is a handful of vectorized operations followed by
+np.argpartition for the top k, so a request never scans tables in SQL.
+
+A job's caregivers are scored as a weighted sum in [0, 1], over
+caregivers of the required type only:
+
+    town     1 if the caregiver's city and the member's address town resolve
+             to the same locality (see migration 0006)
+    rate     exp(-|log(rate / reference)|), the reference being the average
+             rate of caregivers the member has accepted before, else the
+             median rate for the type
+    hours    accepted appointment hours, log-scaled against the maximum
+    history  applications the caregiver made to jobs of this type, log-scaled
+
+Jobs recommended to a caregiver use the same town and rate terms, with the
+hours and history weight given to how recently the job was posted, and
+skip jobs the caregiver has already applied to.
+
+Indices refresh lazily when used: at most every REFRESH_SECONDS they load
+rows whose ids were marked dirty in this process plus any id above the
+highest one seen. Every FULL_REFRESH_SECONDS they reload completely (which
+also picks up changes made through other workers) in a background thread,
+on an engine of their own without statement_timeout; the rows are streamed
+LOAD_BATCH_ROWS at a time into the column arrays, and requests keep
+scoring against the previous arrays until the new ones are swapped in.
+Only a worker's first load can hold a request, for FIRST_LOAD_WAIT_SECONDS
+at most; warm_up() starts it before the worker accepts requests.
+"""
+
+import functools
+import logging
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import make_engine
+
+log = logging.getLogger(__name__)
+
+CAREGIVING_TYPES = ("babysitter", "elderly", "playmate")
+TYPE_CODE = {t: i for i, t in enumerate(CAREGIVING_TYPES)}
+
+REFRESH_SECONDS = 5
+FULL_REFRESH_SECONDS = 300
+RELOAD_RETRY_SECONDS = 30       # after a failed full reload
+FIRST_LOAD_WAIT_SECONDS = 10
+LOAD_BATCH_ROWS = 10_000
+DEFAULT_TOP_K = 20
+
+WEIGHTS = {"town": 0.40, "rate": 0.25, "hours": 0.20, "history": 0.15}
+RECENCY_DAYS = 30   # recommended jobs: weight of a posting halves roughly every 3 weeks
+
+
+CAREGIVER_SQL = """
+    SELECT c.caregiver_user_id AS id, c.caregiving_type, c.hourly_rate,
+           u.locality_id AS town,
+           coalesce(s.accepted_hours, 0) AS accepted_hours,
+           coalesce(h.babysitter, 0) AS apps_babysitter,
+           coalesce(h.elderly, 0) AS apps_elderly,
+           coalesce(h.playmate, 0) AS apps_playmate
+    FROM caregiver c
+    JOIN app_user u ON u.user_id = c.caregiver_user_id
+    LEFT JOIN caregiver_accepted_stats s ON s.caregiver_user_id = c.caregiver_user_id
+    LEFT JOIN LATERAL (
+        SELECT count(*) FILTER (WHERE j.required_caregiving_type = 'babysitter') AS babysitter,
+               count(*) FILTER (WHERE j.required_caregiving_type = 'elderly')    AS elderly,
+               count(*) FILTER (WHERE j.required_caregiving_type = 'playmate')   AS playmate
+        FROM job_application ja JOIN job j ON j.job_id = ja.job_id
+        WHERE ja.caregiver_user_id = c.caregiver_user_id
+    ) h ON true
+    {where}
+"""
+
+JOB_SQL = """
+    SELECT j.job_id AS id, j.required_caregiving_type, j.date_posted,
+           a.locality_id AS town, r.ref_rate
+    FROM job j
+    LEFT JOIN address a ON a.member_user_id = j.member_user_id
+    LEFT JOIN LATERAL (
+        SELECT avg(c.hourly_rate) AS ref_rate
+        FROM appointment ap JOIN caregiver c ON c.caregiver_user_id = ap.caregiver_user_id
+        WHERE ap.member_user_id = j.member_user_id AND ap.status = 'accepted'
+    ) r ON true
+    {where}
+"""
+
+
+@functools.cache
+def loader_engine():
+    # full reloads read every row: no statement_timeout, and off the request pool
+    return make_engine(pool_size=2, max_overflow=0, statement_timeout_ms=0)
+
+
+class _Index:
+    """Columns keyed by row position; ``pos`` maps an id to its row.
+
+    Refreshes build new arrays and swap them in under the lock, so readers
+    always see a consistent set of columns. ``refresh_lock`` only serializes
+    incremental refreshes; a full reload runs in ``reload_thread``.
+    """
+
+    sql = None
+    id_column = None
+    columns = ()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.dirty = set()
+        self.pos = {}
+        self.ids = np.empty(0, dtype=np.int64)
+        self.live = np.empty(0, dtype=bool)
+        self.max_id = 0
+        self.loaded = threading.Event()
+        self.reload_thread = None
+        self.reload_due = 0.0   # monotonic time the next full reload may start
+        self.reload_dirty = None   # ids refreshed into the old arrays while a reload runs
+        self.loaded_at = self.refreshed_at = 0.0
+
+    def mark_dirty(self, *ids):
+        with self.lock:
+            self.dirty.update(int(i) for i in ids if i is not None)
+
+    def ensure_fresh(self, db, force=False):
+        self.start_reload()
+        if not self.loaded.is_set():
+            thread = self.reload_thread
+            if thread is not None:
+                thread.join(FIRST_LOAD_WAIT_SECONDS)
+            if not self.loaded.is_set():
+                return   # score against the empty index rather than hold the request
+        with self.refresh_lock:
+            now = time.monotonic()
+            if force or now - self.refreshed_at >= REFRESH_SECONDS:
+                self._incremental(db, now)
+
+    def start_reload(self):
+        """Start a full reload in the background if one is due and none is running."""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.reload_due or (self.reload_thread is not None and self.reload_thread.is_alive()):
+                return
+            self.reload_due = now + FULL_REFRESH_SECONDS
+            self.reload_dirty = set()
+            self.reload_thread = threading.Thread(target=self._reload, name=f"matching-{self.__class__.__name__}",
+                                                  daemon=True)
+            self.reload_thread.start()
+
+    def _reload(self):
+        started = time.monotonic()
+        try:
+            ids, cols = self._load_all()
+        except SQLAlchemyError as e:
+            log.warning("%s full reload failed: %s", self.__class__.__name__, str(e).strip().splitlines()[0])
+            with self.lock:
+                self.reload_dirty = None
+                self.reload_due = time.monotonic() + RELOAD_RETRY_SECONDS
+            return
+        with self.lock:
+            # rows refreshed into the old arrays during the load may be newer than
+            # what the load read; refresh them again on top of the new arrays
+            self.dirty |= self.reload_dirty
+            self.reload_dirty = None
+            self.ids = ids
+            self.live = np.ones(len(ids), dtype=bool)
+            self.pos = {int(i): n for n, i in enumerate(ids)}
+            self._set_columns(cols)
+            self.max_id = int(ids.max()) if len(ids) else 0
+            self.loaded_at = self.refreshed_at = started
+        self.loaded.set()
+        log.info("%s loaded %d rows in %.1fs", self.__class__.__name__, len(ids), time.monotonic() - started)
+
+    def _load_all(self):
+        """(ids, {column: array}) for every row, read LOAD_BATCH_ROWS at a time."""
+        ids, parts = [np.empty(0, dtype=np.int64)], [self._to_columns([])]
+        with loader_engine().connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=LOAD_BATCH_ROWS).execute(
+                text(self.sql.format(where="")))
+            for rows in result.partitions():
+                ids.append(np.fromiter((r.id for r in rows), dtype=np.int64, count=len(rows)))
+                parts.append(self._to_columns(rows))
+        return np.concatenate(ids), {name: np.concatenate([p[name] for p in parts]) for name in self.columns}
+
+    def _incremental(self, db, now):
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            max_id = self.max_id
+            if self.reload_dirty is not None:
+                self.reload_dirty |= dirty
+        where = f"WHERE {self.id_column} > :max_id OR {self.id_column} = ANY(:ids)"
+        rows = db.execute(text(self.sql.format(where=where)),
+                          {"max_id": max_id, "ids": sorted(dirty)}).all()
+        if not rows and not dirty:
+            self.refreshed_at = now
+            return
+        with self.lock:
+            found = {r.id for r in rows}
+            updates = self._to_columns([r for r in rows if r.id in self.pos])
+            added = [r for r in rows if r.id not in self.pos]
+            live = self.live.copy()
+            pos = dict(self.pos) if added else self.pos
+            cols = {name: getattr(self, name).copy() for name in self.columns}
+            rows_at = np.array([self.pos[r.id] for r in rows if r.id in self.pos], dtype=np.int64)
+            for name in self.columns:
+                cols[name][rows_at] = updates[name]
+            for i in dirty - found:   # deleted since the last load
+                if i in self.pos:
+                    live[self.pos[i]] = False
+            if added:
+                new = self._to_columns(added)
+                start = len(self.ids)
+                self.ids = np.concatenate([self.ids, np.array([r.id for r in added], dtype=np.int64)])
+                live = np.concatenate([live, np.ones(len(added), dtype=bool)])
+                cols = {name: np.concatenate([cols[name], new[name]]) for name in self.columns}
+                for n, r in enumerate(added):
+                    pos[r.id] = start + n
+                self.max_id = max(self.max_id, max(r.id for r in added))
+            self.live = live
+            self.pos = pos
+            self._set_columns(cols)
+            self.refreshed_at = now
+
+    def _set_columns(self, cols):
+        for name in self.columns:
+            setattr(self, name, cols[name])
+
+    def snapshot(self):
+        """(ids, live, pos, {column: array}) as of the last refresh."""
+        with self.lock:
+            return self.ids, self.live, self.pos, {name: getattr(self, name) for name in self.columns}
+
+
+class CaregiverIndex(_Index):
+    sql = CAREGIVER_SQL
+    id_column = "c.caregiver_user_id"
+    columns = ("type_code", "town_code", "rate", "hours", "apps")
+
+    def __init__(self):
+        super().__init__()
+        self.type_code = np.empty(0, dtype=np.int8)
+        self.town_code = np.empty(0, dtype=np.int32)
+        self.rate = np.empty(0, dtype=np.float32)
+        self.hours = np.empty(0, dtype=np.float32)
+        self.apps = np.empty((0, len(CAREGIVING_TYPES)), dtype=np.float32)
+        self.median_rates = np.full(len(CAREGIVING_TYPES), np.nan, dtype=np.float32)
+
+    @staticmethod
+    def _to_columns(rows):
+        return {
+            "type_code": np.array([TYPE_CODE.get(r.caregiving_type, -1) for r in rows], dtype=np.int8),
+            "town_code": np.array([r.town or 0 for r in rows], dtype=np.int32),
+            "rate": np.array([r.hourly_rate or np.nan for r in rows], dtype=np.float32),
+            "hours": np.array([r.accepted_hours for r in rows], dtype=np.float32),
+            "apps": np.array([[r.apps_babysitter, r.apps_elderly, r.apps_playmate] for r in rows],
+                             dtype=np.float32).reshape(len(rows), len(CAREGIVING_TYPES)),
+        }
+
+    def _set_columns(self, cols):
+        super()._set_columns(cols)
+        # median hourly rate per type code, for members with no booking history
+        medians = np.full(len(CAREGIVING_TYPES), np.nan, dtype=np.float32)
+        for code in range(len(CAREGIVING_TYPES)):
+            rates = cols["rate"][cols["type_code"] == code]
+            rates = rates[~np.isnan(rates)]
+            if len(rates):
+                medians[code] = np.median(rates)
+        self.median_rates = medians
+
+
+class JobIndex(_Index):
+    sql = JOB_SQL
+    id_column = "j.job_id"
+    columns = ("type_code", "town_code", "ref_rate", "posted_day")
+
+    def __init__(self):
+        super().__init__()
+        self.type_code = np.empty(0, dtype=np.int8)
+        self.town_code = np.empty(0, dtype=np.int32)
+        self.ref_rate = np.empty(0, dtype=np.float32)
+        self.posted_day = np.empty(0, dtype=np.int32)
+
+    @staticmethod
+    def _to_columns(rows):
+        return {
+            "type_code": np.array([TYPE_CODE.get(r.required_caregiving_type, -1) for r in rows],
+                                  dtype=np.int8),
+            "town_code": np.array([r.town or 0 for r in rows], dtype=np.int32),
+            "ref_rate": np.array([r.ref_rate or np.nan for r in rows], dtype=np.float32),
+            "posted_day": np.array([r.date_posted.toordinal() if r.date_posted else 0 for r in rows],
+                                   dtype=np.int32),
+        }
+
+
+caregivers = CaregiverIndex()
+jobs = JobIndex()
+
+
+def warm_up():
+    """Start both indices' first load in the background (call in the worker, after the fork)."""
+    for index in (caregivers, jobs):
+        index.start_reload()
+
+
+# ---------------------------------------------------------------------------
+# Scoring
+# ---------------------------------------------------------------------------
+
+def _rate_fit(rate, reference):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fit = np.exp(-np.abs(np.log(rate / reference)))
+    return np.nan_to_num(fit, nan=0.0)
+
+
+def _log_scaled(values):
+    top = values.max() if len(values) else 0
+    return np.log1p(values) / np.log1p(top) if top > 0 else np.zeros_like(values)
+
+
+def _top_k(ids, scores, k):
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    order = part[np.argsort(-scores[part], kind="stable")]
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def match_caregivers(db, job_id, k=DEFAULT_TOP_K):
+    """Top ``k`` [(caregiver_user_id, score)] for ``job_id``; None if the job does not exist."""
+    caregivers.ensure_fresh(db)
+    jobs.ensure_fresh(db)
+    if job_id not in jobs.pos:   # posted through another worker since the last refresh
+        jobs.mark_dirty(job_id)
+        jobs.ensure_fresh(db, force=True)
+    _, job_live, job_pos, job = jobs.snapshot()
+    row = job_pos.get(job_id)
+    if row is None or not job_live[row]:
+        return None
+    type_code = int(job["type_code"][row])
+    if type_code < 0:   # no (known) required type: nobody matches, and -1 would index the last type
+        return []
+    town = int(job["town_code"][row])
+    reference = job["ref_rate"][row]
+    if np.isnan(reference):
+        reference = caregivers.median_rates[type_code]
+
+    ids, live, _, c = caregivers.snapshot()
+    candidates = np.flatnonzero(live & (c["type_code"] == type_code))
+    if not len(candidates):
+        return []
+    scores = (
+        WEIGHTS["town"] * ((c["town_code"][candidates] == town) & (town > 0))
+        + WEIGHTS["rate"] * _rate_fit(c["rate"][candidates], reference)
+        + WEIGHTS["hours"] * _log_scaled(c["hours"][candidates])
+        + WEIGHTS["history"] * _log_scaled(c["apps"][candidates, type_code])
+    )
+    return _top_k(ids[candidates], scores.astype(np.float32), k)
+
+
+def recommend_jobs(db, caregiver_user_id, k=DEFAULT_TOP_K, today=None):
+    """Top ``k`` [(job_id, score)] for a caregiver, excluding jobs they already applied to."""
+    caregivers.ensure_fresh(db)
+    jobs.ensure_fresh(db)
+    _, c_live, c_pos, c = caregivers.snapshot()
+    row = c_pos.get(caregiver_user_id)
+    if row is None or not c_live[row]:
+        return []
+    type_code = int(c["type_code"][row])
+    if type_code < 0:   # no (known) caregiving type: no job matches
+        return []
+    town = int(c["town_code"][row])
+    rate = c["rate"][row]
+
+    ids, live, pos, j = jobs.snapshot()
+    mask = live & (j["type_code"] == type_code)
+    applied = [r[0] for r in db.execute(text(
+        "SELECT job_id FROM job_application WHERE caregiver_user_id = :cid"), {"cid": caregiver_user_id})]
+    applied_rows = [pos[a] for a in applied if a in pos]
+    mask[applied_rows] = False
+    candidates = np.flatnonzero(mask)
+    if not len(candidates):
+        return []
+    reference = j["ref_rate"][candidates].copy()
+    missing = np.isnan(reference)
+    reference[missing] = caregivers.median_rates[type_code]
+    age = np.maximum((today or date.today()).toordinal() - j["posted_day"][candidates], 0)
+    scores = (
+        WEIGHTS["town"] * ((j["town_code"][candidates] == town) & (town > 0))
+        + WEIGHTS["rate"] * _rate_fit(rate, reference)
+        + (WEIGHTS["hours"] + WEIGHTS["history"]) * np.exp(-age / RECENCY_DAYS)
+    )
+    return _top_k(ids[candidates], scores.astype(np.float32), k)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+migrate.py - versioned schema migrations
+
+schema.sql is the baseline. Every later schema change is a file in
+migrations/ named NNNN_description.sql; each one is applied once, in version
+order, and recorded in the schema_migrations table.
+
+    psql -f schema.sql && psql -f data.sql   # new database
+    python migrate.py                        # apply pending migrations
+    python migrate.py status                 # list applied / pending
+
+A migration runs in a single transaction unless its first line is
+``-- migrate: no-transaction`` (needed for CREATE INDEX CONCURRENTLY); such
+files are executed statement by statement in autocommit mode, so they must
+be safe to re-run (IF NOT EXISTS). A CREATE INDEX CONCURRENTLY that failed
+half-way leaves an INVALID index behind, which IF NOT EXISTS would keep;
+such an index is dropped before its statement runs again.
+"""
+
+import re
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+from db import make_engine
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+NO_TRANSACTION = "-- migrate: no-transaction"
+CONCURRENT_INDEX_RE = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)", re.IGNORECASE)
+
+engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+
+
+def available_migrations():
+    """Return [(version, name, path)] for every migration file, in version order."""
+    found = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        m = re.match(r"(\d+)_(.+)\.sql$", path.name)
+        if m:
+            found.append((int(m.group(1)), m.group(2), path))
+    return found
+
+
+def applied_versions(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    INT PRIMARY KEY,
+            name       VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+    return {r[0] for r in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _split_statements(sql):
+    # Only used for no-transaction files, which hold plain DDL (no function bodies).
+    body = "\n".join(line for line in sql.splitlines() if not line.lstrip().startswith("--"))
+    return [s.strip() for s in body.split(";") if s.strip()]
+
+
+def drop_invalid_index(conn, stmt):
+    """Drop the index ``stmt`` creates concurrently if an earlier, failed run left it INVALID."""
+    m = CONCURRENT_INDEX_RE.match(stmt)
+    if not m:
+        return
+    invalid = conn.execute(text("""
+        SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)
+    """), {"name": m.group(1)}).scalar()
+    if invalid:
+        print(f"  dropping invalid index {m.group(1)} left by an earlier run")
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {m.group(1)}")
+
+
+def apply(version, name, path):
+    sql = path.read_text()
+    if sql.startswith(NO_TRANSACTION):
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for stmt in _split_statements(sql):
+                drop_invalid_index(conn, stmt)
+                # no_parameters: psycopg2 would otherwise read every '%' as a placeholder
+                conn.execution_options(no_parameters=True).exec_driver_sql(stmt)
+            conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                         {"v": version, "n": name})
+    else:
+        with engine.begin() as conn:
+            # exec_driver_sql: migration files may contain ':' casts that text() would treat as binds;
+            # no_parameters: and '%' (RAISE / format()) that psycopg2 would treat as placeholders
+            conn.execution_options(no_parameters=True).exec_driver_sql(sql)
+            conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                         {"v": version, "n": name})
+
+
+def migrate():
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    pending = [m for m in available_migrations() if m[0] not in done]
+    if not pending:
+        print("Schema is up to date.")
+        return
+    for version, name, path in pending:
+        print(f"Applying {version:04d}_{name} ...")
+        apply(version, name, path)
+    print(f"Applied {len(pending)} migration(s).")
+
+
+def status():
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    for version, name, _ in available_migrations():
+        print(f"{'applied' if version in done else 'pending':8} {version:04d}_{name}")
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "up"
+    if cmd == "up":
+        migrate()
+    elif cmd == "status":
+        status()
+    else:
+        sys.exit(f"usage: {sys.argv[0]} [up|status]")
@@ -0,0 +1,10 @@
+-- Full-text and trigram search (already part of schema.sql for new databases;
+-- written idempotently so it also upgrades databases created before it).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE job ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+  GENERATED ALWAYS AS (to_tsvector('english', coalesce(other_requirements, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS job_search_tsv_idx ON job USING GIN (search_tsv);
+CREATE INDEX IF NOT EXISTS job_other_requirements_trgm_idx ON job USING GIN (other_requirements gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS member_house_rules_trgm_idx ON member USING GIN (house_rules gin_trgm_ops);
@@ -0,0 +1,25 @@
+-- migrate: no-transaction
+-- Indexes for foreign-key hot paths. Built CONCURRENTLY so the tables stay
+-- writable while this runs on a live database.
+
+-- ON DELETE CASCADE from caregiver/member, and the per-user /appointments
+-- listing ordered by (appointment_date, appointment_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS appointment_caregiver_date_idx
+  ON appointment (caregiver_user_id, appointment_date, appointment_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS appointment_member_date_idx
+  ON appointment (member_user_id, appointment_date, appointment_id);
+
+-- accepted-appointment reports in main.py (5.1, 6.2 - 7)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS appointment_status_caregiver_idx
+  ON appointment (status, caregiver_user_id) INCLUDE (work_hours);
+
+-- ON DELETE CASCADE from member, delete_member_cascade and /applications for members
+CREATE INDEX CONCURRENTLY IF NOT EXISTS job_member_idx ON job (member_user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS address_member_idx ON address (member_user_id);
+
+-- ON DELETE CASCADE from job; the primary key leads with caregiver_user_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS job_application_job_idx
+  ON job_application (job_id, caregiver_user_id);
+
+-- /jobs filtered by required_caregiving_type, paged by job_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS job_type_id_idx ON job (required_caregiving_type, job_id);
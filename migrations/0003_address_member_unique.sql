@@ -0,0 +1,11 @@
+-- One address per member, so profile writes can use INSERT ... ON CONFLICT.
+-- Keep the most recent address of any member that has several.
+DELETE FROM address a
+USING address b
+WHERE a.member_user_id = b.member_user_id
+  AND a.address_id < b.address_id;
+
+ALTER TABLE address ADD CONSTRAINT address_member_user_id_key UNIQUE (member_user_id);
+
+-- the unique constraint's index replaces the plain one from 0002
+DROP INDEX IF EXISTS address_member_idx;
@@ -0,0 +1,89 @@
+-- Summary tables behind the main.py reports 6.1 - 7, kept current by
+-- statement-level triggers. Transition tables let one INSERT/COPY/DELETE of
+-- many rows apply a single grouped delta instead of one update per row.
+-- Deltas are joined to job / caregiver so that cascaded deletes of the
+-- parent never try to recreate its summary row. TRUNCATE is not tracked:
+-- run `python aggregates.py rebuild` after truncating either base table.
+
+CREATE TABLE job_applicant_count (
+  job_id          INT PRIMARY KEY REFERENCES job(job_id) ON DELETE CASCADE,
+  applicant_count INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE caregiver_accepted_stats (
+  caregiver_user_id INT PRIMARY KEY REFERENCES caregiver(caregiver_user_id) ON DELETE CASCADE,
+  accepted_count    INT NOT NULL DEFAULT 0,
+  accepted_hours    NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE FUNCTION job_applicant_count_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO job_applicant_count AS c (job_id, applicant_count)
+    SELECT n.job_id, count(*)
+    FROM new_rows n JOIN job j ON j.job_id = n.job_id
+    GROUP BY n.job_id
+    ON CONFLICT (job_id) DO UPDATE SET applicant_count = c.applicant_count + EXCLUDED.applicant_count;
+  END IF;
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    UPDATE job_applicant_count c
+    SET applicant_count = c.applicant_count - d.n
+    FROM (SELECT job_id, count(*) AS n FROM old_rows GROUP BY job_id) d
+    WHERE c.job_id = d.job_id;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER job_application_count_ins AFTER INSERT ON job_application
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION job_applicant_count_apply();
+CREATE TRIGGER job_application_count_upd AFTER UPDATE ON job_application
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION job_applicant_count_apply();
+CREATE TRIGGER job_application_count_del AFTER DELETE ON job_application
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION job_applicant_count_apply();
+
+CREATE FUNCTION caregiver_accepted_stats_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO caregiver_accepted_stats AS s (caregiver_user_id, accepted_count, accepted_hours)
+    SELECT n.caregiver_user_id, count(*), coalesce(sum(n.work_hours), 0)
+    FROM new_rows n JOIN caregiver c ON c.caregiver_user_id = n.caregiver_user_id
+    WHERE n.status = 'accepted'
+    GROUP BY n.caregiver_user_id
+    ON CONFLICT (caregiver_user_id) DO UPDATE
+    SET accepted_count = s.accepted_count + EXCLUDED.accepted_count,
+        accepted_hours = s.accepted_hours + EXCLUDED.accepted_hours;
+  END IF;
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    UPDATE caregiver_accepted_stats s
+    SET accepted_count = s.accepted_count - d.n,
+        accepted_hours = s.accepted_hours - d.h
+    FROM (SELECT caregiver_user_id, count(*) AS n, coalesce(sum(work_hours), 0) AS h
+          FROM old_rows WHERE status = 'accepted' GROUP BY caregiver_user_id) d
+    WHERE s.caregiver_user_id = d.caregiver_user_id;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER appointment_stats_ins AFTER INSERT ON appointment
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION caregiver_accepted_stats_apply();
+CREATE TRIGGER appointment_stats_upd AFTER UPDATE ON appointment
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION caregiver_accepted_stats_apply();
+CREATE TRIGGER appointment_stats_del AFTER DELETE ON appointment
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION caregiver_accepted_stats_apply();
+
+-- backfill
+INSERT INTO job_applicant_count (job_id, applicant_count)
+SELECT job_id, count(*) FROM job_application GROUP BY job_id;
+
+INSERT INTO caregiver_accepted_stats (caregiver_user_id, accepted_count, accepted_hours)
+SELECT caregiver_user_id, count(*), coalesce(sum(work_hours), 0)
+FROM appointment WHERE status = 'accepted' AND caregiver_user_id IS NOT NULL
+GROUP BY caregiver_user_id;
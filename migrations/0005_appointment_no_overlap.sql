@@ -0,0 +1,48 @@
+-- Each appointment gets the time range it occupies, and a caregiver can no
+-- longer hold two pending/accepted appointments whose ranges overlap. The
+-- exclusion constraint's GiST index also answers "what is booked between
+-- :from and :to" for one caregiver without reading the rest of their
+-- history (see /caregivers/<id>/availability).
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE appointment ADD COLUMN time_range TSRANGE GENERATED ALWAYS AS (
+  CASE WHEN appointment_date IS NOT NULL AND appointment_time IS NOT NULL AND work_hours IS NOT NULL
+       THEN tsrange(appointment_date + appointment_time,
+                    appointment_date + appointment_time + work_hours::float8 * interval '1 hour', '[)')
+  END
+) STORED;
+
+-- Existing double bookings would make the constraint fail. Pending bookings
+-- that overlap an accepted one, then pending bookings that overlap an
+-- earlier pending one, are declined; overlapping accepted bookings need a
+-- person to decide and abort the migration.
+UPDATE appointment p SET status = 'declined'
+WHERE p.status = 'pending'
+  AND EXISTS (SELECT 1 FROM appointment a
+              WHERE a.caregiver_user_id = p.caregiver_user_id AND a.status = 'accepted'
+                AND a.time_range && p.time_range);
+
+UPDATE appointment p SET status = 'declined'
+WHERE p.status = 'pending'
+  AND EXISTS (SELECT 1 FROM appointment e
+              WHERE e.caregiver_user_id = p.caregiver_user_id AND e.status = 'pending'
+                AND e.appointment_id < p.appointment_id AND e.time_range && p.time_range);
+
+DO $$
+DECLARE
+  n INT;
+BEGIN
+  SELECT count(*) INTO n
+  FROM appointment a JOIN appointment b
+    ON b.caregiver_user_id = a.caregiver_user_id AND b.appointment_id > a.appointment_id
+   AND b.time_range && a.time_range
+  WHERE a.status = 'accepted' AND b.status = 'accepted';
+  IF n > 0 THEN
+    RAISE EXCEPTION '% pair(s) of overlapping accepted appointments; resolve them and re-run', n;
+  END IF;
+END $$;
+
+ALTER TABLE appointment ADD CONSTRAINT appointment_no_overlap
+  EXCLUDE USING gist (caregiver_user_id WITH =, time_range WITH &&)
+  WHERE (status IN ('pending', 'accepted'));
@@ -0,0 +1,90 @@
+-- Canonical localities. app_user.city and address.town stay as entered, and
+-- a trigger resolves each to locality_id through locality_alias, keyed by
+-- locality_key(): lower-cased with whitespace and punctuation removed, so
+-- "Nur-Sultan", "nur sultan" and "NURSULTAN" share one key. Aliases map
+-- former names and Cyrillic spellings onto one locality. A value with no
+-- alias yet gets a new locality of its own; merge it later by repointing
+-- its alias row and re-running the backfill UPDATEs below.
+
+CREATE FUNCTION locality_key(name TEXT) RETURNS TEXT
+  LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT nullif(regexp_replace(lower(trim(name)), '[[:space:][:punct:]]+', '', 'g'), '')
+  $$;
+
+CREATE TABLE locality (
+  locality_id SERIAL PRIMARY KEY,
+  name        VARCHAR(100) NOT NULL UNIQUE
+);
+
+CREATE TABLE locality_alias (
+  alias_key   VARCHAR(100) PRIMARY KEY,
+  locality_id INT NOT NULL REFERENCES locality(locality_id) ON DELETE CASCADE
+);
+
+INSERT INTO locality (name) VALUES
+  ('Astana'), ('Almaty'), ('Shymkent'), ('Karaganda'), ('Atyrau'), ('Aktobe'),
+  ('Pavlodar'), ('Oskemen'), ('Semey'), ('Taraz'), ('Kostanay'), ('Kyzylorda');
+
+INSERT INTO locality_alias (alias_key, locality_id)
+SELECT locality_key(a.alias), l.locality_id
+FROM (VALUES
+  ('Astana', 'Astana'), ('Nur-Sultan', 'Astana'), ('Akmola', 'Astana'), ('Aqmola', 'Astana'),
+  ('Tselinograd', 'Astana'), ('Астана', 'Astana'), ('Нур-Султан', 'Astana'), ('Акмола', 'Astana'),
+  ('Almaty', 'Almaty'), ('Alma-Ata', 'Almaty'), ('Алматы', 'Almaty'), ('Алма-Ата', 'Almaty'),
+  ('Shymkent', 'Shymkent'), ('Chimkent', 'Shymkent'), ('Шымкент', 'Shymkent'), ('Чимкент', 'Shymkent'),
+  ('Karaganda', 'Karaganda'), ('Karagandy', 'Karaganda'), ('Qaraghandy', 'Karaganda'), ('Караганда', 'Karaganda'),
+  ('Atyrau', 'Atyrau'), ('Guryev', 'Atyrau'), ('Атырау', 'Atyrau'),
+  ('Aktobe', 'Aktobe'), ('Aqtobe', 'Aktobe'), ('Aktyubinsk', 'Aktobe'), ('Актобе', 'Aktobe'),
+  ('Pavlodar', 'Pavlodar'), ('Павлодар', 'Pavlodar'),
+  ('Oskemen', 'Oskemen'), ('Ust-Kamenogorsk', 'Oskemen'), ('Өскемен', 'Oskemen'), ('Усть-Каменогорск', 'Oskemen'),
+  ('Semey', 'Semey'), ('Semipalatinsk', 'Semey'), ('Семей', 'Semey'),
+  ('Taraz', 'Taraz'), ('Zhambyl', 'Taraz'), ('Dzhambul', 'Taraz'), ('Тараз', 'Taraz'),
+  ('Kostanay', 'Kostanay'), ('Qostanay', 'Kostanay'), ('Kustanai', 'Kostanay'), ('Костанай', 'Kostanay'),
+  ('Kyzylorda', 'Kyzylorda'), ('Qyzylorda', 'Kyzylorda'), ('Кызылорда', 'Kyzylorda')
+) AS a(alias, canonical)
+JOIN locality l ON l.name = a.canonical;
+
+CREATE FUNCTION resolve_locality(name TEXT) RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+  k   TEXT := locality_key(name);
+  lid INT;
+BEGIN
+  IF k IS NULL THEN
+    RETURN NULL;
+  END IF;
+  SELECT locality_id INTO lid FROM locality_alias WHERE alias_key = k;
+  IF FOUND THEN
+    RETURN lid;
+  END IF;
+  INSERT INTO locality (name) VALUES (initcap(trim(name)))
+  ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+  RETURNING locality_id INTO lid;
+  INSERT INTO locality_alias (alias_key, locality_id) VALUES (k, lid)
+  ON CONFLICT (alias_key) DO NOTHING;
+  -- a concurrent insert may have claimed the key first
+  SELECT locality_id INTO lid FROM locality_alias WHERE alias_key = k;
+  RETURN lid;
+END $$;
+
+ALTER TABLE app_user ADD COLUMN locality_id INT REFERENCES locality(locality_id);
+ALTER TABLE address  ADD COLUMN locality_id INT REFERENCES locality(locality_id);
+
+CREATE FUNCTION app_user_set_locality() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.locality_id := resolve_locality(NEW.city);
+  RETURN NEW;
+END $$;
+
+CREATE FUNCTION address_set_locality() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.locality_id := resolve_locality(NEW.town);
+  RETURN NEW;
+END $$;
+
+CREATE TRIGGER app_user_locality BEFORE INSERT OR UPDATE OF city ON app_user
+  FOR EACH ROW EXECUTE FUNCTION app_user_set_locality();
+CREATE TRIGGER address_locality BEFORE INSERT OR UPDATE OF town ON address
+  FOR EACH ROW EXECUTE FUNCTION address_set_locality();
+
+UPDATE app_user SET locality_id = resolve_locality(city) WHERE city IS NOT NULL;
+UPDATE address  SET locality_id = resolve_locality(town) WHERE town IS NOT NULL;
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- Equality lookups for location filters (see 0006_locality.sql).
+
+-- "members / users in <locality>": main.py 5.4, the town filter on /jobs
+CREATE INDEX CONCURRENTLY IF NOT EXISTS app_user_locality_idx ON app_user (locality_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS address_locality_idx ON address (locality_id, member_user_id);
+
+-- case-insensitive street equality (main.py 4.2)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS address_street_lower_idx ON address (lower(street));
@@ -0,0 +1,36 @@
+-- Every change to a job is announced on the job_feed channel; jobfeed.py
+-- listens once per web process and fans the changes out to the open
+-- /jobs/stream feeds. The payload stays small (ids, type, town) and the
+-- listener loads the row itself. NOTIFY is delivered at commit, so feeds
+-- never see a change that was rolled back.
+
+CREATE FUNCTION job_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  j job;
+  old_type VARCHAR;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    j := OLD;
+  ELSE
+    j := NEW;
+  END IF;
+  IF TG_OP = 'UPDATE' THEN
+    old_type := OLD.required_caregiving_type;
+  END IF;
+  PERFORM pg_notify('job_feed', json_build_object(
+    'op', lower(TG_OP),
+    'job_id', j.job_id,
+    'type', j.required_caregiving_type,
+    'old_type', old_type,
+    'locality_id', (SELECT locality_id FROM address WHERE member_user_id = j.member_user_id)
+  )::text);
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER job_notify_ins AFTER INSERT ON job
+  FOR EACH ROW EXECUTE FUNCTION job_notify();
+CREATE TRIGGER job_notify_upd AFTER UPDATE ON job
+  FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION job_notify();
+CREATE TRIGGER job_notify_del AFTER DELETE ON job
+  FOR EACH ROW EXECUTE FUNCTION job_notify();
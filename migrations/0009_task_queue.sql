@@ -0,0 +1,26 @@
+-- Durable queue for work that follows a commit (mail, notices). Tasks are
+-- inserted in the same transaction as the write they belong to, so they
+-- exist exactly when the write does; tasks.py workers claim them with
+-- FOR UPDATE SKIP LOCKED and hold a lease (locked_until) while running. A
+-- task whose worker died is claimed again once its lease has expired.
+
+CREATE TABLE task (
+  task_id      BIGSERIAL PRIMARY KEY,
+  kind         VARCHAR(50) NOT NULL,
+  payload      JSONB NOT NULL DEFAULT '{}',
+  status       VARCHAR(10) NOT NULL DEFAULT 'queued'
+                 CHECK (status IN ('queued', 'running', 'done', 'failed')),
+  attempts     INT NOT NULL DEFAULT 0,
+  max_attempts INT NOT NULL DEFAULT 5,
+  run_after    TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  last_error   TEXT,
+  created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at  TIMESTAMPTZ
+);
+
+-- what a worker looks for: ready tasks of a kind, and expired leases
+CREATE INDEX task_ready_idx ON task (kind, run_after) WHERE status = 'queued';
+CREATE INDEX task_running_idx ON task (kind, locked_until) WHERE status = 'running';
+-- pruning finished tasks
+CREATE INDEX task_finished_idx ON task (finished_at) WHERE status IN ('done', 'failed');
@@ -0,0 +1,174 @@
+-- appointment becomes a table partitioned by month of appointment_date
+-- (appointment_pYYYY_MM), so queries and reports that bound the date only
+-- read the months they need, and old months can be moved out whole:
+-- `python partitions.py archive` detaches them into archive.appointment,
+-- `python partitions.py ensure` (daily, from cron) creates the coming
+-- months. Rows for a month without a partition land in appointment_default
+-- and are moved into the month's partition when it is created.
+--
+-- Partition keys must be part of every unique constraint, so the primary
+-- key becomes (appointment_id, appointment_date) and appointment_date NOT
+-- NULL. Exclusion constraints cannot span partitions: each partition gets
+-- its own <partition>_no_overlap constraint, and a trigger checks the one
+-- case those miss, a booking that runs past midnight into the next month.
+--
+-- The table is rewritten in this transaction; run it when bookings are quiet.
+
+DO $$
+DECLARE
+  n INT;
+BEGIN
+  SELECT count(*) INTO n FROM appointment WHERE appointment_date IS NULL;
+  IF n > 0 THEN
+    RAISE EXCEPTION '% appointment(s) without a date; set or delete them and re-run', n;
+  END IF;
+END $$;
+
+ALTER TABLE appointment RENAME TO appointment_unpartitioned;
+ALTER INDEX appointment_pkey RENAME TO appointment_unpartitioned_pkey;
+ALTER INDEX appointment_caregiver_date_idx RENAME TO appointment_unpartitioned_caregiver_date_idx;
+ALTER INDEX appointment_member_date_idx RENAME TO appointment_unpartitioned_member_date_idx;
+ALTER INDEX appointment_status_caregiver_idx RENAME TO appointment_unpartitioned_status_caregiver_idx;
+ALTER TABLE appointment_unpartitioned RENAME CONSTRAINT appointment_no_overlap TO appointment_unpartitioned_no_overlap;
+
+CREATE TABLE appointment (
+  appointment_id    INT NOT NULL DEFAULT nextval('appointment_appointment_id_seq'),
+  caregiver_user_id INT REFERENCES caregiver(caregiver_user_id) ON DELETE CASCADE,
+  member_user_id    INT REFERENCES member(member_user_id)    ON DELETE CASCADE,
+  appointment_date  DATE NOT NULL,
+  appointment_time  TIME,
+  work_hours        NUMERIC(5, 2) CHECK (work_hours > 0),
+  status            VARCHAR(20) CHECK (status IN ('pending', 'accepted', 'declined')),
+  time_range        TSRANGE GENERATED ALWAYS AS (
+    CASE WHEN appointment_date IS NOT NULL AND appointment_time IS NOT NULL AND work_hours IS NOT NULL
+         THEN tsrange(appointment_date + appointment_time,
+                      appointment_date + appointment_time + work_hours::float8 * interval '1 hour', '[)')
+    END
+  ) STORED,
+  PRIMARY KEY (appointment_id, appointment_date)
+) PARTITION BY RANGE (appointment_date);
+
+-- the id sequence now belongs to the new table (and survives the old one)
+ALTER SEQUENCE appointment_appointment_id_seq OWNED BY appointment.appointment_id;
+
+CREATE TABLE appointment_default PARTITION OF appointment DEFAULT;
+ALTER TABLE appointment_default ADD CONSTRAINT appointment_default_no_overlap
+  EXCLUDE USING gist (caregiver_user_id WITH =, time_range WITH &&)
+  WHERE (status IN ('pending', 'accepted'));
+
+-- Create the partition for the month of day `month` (no-op if it exists) and
+-- move that month's rows out of appointment_default into it. Rows are moved
+-- partition to partition, below the parent's statement triggers, so the
+-- summary tables of migration 0004 are not touched.
+CREATE FUNCTION appointment_ensure_partition(month DATE) RETURNS TEXT LANGUAGE plpgsql AS $$
+DECLARE
+  first_day  DATE := date_trunc('month', month)::date;
+  next_month DATE := (date_trunc('month', month) + interval '1 month')::date;
+  part       TEXT := 'appointment_p' || to_char(month, 'YYYY_MM');
+  moving     BOOLEAN;
+BEGIN
+  IF to_regclass(part) IS NOT NULL THEN
+    RETURN part;
+  END IF;
+  SELECT EXISTS (SELECT 1 FROM appointment_default
+                 WHERE appointment_date >= first_day AND appointment_date < next_month) INTO moving;
+  IF moving THEN
+    CREATE TEMP TABLE appointment_moving ON COMMIT DROP AS
+      SELECT appointment_id, caregiver_user_id, member_user_id, appointment_date,
+             appointment_time, work_hours, status
+      FROM appointment_default WHERE false;
+    WITH gone AS (
+      DELETE FROM appointment_default
+      WHERE appointment_date >= first_day AND appointment_date < next_month
+      RETURNING appointment_id, caregiver_user_id, member_user_id, appointment_date,
+                appointment_time, work_hours, status
+    )
+    INSERT INTO appointment_moving SELECT * FROM gone;
+  END IF;
+  EXECUTE 'CREATE TABLE ' || quote_ident(part) || ' PARTITION OF appointment FOR VALUES FROM ('
+          || quote_literal(first_day) || ') TO (' || quote_literal(next_month) || ')';
+  EXECUTE 'ALTER TABLE ' || quote_ident(part) || ' ADD CONSTRAINT ' || quote_ident(part || '_no_overlap')
+          || ' EXCLUDE USING gist (caregiver_user_id WITH =, time_range WITH &&)'
+          || ' WHERE (status IN (''pending'', ''accepted''))';
+  IF moving THEN
+    EXECUTE 'INSERT INTO ' || quote_ident(part) || ' (appointment_id, caregiver_user_id, member_user_id,'
+            || ' appointment_date, appointment_time, work_hours, status) SELECT * FROM appointment_moving';
+    DROP TABLE appointment_moving;
+  END IF;
+  RETURN part;
+END;
+$$;
+
+-- a partition for every month with bookings, and for the next three
+SELECT appointment_ensure_partition(m::date)
+FROM generate_series(
+       date_trunc('month', least((SELECT min(appointment_date) FROM appointment_unpartitioned), CURRENT_DATE)),
+       date_trunc('month', greatest((SELECT max(appointment_date) FROM appointment_unpartitioned), CURRENT_DATE))
+         + interval '3 months',
+       interval '1 month') AS m;
+
+INSERT INTO appointment (appointment_id, caregiver_user_id, member_user_id, appointment_date,
+                         appointment_time, work_hours, status)
+SELECT appointment_id, caregiver_user_id, member_user_id, appointment_date,
+       appointment_time, work_hours, status
+FROM appointment_unpartitioned;
+
+DROP TABLE appointment_unpartitioned;
+
+-- same indexes as migration 0002, now one per partition
+CREATE INDEX appointment_caregiver_date_idx ON appointment (caregiver_user_id, appointment_date, appointment_id);
+CREATE INDEX appointment_member_date_idx ON appointment (member_user_id, appointment_date, appointment_id);
+CREATE INDEX appointment_status_caregiver_idx ON appointment (status, caregiver_user_id) INCLUDE (work_hours);
+
+-- the summary-table triggers of migration 0004 went with the old table;
+-- created after the copy, so the copied rows are not counted twice
+CREATE TRIGGER appointment_stats_ins AFTER INSERT ON appointment
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION caregiver_accepted_stats_apply();
+CREATE TRIGGER appointment_stats_upd AFTER UPDATE ON appointment
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION caregiver_accepted_stats_apply();
+CREATE TRIGGER appointment_stats_del AFTER DELETE ON appointment
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION caregiver_accepted_stats_apply();
+
+-- A booking that runs past midnight into the next month overlaps rows of a
+-- partition its own constraint does not see. Bookings touching a month
+-- boundary (starting on the 1st, or ending after their month) lock their
+-- caregiver and look across the boundary; all other bookings are covered
+-- by their partition's constraint alone.
+CREATE FUNCTION appointment_check_month_overlap() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  month_start DATE;
+  month_end   DATE;
+BEGIN
+  IF NEW.status NOT IN ('pending', 'accepted') OR NEW.time_range IS NULL THEN
+    RETURN NULL;
+  END IF;
+  month_start := date_trunc('month', NEW.appointment_date)::date;
+  month_end := (month_start + interval '1 month')::date;
+  IF NEW.appointment_date > month_start AND upper(NEW.time_range) <= month_end THEN
+    RETURN NULL;
+  END IF;
+  PERFORM pg_advisory_xact_lock(hashtext('appointment_month_overlap'), NEW.caregiver_user_id);
+  IF EXISTS (SELECT 1 FROM appointment a
+             WHERE a.caregiver_user_id = NEW.caregiver_user_id
+               AND a.status IN ('pending', 'accepted')
+               AND a.appointment_date >= month_start - 1 AND a.appointment_date <= upper(NEW.time_range)::date
+               AND (a.appointment_date < month_start OR a.appointment_date >= month_end)
+               AND a.time_range && NEW.time_range
+               AND a.appointment_id <> NEW.appointment_id) THEN
+    RAISE EXCEPTION 'appointment overlaps another booking of caregiver %', NEW.caregiver_user_id
+      USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'appointment_no_overlap';
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER appointment_month_overlap AFTER INSERT OR UPDATE ON appointment
+  FOR EACH ROW EXECUTE FUNCTION appointment_check_month_overlap();
+
+-- archived months keep their shape here (partitions.py archive)
+CREATE SCHEMA IF NOT EXISTS archive;
+CREATE TABLE archive.appointment (LIKE appointment INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)
+  PARTITION BY RANGE (appointment_date);
@@ -1,9 +1,34 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Text, Date, Time, Numeric, ForeignKey
+from sqlalchemy import Column, Computed, Integer, String, Text, Date, Time, Numeric, ForeignKey
+from sqlalchemy.dialects.postgresql import TSRANGE, TSVECTOR
 
 Base = declarative_base()
 
 
+class Locality(Base):
+    __tablename__ = "locality"
+
+    locality_id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False, unique=True)
+
+    aliases = relationship("LocalityAlias", back_populates="locality")
+
+    def __repr__(self):
+        return f"<Locality id={self.locality_id} {self.name!r}>"
+
+
+class LocalityAlias(Base):
+    __tablename__ = "locality_alias"
+
+    alias_key = Column(String(100), primary_key=True)  # locality_key(name) in SQL
+    locality_id = Column(Integer, ForeignKey("locality.locality_id"), nullable=False)
+
+    locality = relationship("Locality", back_populates="aliases")
+
+    def __repr__(self):
+        return f"<LocalityAlias {self.alias_key!r} -> {self.locality_id}>"
+
+
 class AppUser(Base):
     __tablename__ = "app_user"
 
@@ -12,6 +37,7 @@ class AppUser(Base):
     given_name = Column(String(100))
     surname = Column(String(100))
     city = Column(String(100))
+    locality_id = Column(Integer, ForeignKey("locality.locality_id"))  # set by trigger from city
     phone_number = Column(String(30))
     profile_description = Column(Text)
     password = Column(String(255))
@@ -59,10 +85,11 @@ class Address(Base):
     __tablename__ = "address"
 
     address_id = Column(Integer, primary_key=True)
-    member_user_id = Column(Integer, ForeignKey("member.member_user_id"), nullable=False)
+    member_user_id = Column(Integer, ForeignKey("member.member_user_id"), nullable=False, unique=True)
     house_number = Column(String(30))
     street = Column(String(200))
     town = Column(String(100))
+    locality_id = Column(Integer, ForeignKey("locality.locality_id"))  # set by trigger from town
 
     member = relationship("Member", back_populates="address")
 
@@ -78,6 +105,7 @@ class Job(Base):
     required_caregiving_type = Column(String(20))
     other_requirements = Column(Text)
     date_posted = Column(Date)
+    search_tsv = Column(TSVECTOR, Computed("to_tsvector('english', coalesce(other_requirements, ''))"))
 
     member = relationship("Member", back_populates="jobs")
     applications = relationship("JobApplication", back_populates="job")
@@ -102,14 +130,23 @@ class JobApplication(Base):
 
 class Appointment(Base):
     __tablename__ = "appointment"
+    # partitioned by month (migration 0010, partitions.py); each partition has
+    # its own <partition>_no_overlap exclusion constraint on
+    # (caregiver_user_id WITH =, time_range WITH &&), and a trigger checks
+    # bookings that cross into the next month
+    __table_args__ = {"postgresql_partition_by": "RANGE (appointment_date)"}
 
     appointment_id = Column(Integer, primary_key=True)
     caregiver_user_id = Column(Integer, ForeignKey("caregiver.caregiver_user_id"), nullable=False)
     member_user_id = Column(Integer, ForeignKey("member.member_user_id"), nullable=False)
-    appointment_date = Column(Date)
+    appointment_date = Column(Date, primary_key=True)
     appointment_time = Column(Time)
     work_hours = Column(Numeric(5, 2))
     status = Column(String(20))
+    time_range = Column(TSRANGE, Computed(
+        "CASE WHEN appointment_date IS NOT NULL AND appointment_time IS NOT NULL AND work_hours IS NOT NULL "
+        "THEN tsrange(appointment_date + appointment_time, "
+        "appointment_date + appointment_time + work_hours::float8 * interval '1 hour', '[)') END"))
 
     caregiver = relationship("Caregiver", back_populates="appointments")
     member = relationship("Member", back_populates="appointments")
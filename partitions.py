@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+partitions.py - create and archive the monthly partitions of appointment
+
+appointment is partitioned by month of appointment_date (migration 0010):
+appointment_p2025_01 holds January 2025, and rows for a month without a
+partition go to appointment_default. `ensure` creates the partitions for
+the coming months (and for any month that has rows in appointment_default,
+moving them over); run it daily from cron so bookings never land in the
+default partition to begin with.
+
+`archive` moves whole months out of appointment into archive.appointment,
+so the live table, its indexes and the month-overlap checks only cover the
+months still being booked. A month is archived only when it has ended and
+none of its appointments are still pending; accepted (completed) and
+declined ones are moved as they are. Archived appointments keep counting
+in caregiver_accepted_stats, and deleting a user still removes them.
+
+Each step is a short DDL transaction under lock_timeout: it gives up
+instead of queueing live traffic behind it, and is retried after a pause.
+Before a month is detached, its bounds are added as a CHECK constraint and
+validated (which scans the month but does not block its writes), so the
+ATTACH to archive.appointment can skip its own scan while the DETACH still
+holds ACCESS EXCLUSIVE on appointment; the constraint is dropped again
+once the partition is attached.
+
+    python partitions.py list
+    python partitions.py ensure                    # this month and the next 3
+    python partitions.py ensure --ahead 6
+    python partitions.py archive --before 2025-01 --dry-run
+    python partitions.py archive --before 2025-01  # every month before January 2025
+"""
+
+import argparse
+import re
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from db import make_engine
+
+AHEAD_MONTHS = 3
+LOCK_TIMEOUT = "2s"
+MAX_RETRIES = 5
+PAUSE_SECONDS = 1.0
+PARTITION_RE = re.compile(r"appointment_p(\d{4})_(\d{2})$")
+
+engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+
+PARTITIONS = """
+    SELECT n.nspname AS schema, c.relname AS name,
+           pg_get_expr(c.relpartbound, c.oid) AS bounds,
+           greatest(c.reltuples, 0)::bigint AS estimated_rows,
+           pg_size_pretty(pg_total_relation_size(c.oid)) AS size
+    FROM pg_inherits i
+    JOIN pg_class c     ON c.oid = i.inhrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE i.inhparent IN (to_regclass('public.appointment'), to_regclass('archive.appointment'))
+    ORDER BY n.nspname DESC, c.relname
+"""
+
+DEFAULT_MONTHS = """
+    SELECT DISTINCT date_trunc('month', appointment_date)::date AS month
+    FROM appointment_default
+    ORDER BY 1
+"""
+
+PARTITION_STATUS = """
+    SELECT count(*) AS total, count(*) FILTER (WHERE status = 'pending') AS pending
+    FROM {table}
+"""
+
+
+def month_start(d):
+    return d.replace(day=1)
+
+
+def add_months(d, n):
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def partition_name(month):
+    return f"appointment_p{month:%Y_%m}"
+
+
+def parse_month(value):
+    """argparse type for YYYY-MM."""
+    try:
+        return date.fromisoformat(value + "-01")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a month (YYYY-MM): {value!r}") from None
+
+
+def _is_lock_timeout(e):
+    # 55P03 lock_not_available; 40P01 deadlock_detected (a write that reached the
+    # partition's SHARE lock through appointment while DETACH waits for appointment)
+    return getattr(e.orig, "pgcode", None) in ("55P03", "40P01")
+
+
+def under_lock_timeout(what, work):
+    """Run ``work(conn)`` in one transaction under lock_timeout, retrying on timeout."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT set_config('lock_timeout', :v, true)"), {"v": LOCK_TIMEOUT})
+                return work(conn)
+        except OperationalError as e:
+            if not _is_lock_timeout(e) or attempt == MAX_RETRIES:
+                raise
+            print(f"  {what}: timed out waiting for locks; retrying")
+            time.sleep(PAUSE_SECONDS * 2 ** attempt)
+
+
+def partition_months(conn):
+    """{"public": {month, ...}, "archive": {month, ...}} for the monthly partitions."""
+    months = {"public": set(), "archive": set()}
+    for r in conn.execute(text(PARTITIONS)):
+        m = PARTITION_RE.match(r.name)
+        if m:
+            months[r.schema].add(date(int(m.group(1)), int(m.group(2)), 1))
+    return months
+
+
+# ---------------------------------------------------------------------------
+# Commands
+# ---------------------------------------------------------------------------
+
+def list_partitions():
+    with engine.connect() as conn:
+        rows = conn.execute(text(PARTITIONS)).mappings().all()
+    for r in rows:
+        print(f"{r['schema'] + '.' + r['name']:38} {r['bounds']:60} ~{r['estimated_rows']:>9} rows  {r['size']}")
+
+
+def ensure(ahead):
+    this_month = month_start(date.today())
+    with engine.connect() as conn:
+        months = partition_months(conn)
+        stray = [r.month for r in conn.execute(text(DEFAULT_MONTHS))]
+    wanted = sorted({add_months(this_month, n) for n in range(ahead + 1)} | set(stray))
+    created = 0
+    for month in wanted:
+        if month in months["public"]:
+            continue
+        if month in months["archive"]:
+            print(f"  {partition_name(month)} is archived; {month:%Y-%m} rows stay in appointment_default")
+            continue
+        under_lock_timeout(partition_name(month), lambda conn: conn.execute(
+            text("SELECT appointment_ensure_partition(:m)"), {"m": month}))
+        print(f"  created {partition_name(month)}" + (" (moved rows from appointment_default)"
+                                                       if month in stray else ""))
+        created += 1
+    print(f"{created} partition(s) created.")
+
+
+def bounds_check_name(month):
+    return f"{partition_name(month)}_bounds"
+
+
+def add_bounds_check(month):
+    """Add and validate a CHECK matching ``month``'s partition bounds, unless a valid one exists."""
+    name, check = partition_name(month), bounds_check_name(month)
+    with engine.connect() as conn:
+        validated = conn.execute(text("""
+            SELECT convalidated FROM pg_constraint WHERE conrelid = to_regclass(:t) AND conname = :c
+        """), {"t": name, "c": check}).scalar()
+    if validated is None:
+        # NOT VALID: only a brief lock, no scan
+        under_lock_timeout(name, lambda conn: conn.execute(text(
+            f"ALTER TABLE {name} ADD CONSTRAINT {check} CHECK (appointment_date IS NOT NULL "
+            f"AND appointment_date >= DATE '{month}' AND appointment_date < DATE '{add_months(month, 1)}') "
+            f"NOT VALID")))
+    if not validated:
+        # SHARE UPDATE EXCLUSIVE: the scan runs alongside reads and writes
+        under_lock_timeout(name, lambda conn: conn.execute(text(f"ALTER TABLE {name} VALIDATE CONSTRAINT {check}")))
+
+
+def archive_month(conn, month):
+    """Move ``month``'s partition to archive.appointment; the number of rows, or None if any is pending."""
+    name = partition_name(month)
+    # the pending check scans the month: hold writes to that partition only while it
+    # runs, so the rest of appointment stays readable and writable
+    conn.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+    counts = conn.execute(text(PARTITION_STATUS.format(table=name))).mappings().one()
+    if counts["pending"]:
+        conn.rollback()
+        return None
+    # the lock on appointment itself now only covers catalog changes;
+    # DETACH ... CONCURRENTLY is not allowed while appointment has a default partition
+    conn.execute(text(f"ALTER TABLE appointment DETACH PARTITION {name}"))
+    conn.execute(text(f"ALTER TABLE {name} SET SCHEMA archive"))
+    # the validated bounds check (add_bounds_check) lets ATTACH skip scanning the month
+    conn.execute(text(f"ALTER TABLE archive.appointment ATTACH PARTITION archive.{name} "
+                      f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"))
+    conn.execute(text(f"ALTER TABLE archive.{name} DROP CONSTRAINT {bounds_check_name(month)}"))
+    return counts["total"]
+
+
+def archive(before, dry_run):
+    if before > month_start(date.today()):
+        sys.exit(f"--before {before:%Y-%m}: only months that have ended can be archived")
+    with engine.connect() as conn:
+        candidates = sorted(m for m in partition_months(conn)["public"] if m < before)
+        status = {m: conn.execute(text(PARTITION_STATUS.format(table=partition_name(m)))).mappings().one()
+                  for m in candidates}
+    archived = 0
+    for month in candidates:
+        name, counts = partition_name(month), status[month]
+        if counts["pending"]:
+            print(f"  {name}: {counts['pending']} pending appointment(s); not archived")
+            continue
+        if dry_run:
+            print(f"  {name}: would archive {counts['total']} appointment(s)")
+            continue
+        add_bounds_check(month)
+        moved = under_lock_timeout(name, lambda conn: archive_month(conn, month))
+        if moved is None:
+            print(f"  {name}: an appointment became pending; not archived")
+            continue
+        print(f"  {name}: archived {moved} appointment(s)")
+        archived += 1
+    if not dry_run:
+        print(f"{archived} partition(s) archived.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="live and archived partitions")
+    p = sub.add_parser("ensure", help="create the partitions for this month and the coming ones")
+    p.add_argument("--ahead", type=int, default=AHEAD_MONTHS, help=f"months ahead (default {AHEAD_MONTHS})")
+    p = sub.add_parser("archive", help="move ended months without pending appointments to archive.appointment")
+    p.add_argument("--before", type=parse_month, required=True, metavar="YYYY-MM",
+                   help="archive the months before this one")
+    p.add_argument("--dry-run", action="store_true", help="only show what would be archived")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_partitions()
+    elif args.command == "ensure":
+        ensure(max(args.ahead, 0))
+    else:
+        archive(args.before, args.dry_run)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+profiles.py - member and caregiver profile writes
+
+Every write here is a single INSERT ... ON CONFLICT DO UPDATE, so a profile
+save is one round trip per table and concurrent edits cannot race between a
+"does it exist?" check and the write.
+
+The bulk_* functions take thousands of profiles at once and send one
+multi-row statement per table (rows are passed as arrays and expanded with
+unnest, so the statement text does not grow with the batch):
+
+    python profiles.py members onboarding_members.jsonl
+    python profiles.py caregivers onboarding_caregivers.jsonl
+"""
+
+import json
+import secrets
+import sys
+
+from sqlalchemy import text
+from db import make_engine
+
+BULK_BATCH_SIZE = 5000
+NEW_USER_REQUIRED = ("given_name", "surname")   # NOT NULL columns an update keeps from the existing row
+
+
+def normalize_hourly_rate(raw):
+    if not raw:
+        return None
+    try:
+        return int(round(float(raw) / 100) * 100)
+    except (ValueError, TypeError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Single profile
+# ---------------------------------------------------------------------------
+
+def upsert_member(db, user_id, form):
+    db.execute(text("""
+        INSERT INTO member (member_user_id, house_rules, dependent_description)
+        VALUES (:uid, :hr, :dd)
+        ON CONFLICT (member_user_id) DO UPDATE
+        SET house_rules = EXCLUDED.house_rules,
+            dependent_description = EXCLUDED.dependent_description
+    """), {"uid": user_id, "hr": form.get("house_rules"), "dd": form.get("dependent_description")})
+    _upsert_address(db, user_id, form)
+
+
+def _upsert_address(db, user_id, form):
+    hn, st, tn = form.get("house_number"), form.get("street"), form.get("town")
+    # An existing address is always overwritten; a new one is only created
+    # when at least one field was filled in.
+    db.execute(text("""
+        INSERT INTO address (member_user_id, house_number, street, town)
+        SELECT :uid, :hn, :st, :tn
+        WHERE :has_values OR EXISTS (SELECT 1 FROM address WHERE member_user_id = :uid)
+        ON CONFLICT (member_user_id) DO UPDATE
+        SET house_number = EXCLUDED.house_number,
+            street = EXCLUDED.street,
+            town = EXCLUDED.town
+    """), {"uid": user_id, "hn": hn, "st": st, "tn": tn, "has_values": bool(hn or st or tn)})
+
+
+def upsert_caregiver(db, user_id, form):
+    db.execute(text("""
+        INSERT INTO caregiver (caregiver_user_id, gender, caregiving_type, hourly_rate)
+        VALUES (:uid, :g, :ct, :hr)
+        ON CONFLICT (caregiver_user_id) DO UPDATE
+        SET gender = EXCLUDED.gender,
+            caregiving_type = EXCLUDED.caregiving_type,
+            hourly_rate = EXCLUDED.hourly_rate
+    """), {
+        "uid": user_id,
+        "g": form.get("gender"),
+        "ct": form.get("caregiving_type"),
+        "hr": normalize_hourly_rate(form.get("hourly_rate")),
+    })
+
+
+# ---------------------------------------------------------------------------
+# Bulk
+# ---------------------------------------------------------------------------
+
+def _by_user(profiles, ids):
+    """One row per user id: ON CONFLICT cannot update the same row twice in one statement."""
+    rows = {}
+    for p in profiles:
+        uid = ids.get((p.get("email") or "").strip().lower())
+        if uid is not None:
+            rows[uid] = dict(p, uid=uid)
+    return list(rows.values())
+
+
+def _columns(rows, *names):
+    return {name: [r.get(name) for r in rows] for name in names}
+
+
+def bulk_upsert_users(db, profiles):
+    """Upsert app_user rows keyed by email; return {email: user_id}.
+
+    Existing users keep their password; descriptive fields are only
+    overwritten when the incoming profile provides them. A new user without
+    a password gets a random one nobody knows, so the account cannot be
+    signed into until its password is reset. Profiles that would create a
+    user without given_name or surname are skipped (their email is missing
+    from the result) instead of failing the whole batch.
+    """
+    by_email = {}
+    for p in profiles:
+        email = (p.get("email") or "").strip().lower()
+        if email:
+            by_email[email] = dict(p, email=email, password=p.get("password") or secrets.token_urlsafe(32))
+    incomplete = [e for e, p in by_email.items() if any(not p.get(c) for c in NEW_USER_REQUIRED)]
+    if incomplete:
+        existing = set(db.execute(text("SELECT email FROM app_user WHERE email = ANY(:emails)"),
+                                  {"emails": incomplete}).scalars())
+        for email in incomplete:
+            if email not in existing:
+                del by_email[email]
+    if not by_email:
+        return {}
+    rows = list(by_email.values())
+    result = db.execute(text("""
+        INSERT INTO app_user (email, given_name, surname, city, phone_number, profile_description, password)
+        SELECT * FROM unnest(
+            CAST(:email AS varchar[]), CAST(:given_name AS varchar[]), CAST(:surname AS varchar[]),
+            CAST(:city AS varchar[]), CAST(:phone_number AS varchar[]),
+            CAST(:profile_description AS text[]), CAST(:password AS varchar[]))
+        ON CONFLICT (email) DO UPDATE
+        SET given_name = COALESCE(EXCLUDED.given_name, app_user.given_name),
+            surname = COALESCE(EXCLUDED.surname, app_user.surname),
+            city = COALESCE(EXCLUDED.city, app_user.city),
+            phone_number = COALESCE(EXCLUDED.phone_number, app_user.phone_number),
+            profile_description = COALESCE(EXCLUDED.profile_description, app_user.profile_description)
+        RETURNING email, user_id
+    """), _columns(rows, "email", "given_name", "surname", "city", "phone_number",
+                   "profile_description", "password"))
+    return dict(result.fetchall())
+
+
+def bulk_upsert_members(db, profiles):
+    """Upsert users, members and addresses for ``profiles``: three statements in total.
+
+    Each profile is a dict with the app_user fields (``email`` is the key),
+    ``house_rules``, ``dependent_description`` and optionally
+    ``house_number``, ``street`` and ``town``. Returns {email: user_id}.
+    """
+    ids = bulk_upsert_users(db, profiles)
+    if not ids:
+        return ids
+    rows = _by_user(profiles, ids)
+    db.execute(text("""
+        INSERT INTO member (member_user_id, house_rules, dependent_description)
+        SELECT * FROM unnest(CAST(:uid AS int[]), CAST(:house_rules AS text[]),
+                             CAST(:dependent_description AS text[]))
+        ON CONFLICT (member_user_id) DO UPDATE
+        SET house_rules = EXCLUDED.house_rules,
+            dependent_description = EXCLUDED.dependent_description
+    """), _columns(rows, "uid", "house_rules", "dependent_description"))
+    addresses = [r for r in rows if r.get("house_number") or r.get("street") or r.get("town")]
+    if addresses:
+        db.execute(text("""
+            INSERT INTO address (member_user_id, house_number, street, town)
+            SELECT * FROM unnest(CAST(:uid AS int[]), CAST(:house_number AS varchar[]),
+                                 CAST(:street AS varchar[]), CAST(:town AS varchar[]))
+            ON CONFLICT (member_user_id) DO UPDATE
+            SET house_number = EXCLUDED.house_number,
+                street = EXCLUDED.street,
+                town = EXCLUDED.town
+        """), _columns(addresses, "uid", "house_number", "street", "town"))
+    return ids
+
+
+def bulk_upsert_caregivers(db, profiles):
+    """Upsert users and caregivers for ``profiles``: two statements in total.
+
+    Each profile is a dict with the app_user fields (``email`` is the key),
+    ``gender``, ``caregiving_type`` and ``hourly_rate``. Returns {email: user_id}.
+    """
+    ids = bulk_upsert_users(db, profiles)
+    if not ids:
+        return ids
+    rows = [dict(r, hourly_rate=normalize_hourly_rate(r.get("hourly_rate"))) for r in _by_user(profiles, ids)]
+    db.execute(text("""
+        INSERT INTO caregiver (caregiver_user_id, gender, caregiving_type, hourly_rate)
+        SELECT * FROM unnest(CAST(:uid AS int[]), CAST(:gender AS varchar[]),
+                             CAST(:caregiving_type AS varchar[]), CAST(:hourly_rate AS int[]))
+        ON CONFLICT (caregiver_user_id) DO UPDATE
+        SET gender = EXCLUDED.gender,
+            caregiving_type = EXCLUDED.caregiving_type,
+            hourly_rate = EXCLUDED.hourly_rate
+    """), _columns(rows, "uid", "gender", "caregiving_type", "hourly_rate"))
+    return ids
+
+
+def _read_batches(path, size):
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) == size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def main(kind, path):
+    upsert = {"members": bulk_upsert_members, "caregivers": bulk_upsert_caregivers}[kind]
+    engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+    total = skipped = 0
+    for batch in _read_batches(path, BULK_BATCH_SIZE):
+        with engine.begin() as conn:
+            ids = upsert(conn, batch)
+        total += len(ids)
+        skipped += sum(1 for p in batch if (p.get("email") or "").strip().lower() not in ids)
+        print(f"{kind}: {total} profiles upserted, {skipped} skipped (no email, or a new user "
+              f"without {' / '.join(NEW_USER_REQUIRED)})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("members", "caregivers"):
+        sys.exit(f"usage: {sys.argv[0]} members|caregivers FILE.jsonl")
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+purge.py - delete many user accounts in small, throttled batches
+
+Every user row is deleted with everything hanging off it (caregiver /
+member profile, address, jobs, applications, appointments) through the
+ON DELETE CASCADE foreign keys, BATCH_SIZE users per transaction. Each
+batch sets a short lock_timeout, so it gives up instead of queueing behind
+(and in front of) live traffic; a batch that times out is retried at half
+the size after a pause. Between batches the tool sleeps, so the database
+spends most of its time serving the site.
+
+Ids are processed in ascending order and the last finished id is written
+to the checkpoint file after every batch; re-running the same command
+continues where it stopped.
+
+Batches are sized in users, but one account can own hundreds of thousands
+of rows. Accounts with HEAVY_ROWS or more dependent rows are drained first:
+their appointments (archived ones included), applications and jobs are
+deleted DRAIN_CHUNK rows per transaction, under the same timeouts and
+retries, and only then is the emptied account deleted with its batch.
+
+    python purge.py ids.txt                     # one user_id per line
+    python purge.py ids.txt --batch-size 100 --pause 1.0
+    python purge.py ids.txt --dry-run           # count what would go
+    python purge.py ids.txt --restart           # ignore the checkpoint
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from db import make_engine
+
+BATCH_SIZE = 200
+PAUSE_SECONDS = 0.5
+LOCK_TIMEOUT = "2s"
+STATEMENT_TIMEOUT = "30s"
+MAX_RETRIES = 5
+HEAVY_ROWS = 10_000     # dependent rows that make an account drained separately
+DRAIN_CHUNK = 5_000     # rows per drain transaction
+
+engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+
+DELETE_USERS = """
+    DELETE FROM app_user WHERE user_id = ANY(:ids) RETURNING user_id
+"""
+
+# dependent rows per user, each count capped at :cap so a huge account costs
+# no more than a light one to classify
+DEPENDENTS = """
+    SELECT u.id AS user_id,
+           (SELECT count(*) FROM (SELECT 1 FROM appointment WHERE caregiver_user_id = u.id UNION ALL
+                                  SELECT 1 FROM archive.appointment WHERE caregiver_user_id = u.id LIMIT :cap) x)
+         + (SELECT count(*) FROM (SELECT 1 FROM appointment WHERE member_user_id = u.id UNION ALL
+                                  SELECT 1 FROM archive.appointment WHERE member_user_id = u.id LIMIT :cap) x)
+         + (SELECT count(*) FROM (SELECT 1 FROM job_application WHERE caregiver_user_id = u.id LIMIT :cap) x)
+         + (SELECT count(*) FROM (SELECT 1 FROM job_application ja JOIN job j ON j.job_id = ja.job_id
+                                  WHERE j.member_user_id = u.id LIMIT :cap) x)
+         + (SELECT count(*) FROM (SELECT 1 FROM job WHERE member_user_id = u.id LIMIT :cap) x) AS rows
+    FROM unnest(CAST(:ids AS int[])) AS u(id)
+"""
+
+# one heavy account, emptied in order (applications before the jobs they
+# cascade from), at most :n rows per statement
+DRAIN_STEPS = [
+    ("appointments", """
+        DELETE FROM appointment WHERE appointment_id IN (
+            SELECT appointment_id FROM appointment WHERE caregiver_user_id = :uid LIMIT :n)
+    """),
+    ("appointments", """
+        DELETE FROM appointment WHERE appointment_id IN (
+            SELECT appointment_id FROM appointment WHERE member_user_id = :uid LIMIT :n)
+    """),
+    # detached partitions keep their foreign keys, so archived months cascade too
+    ("archived appointments", """
+        DELETE FROM archive.appointment WHERE appointment_id IN (
+            SELECT appointment_id FROM archive.appointment WHERE caregiver_user_id = :uid LIMIT :n)
+    """),
+    ("archived appointments", """
+        DELETE FROM archive.appointment WHERE appointment_id IN (
+            SELECT appointment_id FROM archive.appointment WHERE member_user_id = :uid LIMIT :n)
+    """),
+    ("applications", """
+        DELETE FROM job_application WHERE (caregiver_user_id, job_id) IN (
+            SELECT caregiver_user_id, job_id FROM job_application WHERE caregiver_user_id = :uid LIMIT :n)
+    """),
+    ("applications", """
+        DELETE FROM job_application WHERE (caregiver_user_id, job_id) IN (
+            SELECT ja.caregiver_user_id, ja.job_id FROM job_application ja JOIN job j ON j.job_id = ja.job_id
+            WHERE j.member_user_id = :uid LIMIT :n)
+    """),
+    ("jobs", """
+        DELETE FROM job WHERE job_id IN (SELECT job_id FROM job WHERE member_user_id = :uid LIMIT :n)
+    """),
+]
+
+# what a batch would remove, for --dry-run
+COUNT_CASCADE = """
+    SELECT (SELECT count(*) FROM app_user WHERE user_id = ANY(:ids)) AS users,
+           (SELECT count(*) FROM job WHERE member_user_id = ANY(:ids)) AS jobs,
+           (SELECT count(*) FROM job_application
+             WHERE caregiver_user_id = ANY(:ids)
+                OR job_id IN (SELECT job_id FROM job WHERE member_user_id = ANY(:ids))) AS applications,
+           (SELECT count(*) FROM appointment
+             WHERE caregiver_user_id = ANY(:ids) OR member_user_id = ANY(:ids)) AS appointments
+"""
+
+
+def read_ids(path):
+    ids = set()
+    for n, line in enumerate(Path(path).read_text().splitlines(), 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            ids.add(int(line))
+        except ValueError:
+            sys.exit(f"{path}:{n}: not a user id: {line!r}")
+    return sorted(ids)
+
+
+class Checkpoint:
+    def __init__(self, path, source):
+        self.path = Path(path)
+        self.source = str(Path(source).resolve())
+        self.done_through = None
+        self.deleted = 0
+
+    def load(self):
+        if not self.path.exists():
+            return
+        state = json.loads(self.path.read_text())
+        if state.get("source") != self.source:
+            sys.exit(f"{self.path} belongs to {state.get('source')}; use --checkpoint or --restart")
+        self.done_through = state["done_through"]
+        self.deleted = state["deleted"]
+
+    def save(self, done_through, deleted):
+        self.done_through, self.deleted = done_through, deleted
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"source": self.source, "done_through": done_through, "deleted": deleted}))
+        tmp.replace(self.path)
+
+
+def _short_transaction(conn):
+    conn.execute(text("SELECT set_config('lock_timeout', :v, true)"), {"v": LOCK_TIMEOUT})
+    conn.execute(text("SELECT set_config('statement_timeout', :v, true)"), {"v": STATEMENT_TIMEOUT})
+
+
+def delete_batch(ids):
+    """Delete ``ids`` in one short transaction; return how many users existed."""
+    with engine.begin() as conn:
+        _short_transaction(conn)
+        return len(conn.execute(text(DELETE_USERS), {"ids": ids}).fetchall())
+
+
+def _is_timeout(e):
+    # 55P03 lock_not_available, 57014 query_canceled (statement_timeout)
+    return getattr(e.orig, "pgcode", None) in ("55P03", "57014")
+
+
+def heavy_users(ids):
+    """The users in ``ids`` with HEAVY_ROWS or more dependent rows."""
+    with engine.connect() as conn:
+        rows = conn.execute(text(DEPENDENTS), {"ids": ids, "cap": HEAVY_ROWS}).fetchall()
+    return [r.user_id for r in rows if r.rows >= HEAVY_ROWS]
+
+
+def drain_user(uid, pause):
+    """Delete a heavy account's dependent rows DRAIN_CHUNK at a time, so the user row goes quickly."""
+    removed = {}
+    for what, sql in DRAIN_STEPS:
+        retries = 0
+        while True:
+            try:
+                with engine.begin() as conn:
+                    _short_transaction(conn)
+                    n = conn.execute(text(sql), {"uid": uid, "n": DRAIN_CHUNK}).rowcount
+            except OperationalError as e:
+                if not _is_timeout(e) or retries >= MAX_RETRIES:
+                    raise
+                retries += 1
+                time.sleep(pause * 2 ** retries)
+                continue
+            retries = 0
+            removed[what] = removed.get(what, 0) + n
+            if n < DRAIN_CHUNK:
+                break
+            time.sleep(pause)
+    print(f"  user_id {uid} drained: " + ", ".join(f"{n} {what}" for what, n in removed.items()))
+
+
+def purge(ids, checkpoint, batch_size, pause):
+    pending = [i for i in ids if checkpoint.done_through is None or i > checkpoint.done_through]
+    total = len(ids)
+    done = total - len(pending)
+    deleted = checkpoint.deleted
+    if done:
+        print(f"Resuming after user_id {checkpoint.done_through}: {done}/{total} already processed.")
+    started = time.monotonic()
+    processed = 0
+    size = batch_size
+    retries = 0
+    while pending:
+        batch = pending[:size]
+        for uid in heavy_users(batch):
+            drain_user(uid, pause)
+        t0 = time.monotonic()
+        try:
+            n = delete_batch(batch)
+        except OperationalError as e:
+            if not _is_timeout(e) or retries >= MAX_RETRIES:
+                raise
+            retries += 1
+            size = max(size // 2, 1)
+            print(f"  batch timed out waiting for locks; retrying with {size} users")
+            time.sleep(pause * 2 ** retries)
+            continue
+        retries = 0
+        elapsed = time.monotonic() - t0
+        pending = pending[len(batch):]
+        processed += len(batch)
+        deleted += n
+        checkpoint.save(batch[-1], deleted)
+        rate = processed / (time.monotonic() - started)
+        eta = len(pending) / rate if rate else 0
+        print(f"  {total - len(pending)}/{total} processed, {deleted} deleted "
+              f"(batch {len(batch)} in {elapsed * 1000:.0f} ms, {rate:.0f} users/s, ETA {eta:.0f}s)")
+        if size < batch_size:   # recovered: grow back towards the requested size
+            size = min(size * 2, batch_size)
+        if pending:
+            time.sleep(pause)
+    print(f"Done: {deleted} users deleted.")
+
+
+def dry_run(ids, batch_size):
+    totals = {}
+    with engine.connect() as conn:
+        for start in range(0, len(ids), batch_size):
+            row = conn.execute(text(COUNT_CASCADE), {"ids": ids[start:start + batch_size]}).mappings().one()
+            for k, v in row.items():
+                totals[k] = totals.get(k, 0) + v
+    print("Would delete: " + ", ".join(f"{v} {k}" for k, v in totals.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("ids_file", help="file with one user_id per line ('#' starts a comment)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=PAUSE_SECONDS, help="seconds to sleep between batches")
+    parser.add_argument("--checkpoint", help="progress file (default: IDS_FILE.checkpoint)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be deleted")
+    args = parser.parse_args()
+
+    user_ids = read_ids(args.ids_file)
+    if args.dry_run:
+        dry_run(user_ids, args.batch_size)
+        sys.exit(0)
+    cp = Checkpoint(args.checkpoint or args.ids_file + ".checkpoint", args.ids_file)
+    if not args.restart:
+        cp.load()
+    purge(user_ids, cp, max(args.batch_size, 1), args.pause)
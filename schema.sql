@@ -1,3 +1,6 @@
+-- EXTENSIONS
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- USERS
 CREATE TABLE app_user (
   user_id           SERIAL PRIMARY KEY,
@@ -25,6 +28,9 @@ CREATE TABLE member (
   dependent_description TEXT
 );
 
+-- substring matches on house rules (ILIKE '%...%') go through a trigram index
+CREATE INDEX member_house_rules_trgm_idx ON member USING GIN (house_rules gin_trgm_ops);
+
 -- ADDRESS
 CREATE TABLE address (
   address_id     SERIAL PRIMARY KEY,
@@ -40,9 +46,14 @@ CREATE TABLE job (
   member_user_id          INT REFERENCES member(member_user_id) ON DELETE CASCADE,
   required_caregiving_type VARCHAR(20) CHECK (required_caregiving_type IN ('babysitter', 'elderly', 'playmate')),
   other_requirements      TEXT,
-  date_posted             DATE DEFAULT CURRENT_DATE
+  date_posted             DATE DEFAULT CURRENT_DATE,
+  search_tsv              TSVECTOR GENERATED ALWAYS AS
+                            (to_tsvector('english', coalesce(other_requirements, ''))) STORED
 );
 
+CREATE INDEX job_search_tsv_idx ON job USING GIN (search_tsv);
+CREATE INDEX job_other_requirements_trgm_idx ON job USING GIN (other_requirements gin_trgm_ops);
+
 -- JOB APPLICATIONS
 CREATE TABLE job_application (
   caregiver_user_id INT REFERENCES caregiver(caregiver_user_id) ON DELETE CASCADE,
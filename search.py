@@ -0,0 +1,60 @@
+"""
+search.py - full-text search over job requirements
+
+Jobs carry a generated ``search_tsv`` column (see schema.sql) backed by a GIN
+index, so matching is an index lookup instead of a sequential ILIKE scan.
+Only the top ``limit`` hits are ranked into headlines; ``ts_headline`` is the
+expensive part and must never run over the whole match set.
+"""
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+SEARCH_LIMIT = 50
+
+# ts_headline returns the raw requirements text, which is user input. It is
+# marked with sentinels that cannot appear in a form post, escaped, and only
+# then are the sentinels turned into <mark> tags.
+_START, _STOP = "\x02", "\x03"
+
+JOB_SEARCH_SQL = """
+    WITH q AS (
+        SELECT websearch_to_tsquery('english', :q) AS query
+    ),
+    hits AS (
+        SELECT j.job_id, ts_rank_cd(j.search_tsv, q.query) AS rank
+        FROM job j, q
+        WHERE j.search_tsv @@ q.query
+          {type_filter}
+        ORDER BY rank DESC, j.job_id
+        LIMIT :limit
+    )
+    SELECT j.job_id, j.member_user_id, j.required_caregiving_type, j.other_requirements,
+           j.date_posted, u.given_name || ' ' || u.surname AS member_name, hits.rank,
+           ts_headline('english', coalesce(j.other_requirements, ''), q.query,
+                       'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxFragments=2') AS headline
+    FROM hits
+    JOIN job j ON j.job_id = hits.job_id
+    CROSS JOIN q
+    LEFT JOIN app_user u ON u.user_id = j.member_user_id
+    ORDER BY hits.rank DESC, j.job_id
+"""
+
+
+def highlight(headline):
+    """Escape a ts_headline fragment and wrap the matched terms in <mark>."""
+    return Markup(str(escape(headline or "")).replace(_START, "<mark>").replace(_STOP, "</mark>"))
+
+
+def search_jobs(db, q, caregiving_type=None, limit=SEARCH_LIMIT):
+    """Return the best ``limit`` jobs matching the web-style query ``q``, best first."""
+    q = (q or "").strip()
+    if not q:
+        return []
+    params = {"q": q, "limit": limit}
+    type_filter = ""
+    if caregiving_type:
+        type_filter = "AND j.required_caregiving_type = :rct"
+        params["rct"] = caregiving_type
+    rows = db.execute(text(JOB_SEARCH_SQL.format(type_filter=type_filter)), params).mappings()
+    return [dict(r, headline=highlight(r["headline"])) for r in rows]
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+tasks.py - durable background tasks stored in Postgres
+
+Request handlers call enqueue(db, kind, **payload) before they commit, so a
+task is saved together with the write it follows (or not at all), and the
+work itself - mail, notices - runs later in a worker, outside the request.
+
+Each kind is a function registered with @task(kind, limit=, max_attempts=,
+timeout=). A worker claims ready tasks with FOR UPDATE SKIP LOCKED and
+holds a lease of ``timeout`` seconds on each; a task that raises is retried
+with exponential backoff, and marked failed after max_attempts. ``limit``
+caps how many tasks of a kind run at once across all workers (claims of one
+kind are serialized by an advisory lock). Delivery is at least once: a task
+whose worker died, or that outlived its lease, runs again, so handlers must
+tolerate repeats. A task whose lease runs out on its last attempt (it hung,
+or killed its worker) is marked failed rather than claimed again.
+
+``timeout`` is a lease, not a kill switch: a running Python thread cannot
+be stopped, so a handler that outlives it keeps running while a second copy
+may start (its result is then ignored, see MARK_DONE). The handler's
+transaction gets statement_timeout = ``timeout``, and anything else slow in
+a handler must have its own, shorter timeout (send_mail uses SMTP_TIMEOUT,
+below the default lease).
+
+Workers LISTEN on the task_queue channel and so pick up new tasks as soon
+as they are committed; they also poll every POLL_SECONDS.
+
+    python tasks.py work [--processes 2] [--threads 4]
+    python tasks.py stats                  # queue depth and age per kind
+    python tasks.py retry [KIND]           # re-queue failed tasks
+    python tasks.py prune [--days 7]       # delete finished tasks
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import random
+import select
+import signal
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import config
+from db import make_engine
+
+CHANNEL = "task_queue"
+POLL_SECONDS = 5
+BACKOFF_BASE = 10      # seconds before the first retry; doubles with every attempt
+BACKOFF_MAX = 3600
+SMTP_TIMEOUT = 30      # seconds; below every kind's timeout (the lease)
+
+log = logging.getLogger("tasks")
+
+
+class Kind:
+    def __init__(self, name, fn, limit, max_attempts, timeout):
+        self.name = name
+        self.fn = fn
+        self.limit = limit
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+
+KINDS = {}
+
+
+def task(name, limit=4, max_attempts=5, timeout=60):
+    """Register ``fn(conn, payload)`` as the handler for tasks of kind ``name``.
+
+    ``timeout`` is the lease in seconds (see the module docstring): keep it
+    above the slowest thing the handler waits on.
+    """
+    def decorator(fn):
+        KINDS[name] = Kind(name, fn, limit, max_attempts, timeout)
+        return fn
+    return decorator
+
+
+# ---------------------------------------------------------------------------
+# Enqueueing (request side)
+# ---------------------------------------------------------------------------
+
+ENQUEUE = """
+    INSERT INTO task (kind, payload, max_attempts, run_after)
+    SELECT :kind, p, :max_attempts, now() + make_interval(secs => :delay)
+    FROM unnest(CAST(:payloads AS jsonb[])) AS p
+"""
+
+
+def enqueue_many(db, kind, payloads, delay=0):
+    """Queue a ``kind`` task per payload dict in ``db``'s transaction; they exist once it commits."""
+    if kind not in KINDS:
+        raise KeyError(f"unknown task kind: {kind}")
+    if not payloads:
+        return
+    db.execute(text(ENQUEUE), {"kind": kind, "payloads": [json.dumps(p) for p in payloads],
+                               "max_attempts": KINDS[kind].max_attempts, "delay": delay})
+    # delivered at commit, like the rows themselves
+    db.execute(text("SELECT pg_notify(:channel, :kind)"), {"channel": CHANNEL, "kind": kind})
+
+
+def enqueue(db, kind, delay=0, **payload):
+    enqueue_many(db, kind, [payload], delay=delay)
+
+
+# ---------------------------------------------------------------------------
+# Claiming and finishing (worker side)
+# ---------------------------------------------------------------------------
+
+# run in the claim transaction first: an expired lease on the last attempt
+# means the task hung or took its worker down, and will not get another run
+EXPIRE_EXHAUSTED = """
+    UPDATE task
+    SET status = 'failed', finished_at = now(), locked_until = NULL,
+        last_error = 'lease expired on the last attempt (the task hung or its worker died)'
+    WHERE kind = :kind AND status = 'running' AND locked_until <= now() AND attempts >= max_attempts
+"""
+
+CLAIM = """
+    WITH running AS (
+        SELECT count(*) AS n FROM task
+        WHERE kind = :kind AND status = 'running' AND locked_until > now()
+    ), picked AS (
+        SELECT task_id FROM task
+        WHERE kind = :kind
+          AND ((status = 'queued' AND run_after <= now())
+               OR (status = 'running' AND locked_until <= now()     -- lease expired: worker gone
+                   AND attempts < max_attempts))
+        ORDER BY run_after, task_id
+        LIMIT GREATEST(LEAST(:n, :limit - (SELECT n FROM running)), 0)
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE task t
+    SET status = 'running', attempts = t.attempts + 1,
+        locked_until = now() + make_interval(secs => :timeout)
+    FROM picked
+    WHERE t.task_id = picked.task_id
+    RETURNING t.task_id, t.payload, t.attempts
+"""
+
+# the attempts check ignores a result whose lease expired and was claimed again
+MARK_DONE = """
+    UPDATE task SET status = 'done', finished_at = now(), locked_until = NULL
+    WHERE task_id = :task_id AND attempts = :attempts AND status = 'running'
+"""
+
+MARK_FAILED = """
+    UPDATE task
+    SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+        run_after = now() + make_interval(secs => :delay),
+        locked_until = NULL,
+        last_error = :error
+    WHERE task_id = :task_id AND attempts = :attempts AND status = 'running'
+    RETURNING status
+"""
+
+
+def backoff(attempts):
+    """Seconds before retry number ``attempts``, with jitter so failures do not retry in lockstep."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+
+
+class Worker:
+    """Claims tasks into a pool of ``threads`` threads until stop() is called."""
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.engine = make_engine(pool_size=threads + 2, max_overflow=0, statement_timeout_ms=0)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="task")
+        self.busy = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+
+    def stop(self, *_):
+        self.stopping.set()
+        self.wake.set()
+
+    def run(self):
+        threading.Thread(target=self.listen, name="task-listen", daemon=True).start()
+        log.info("worker started with %d threads", self.threads)
+        while not self.stopping.is_set():
+            if not self.claim_round():
+                self.wake.wait(POLL_SECONDS)
+                self.wake.clear()
+        self.executor.shutdown(wait=True)
+        log.info("worker stopped")
+
+    def claim_round(self):
+        claimed = 0
+        kinds = list(KINDS.values())
+        random.shuffle(kinds)   # no kind gets first pick of the free threads every time
+        for kind in kinds:
+            with self.lock:
+                free = self.threads - self.busy
+            if free <= 0:
+                break
+            with self.engine.begin() as conn:
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"task:{kind.name}"})
+                expired = conn.execute(text(EXPIRE_EXHAUSTED), {"kind": kind.name}).rowcount
+                if expired:
+                    log.warning("%s: %d task(s) failed after their last lease expired", kind.name, expired)
+                rows = conn.execute(text(CLAIM), {"kind": kind.name, "n": free, "limit": kind.limit,
+                                                  "timeout": kind.timeout}).all()
+            with self.lock:
+                self.busy += len(rows)
+            for row in rows:
+                self.executor.submit(self.execute, kind, row)
+            claimed += len(rows)
+        return claimed
+
+    def execute(self, kind, row):
+        started = time.monotonic()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("SELECT set_config('statement_timeout', :v, true)"),
+                             {"v": f"{int(kind.timeout * 1000)}ms"})
+                kind.fn(conn, row.payload)
+            with self.engine.begin() as conn:
+                conn.execute(text(MARK_DONE), {"task_id": row.task_id, "attempts": row.attempts})
+            log.info("%s #%d done in %.0f ms", kind.name, row.task_id, (time.monotonic() - started) * 1000)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            try:
+                with self.engine.begin() as conn:
+                    status = conn.execute(text(MARK_FAILED), {
+                        "task_id": row.task_id, "attempts": row.attempts,
+                        "delay": backoff(row.attempts), "error": error[:2000],
+                    }).scalar()
+                log.warning("%s #%d attempt %d failed (%s): %s", kind.name, row.task_id, row.attempts,
+                            "giving up" if status == "failed" else "will retry", error)
+            except SQLAlchemyError:
+                # the lease runs out and the task is claimed again
+                log.exception("%s #%d: could not record failure", kind.name, row.task_id)
+        finally:
+            with self.lock:
+                self.busy -= 1
+            self.wake.set()
+
+    def listen(self):
+        while not self.stopping.is_set():
+            try:
+                raw = self.engine.raw_connection()
+                try:
+                    conn = raw.driver_connection
+                    conn.autocommit = True
+                    conn.cursor().execute(f"LISTEN {CHANNEL}")
+                    while not self.stopping.is_set():
+                        if select.select([conn], [], [], POLL_SECONDS) != ([], [], []):
+                            conn.poll()
+                            if conn.notifies:
+                                conn.notifies.clear()
+                                self.wake.set()
+                finally:
+                    raw.invalidate()
+            except Exception as e:
+                # polling still picks tasks up meanwhile
+                log.warning("task listener: %s", str(e).strip().splitlines()[0])
+                time.sleep(POLL_SECONDS)
+
+
+def _work(threads):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(name)s %(message)s")
+    worker = Worker(threads)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+def work(processes, threads):
+    if processes == 1:
+        _work(threads)
+        return
+    procs = [multiprocessing.Process(target=_work, args=(threads,), name=f"tasks-{n}") for n in range(processes)]
+    for p in procs:
+        p.start()
+
+    def forward(signum, _frame):
+        for p in procs:
+            if p.is_alive():
+                p.terminate()   # SIGTERM: each finishes its running tasks, then exits
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the children get the terminal's SIGINT themselves
+    for p in procs:
+        p.join()
+
+
+# ---------------------------------------------------------------------------
+# Inspection
+# ---------------------------------------------------------------------------
+
+STATS = """
+    SELECT kind,
+           count(*) FILTER (WHERE status = 'queued' AND run_after <= now()) AS ready,
+           count(*) FILTER (WHERE status = 'queued' AND run_after > now()) AS waiting_retry,
+           count(*) FILTER (WHERE status = 'running') AS running,
+           count(*) FILTER (WHERE status = 'failed') AS failed,
+           count(*) FILTER (WHERE status = 'done') AS done,
+           extract(epoch FROM now() - min(run_after) FILTER (WHERE status = 'queued' AND run_after <= now()))
+               AS oldest_ready_s
+    FROM task
+    GROUP BY kind
+    ORDER BY kind
+"""
+
+
+def stats(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(text(STATS)).mappings().all()
+    columns = ("kind", "ready", "waiting_retry", "running", "failed", "done", "oldest_ready_s")
+    widths = [max(len(c), 12) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        age = r["oldest_ready_s"]
+        values = [r[c] for c in columns[:-1]] + ["-" if age is None else f"{age:.1f}"]
+        print("  ".join(str(v).ljust(w) for v, w in zip(values, widths)))
+    if not rows:
+        print("(no tasks)")
+
+
+def retry_failed(engine, kind=None):
+    with engine.begin() as conn:
+        n = conn.execute(text("""
+            UPDATE task SET status = 'queued', attempts = 0, run_after = now(), finished_at = NULL
+            WHERE status = 'failed' AND (CAST(:kind AS VARCHAR) IS NULL OR kind = :kind)
+        """), {"kind": kind}).rowcount
+        conn.execute(text("SELECT pg_notify(:channel, '')"), {"channel": CHANNEL})
+    print(f"{n} failed task(s) re-queued.")
+
+
+def prune(engine, days):
+    with engine.begin() as conn:
+        n = conn.execute(text("""
+            DELETE FROM task
+            WHERE status IN ('done', 'failed') AND finished_at < now() - make_interval(days => :days)
+        """), {"days": days}).rowcount
+    print(f"{n} finished task(s) deleted.")
+
+
+# ---------------------------------------------------------------------------
+# Mail and task kinds
+# ---------------------------------------------------------------------------
+
+def send_mail(to, subject, body):
+    if not config.SMTP_HOST:
+        log.info("mail to %s: %s", to, subject)
+        return
+    msg = EmailMessage()
+    msg["From"] = config.MAIL_FROM
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.set_content(body)
+    with smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT, timeout=SMTP_TIMEOUT) as smtp:
+        smtp.send_message(msg)
+
+
+@task("caregiver_welcome")
+def caregiver_welcome(conn, payload):
+    user = conn.execute(text("SELECT email, given_name FROM app_user WHERE user_id = :uid"),
+                        {"uid": payload["user_id"]}).first()
+    if user is None:   # account deleted since
+        return
+    send_mail(user.email, "Welcome to the care platform",
+              f"Hello {user.given_name},\n\nyour caregiver profile is live. Members can now find you, "
+              "and you can apply to their jobs from the Jobs page.\n")
+
+
+@task("application_received")
+def application_received(conn, payload):
+    row = conn.execute(text("""
+        SELECT m.email, m.given_name, j.required_caregiving_type,
+               c.given_name || ' ' || c.surname AS caregiver_name
+        FROM job_application ja
+        JOIN job j ON j.job_id = ja.job_id
+        JOIN app_user m ON m.user_id = j.member_user_id
+        JOIN app_user c ON c.user_id = ja.caregiver_user_id
+        WHERE ja.job_id = :jid AND ja.caregiver_user_id = :cid
+    """), {"jid": payload["job_id"], "cid": payload["caregiver_user_id"]}).first()
+    if row is None:   # withdrawn, or the job was deleted
+        return
+    send_mail(row.email, f"New application for your {row.required_caregiving_type} job",
+              f"Hello {row.given_name},\n\n{row.caregiver_name} applied to job #{payload['job_id']}. "
+              "See all applications on the Applications page.\n")
+
+
+APPOINTMENT = """
+    SELECT a.appointment_date, a.appointment_time, a.work_hours, a.status,
+           c.email AS caregiver_email, c.given_name AS caregiver_given_name,
+           c.given_name || ' ' || c.surname AS caregiver_name,
+           m.email AS member_email, m.given_name AS member_given_name,
+           m.given_name || ' ' || m.surname AS member_name
+    FROM appointment a
+    JOIN app_user c ON c.user_id = a.caregiver_user_id
+    JOIN app_user m ON m.user_id = a.member_user_id
+    WHERE a.appointment_id = :aid
+"""
+
+
+@task("appointment_requested")
+def appointment_requested(conn, payload):
+    a = conn.execute(text(APPOINTMENT), {"aid": payload["appointment_id"]}).first()
+    if a is None or a.status != "pending":   # cancelled or already answered
+        return
+    send_mail(a.caregiver_email, "New appointment request",
+              f"Hello {a.caregiver_given_name},\n\n{a.member_name} asked to book you on {a.appointment_date} "
+              f"at {a.appointment_time} for {a.work_hours} hour(s). Accept or decline it on the "
+              "Appointments page.\n")
+
+
+@task("appointment_confirmation")
+def appointment_confirmation(conn, payload):
+    a = conn.execute(text(APPOINTMENT), {"aid": payload["appointment_id"]}).first()
+    if a is None:
+        return
+    send_mail(a.member_email, "Your appointment request was sent",
+              f"Hello {a.member_given_name},\n\nyour request to book {a.caregiver_name} on {a.appointment_date} "
+              f"at {a.appointment_time} for {a.work_hours} hour(s) was sent. You will see their answer "
+              "on the Appointments page.\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("work", help="run workers until SIGTERM / Ctrl-C")
+    p.add_argument("--processes", type=int, default=2)
+    p.add_argument("--threads", type=int, default=4, help="tasks run at once per process")
+    sub.add_parser("stats", help="queue depth per kind")
+    p = sub.add_parser("retry", help="re-queue failed tasks")
+    p.add_argument("kind", nargs="?", choices=sorted(KINDS))
+    p = sub.add_parser("prune", help="delete finished tasks")
+    p.add_argument("--days", type=int, default=7, help="keep tasks finished in the last DAYS days")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        work(max(args.processes, 1), max(args.threads, 1))
+    else:
+        engine = make_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
+        if args.command == "stats":
+            stats(engine)
+        elif args.command == "retry":
+            retry_failed(engine, args.kind)
+        else:
+            prune(engine, args.days)
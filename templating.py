@@ -0,0 +1,58 @@
+"""
+templating.py - template bytecode cache and build step
+
+Jinja compiles a template to Python on first use, which is what makes the
+first requests of a fresh worker slow. The app's environments keep the
+compiled code in TEMPLATE_CACHE_DIR (a FileSystemBytecodeCache), and
+create_app(warm=True) loads every template up front, so a worker starts with
+all templates compiled, from the cache when it is warm. Each cache entry carries a
+checksum of its source, so an edited template is recompiled, never served
+stale.
+
+The sync (Flask) and async (asgi.py) environments compile the same source
+to different code, so they use different file names in the same directory.
+
+    python templating.py            # (re)build the cache, e.g. during deploy
+    python templating.py --clear    # drop cached code first
+"""
+
+import argparse
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+import config
+
+SYNC_PATTERN = "__jinja2_%s.cache"
+ASYNC_PATTERN = "__jinja2_async_%s.cache"
+
+
+def bytecode_cache(async_mode=False):
+    os.makedirs(config.TEMPLATE_CACHE_DIR, exist_ok=True)
+    return FileSystemBytecodeCache(config.TEMPLATE_CACHE_DIR, ASYNC_PATTERN if async_mode else SYNC_PATTERN)
+
+
+def load_all(env):
+    """Compile (or load from the bytecode cache) every .html template into ``env``; return their names."""
+    names = env.list_templates(extensions=("html",))
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clear", action="store_true", help="remove cached bytecode before building")
+    args = parser.parse_args()
+
+    if args.clear:
+        bytecode_cache().clear()
+        bytecode_cache(async_mode=True).clear()
+    started = time.perf_counter()
+    from app import create_app
+    from asgi import templates      # importing compiles the async templates
+    names = load_all(create_app().jinja_env)
+    load_all(templates)
+    print(f"{len(names)} templates compiled into {config.TEMPLATE_CACHE_DIR} "
+          f"in {(time.perf_counter() - started) * 1000:.0f} ms")